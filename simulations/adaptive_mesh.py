@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+
+# Adaptive quadtree (2D) / octree (3D) sampling of the potential
+# Cells are only refined where the potential is curved, so the flat regions far away from the beams cost almost no evaluations
+
+import itertools
+import numpy as np
+from typing import Callable, List, Sequence, Tuple, Union
+
+from dipoletrapli import TrapConfiguration
+
+class AdaptiveMesh():
+    def __init__(self,
+            function: Callable[[np.ndarray], np.ndarray],
+            lower: Sequence[float],
+            upper: Sequence[float],
+            base_cells: Union[int, Sequence[int]] = 16,
+            max_level: int = 8,
+            atol: float = 0,
+            rtol: float = 1e-3,
+            max_variation: Union[float, None] = None,
+            verbose: bool = True
+        ) -> None:
+        """Samples a function on an adaptively refined quadtree (2D) or octree (3D).
+
+        The domain is split into base_cells cells per axis. A cell is split into 2^d children if the function at the corners of the children
+        deviates from the multilinear interpolation of its corners by more than atol + rtol * max|f| (i.e. where the function is curved),
+        or if the function varies by more than max_variation across it (i.e. where the gradient is large).
+        Corners are shared between neighbouring cells and levels, so every point is only evaluated once.
+
+        Args:
+            function (Callable[[np.ndarray], np.ndarray]): Function of (n, d) points returning n values
+            lower (Sequence[float]): Lower corner of the domain, d values
+            upper (Sequence[float]): Upper corner of the domain, d values
+            base_cells (Union[int, Sequence[int]], optional): Number of cells per axis of the coarsest level. Defaults to 16.
+            max_level (int, optional): Maximum number of refinements. Defaults to 8.
+            atol (float, optional): Absolute tolerance of the interpolation error. Defaults to 0.
+            rtol (float, optional): Tolerance of the interpolation error relative to the largest |value| on the coarsest level. Defaults to 1e-3.
+            max_variation (Union[float, None], optional): Maximum variation of the function across a leaf. Defaults to None (not used).
+            verbose (bool, optional): Print progress. Defaults to True.
+        """
+
+        self.function = function
+        self.lower = np.asarray(lower, dtype = np.float64)
+        self.upper = np.asarray(upper, dtype = np.float64)
+        self.ndim = len(self.lower)
+        self.max_level = max_level
+        self.base_cells = np.broadcast_to(np.asarray(base_cells, dtype = np.int64), (self.ndim,)).copy()
+
+        # All corners lie on an integer lattice with the spacing of the finest level
+        self.lattice = self.base_cells * 2**max_level
+        self.spacing = (self.upper - self.lower) / self.lattice
+
+        # (2^d, d) corner offsets of a unit cell, in the order of itertools.product
+        self.offsets = np.array(list(itertools.product((0, 1), repeat = self.ndim)), dtype = np.int64)
+
+        # (3^d, d) offsets of the half-spaced lattice of a unit cell, in units of half a cell, and the (3^d, 2^d) weights of the multilinear interpolation there
+        self.half_offsets = np.array(list(itertools.product((0, 1, 2), repeat = self.ndim)), dtype = np.int64)
+        local = self.half_offsets / 2
+        self.half_weights = np.prod(np.where(self.offsets[np.newaxis, :, :] == 1, local[:, np.newaxis, :], 1 - local[:, np.newaxis, :]), axis = 2)
+
+        self._keys = np.empty(0, dtype = np.int64)
+        self._values = np.empty(0, dtype = np.float64)
+        self.evaluations = 0
+
+        # Leaves per level: sorted linear cell indices and their (n, 2^d) corner values
+        self.leaf_keys: List[np.ndarray] = []
+        self.leaf_values: List[np.ndarray] = []
+
+        self._build(atol = atol, rtol = rtol, max_variation = max_variation, verbose = verbose)
+
+    @staticmethod
+    def from_trap(
+            trap: TrapConfiguration,
+            x_range: Tuple[float, float],
+            z_range: Tuple[float, float],
+            y_range: Union[Tuple[float, float], None] = None,
+            y: float = 0,
+            **kwargs
+        ) -> "AdaptiveMesh":
+        """Adaptive mesh of the potential of a trap, in the x-z plane at y (quadtree) or in the volume if y_range is given (octree).
+        The coordinates of the mesh are (x, z) or (x, y, z). The keyword arguments are passed on to AdaptiveMesh.
+
+        Args:
+            trap (TrapConfiguration): The trap
+            x_range (Tuple[float, float]): Range of x [m]
+            z_range (Tuple[float, float]): Range of z [m]
+            y_range (Union[Tuple[float, float], None], optional): Range of y [m]. Defaults to None (x-z plane).
+            y (float, optional): y of the x-z plane [m]. Defaults to 0.
+
+        Returns:
+            AdaptiveMesh: Mesh of the potential [J]
+        """
+
+        if y_range is None:
+            def function(points: np.ndarray) -> np.ndarray:
+                return trap.potential_points(x = points[:, 0], y = y, z = points[:, 1])
+
+            return AdaptiveMesh(function, lower = (x_range[0], z_range[0]), upper = (x_range[1], z_range[1]), **kwargs)
+
+        def function3d(points: np.ndarray) -> np.ndarray:
+            return trap.potential_points(x = points[:, 0], y = points[:, 1], z = points[:, 2])
+
+        return AdaptiveMesh(function3d, lower = (x_range[0], y_range[0], z_range[0]), upper = (x_range[1], y_range[1], z_range[1]), **kwargs)
+
+    def _lattice_key(self, coordinates: np.ndarray) -> np.ndarray:
+        # Linear index of (n, d) lattice coordinates
+        key = np.zeros(coordinates.shape[:-1], dtype = np.int64)
+        for i in range(self.ndim - 1, -1, -1):
+            key = key * (self.lattice[i] + 1) + coordinates[..., i]
+        return key
+
+    def _evaluate(self, coordinates: np.ndarray) -> np.ndarray:
+        """Function values at lattice coordinates of shape (..., d), evaluating only the points that are not known yet"""
+        keys = self._lattice_key(coordinates)
+        unique, first, inverse = np.unique(keys.ravel(), return_index = True, return_inverse = True)
+
+        position = np.searchsorted(self._keys, unique)
+        known = position < len(self._keys)
+        known[known] = self._keys[position[known]] == unique[known]
+
+        new = unique[~known]
+        if len(new) > 0:
+            points = self.lower + coordinates.reshape((-1, self.ndim))[first[~known]] * self.spacing
+
+            values = np.asarray(self.function(points), dtype = np.float64)
+            self.evaluations += len(new)
+
+            order = np.argsort(np.concatenate([self._keys, new]), kind = "stable")
+            self._keys = np.concatenate([self._keys, new])[order]
+            self._values = np.concatenate([self._values, values])[order]
+
+        return self._values[np.searchsorted(self._keys, unique)][inverse].reshape(keys.shape)
+
+    def _build(self, atol: float, rtol: float, max_variation: Union[float, None], verbose: bool) -> None:
+        # Lower corners of the cells of the current level, in lattice coordinates
+        step = 2**self.max_level
+        cells = np.array(list(itertools.product(*(range(n) for n in self.base_cells))), dtype = np.int64) * step
+
+        tolerance = None
+
+        for level in range(self.max_level + 1):
+            step = 2**(self.max_level - level)
+
+            corner_values = self._evaluate(cells[:, np.newaxis, :] + self.offsets[np.newaxis, :, :] * step)
+
+            if tolerance is None:
+                tolerance = atol + rtol * np.max(np.abs(corner_values))
+
+            if level == self.max_level or len(cells) == 0:
+                refine = np.zeros(len(cells), dtype = bool)
+            else:
+                # Compare the function with the multilinear interpolation of the corners on the 3^d points of the half-spaced lattice of the cell,
+                # i.e. the corners of its children, which are needed anyway if it is refined. Checking only the centre would miss a narrow beam passing through the cell.
+                half_values = self._evaluate(cells[:, np.newaxis, :] + self.half_offsets[np.newaxis, :, :] * (step // 2))
+                refine = np.max(np.abs(half_values - corner_values @ self.half_weights.T), axis = 1) > tolerance
+                if max_variation is not None:
+                    refine |= np.ptp(corner_values, axis = 1) > max_variation
+
+            leaves = ~refine
+            keys = self._cell_key(cells[leaves] // step, level)
+            order = np.argsort(keys)
+            self.leaf_keys.append(keys[order])
+            self.leaf_values.append(corner_values[leaves][order])
+
+            if verbose:
+                print(f"Level {level}: {len(cells)} cells, {np.count_nonzero(refine)} refined, {self.evaluations} evaluations")
+
+            half = step // 2
+            cells = (cells[refine][:, np.newaxis, :] + self.offsets[np.newaxis, :, :] * half).reshape((-1, self.ndim))
+
+    def _cell_key(self, index: np.ndarray, level: int) -> np.ndarray:
+        # Linear index of (n, d) cell indices of a level
+        cells_per_axis = self.base_cells * 2**level
+        key = np.zeros(index.shape[:-1], dtype = np.int64)
+        for i in range(self.ndim - 1, -1, -1):
+            key = key * cells_per_axis[i] + index[..., i]
+        return key
+
+    @property
+    def num_leaves(self) -> int:
+        return sum(len(keys) for keys in self.leaf_keys)
+
+    def __call__(self, points: np.ndarray) -> np.ndarray:
+        """Multilinear interpolation of the function in the leaf containing each point
+
+        Args:
+            points (np.ndarray): (n, d) points inside the domain
+
+        Returns:
+            np.ndarray: n interpolated values
+        """
+
+        points = np.atleast_2d(np.asarray(points, dtype = np.float64))
+        out = np.full(len(points), np.nan)
+
+        # Position in units of the finest lattice
+        position = (points - self.lower) / self.spacing
+
+        for level, (keys, values) in enumerate(zip(self.leaf_keys, self.leaf_values)):
+            if len(keys) == 0:
+                continue
+
+            step = 2**(self.max_level - level)
+            cells_per_axis = self.base_cells * 2**level
+
+            index = np.clip(np.floor(position / step).astype(np.int64), 0, cells_per_axis - 1)
+            found = np.searchsorted(keys, self._cell_key(index, level))
+            found = np.minimum(found, len(keys) - 1)
+            inside = keys[found] == self._cell_key(index, level)
+
+            if not np.any(inside):
+                continue
+
+            local = position[inside] / step - index[inside]
+            corner_values = values[found[inside]]
+
+            # Product of (1 - f) or f over the axes for every corner
+            weights = np.prod(np.where(self.offsets[np.newaxis, :, :] == 1, local[:, np.newaxis, :], 1 - local[:, np.newaxis, :]), axis = 2)
+            out[inside] = np.sum(weights * corner_values, axis = 1)
+
+        return out
+
+    def resample(self, *axes: np.ndarray) -> np.ndarray:
+        """Interpolates the mesh onto the grid spanned by the axes, given in the order of the coordinates of the mesh (e.g. x, z)
+
+        Returns:
+            np.ndarray: Values in the layout of the grid functions, i.e. with the last coordinate first (e.g. (len(z), len(x)))
+        """
+
+        assert len(axes) == self.ndim, f"Give {self.ndim} axes"
+
+        grids = np.meshgrid(*axes[::-1], indexing = "ij")
+        points = np.stack(grids[::-1], axis = -1).reshape((-1, self.ndim))
+
+        return self(points).reshape(grids[0].shape)
@@ -1,73 +1,175 @@
 #!/usr/bin/env python3
 
+import functools
 import numpy as np
 import scipy.constants as sc
-from typing import Callable, Union, Tuple
+from typing import Callable, Dict, List, NamedTuple, Union, Tuple, Sequence
+from collections import OrderedDict
 
 from scipy.spatial.transform import Rotation
 import scipy.integrate
+import scipy.special
+import scipy.signal
 
+# Optional JIT backend (conda install numba), falls back to numpy if not installed
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+class Transition(NamedTuple):
+    wavelength: float   # [m]
+    gamma: float        # Natural line width [s^-1]
+
+# https://jet.physics.ncsu.edu/techdocs/pdf/PropertiesOfLi.pdf
+LI6_D1 = Transition(wavelength = 670.992421e-9, gamma = 36.898e6)
+LI6_D2 = Transition(wavelength = 670.977338e-9, gamma = 36.898e6)
 
 class DipoleTrapLi():
+    # Wavelength units understood by the unit arguments
+    WAVELENGTH_UNITS = { "m": 1, "um": 1e-6, "nm": 1e-9 }
+
+    @staticmethod
+    def wavelength_in_metres(wavelength: Union[float, np.ndarray], unit: Union[str, None] = None) -> Union[float, np.ndarray]:
+        """Converts wavelengths to metres
+
+        Args:
+            wavelength (Union[float, np.ndarray]): Wavelength(s)
+            unit (Union[str, None], optional): One of "m", "um" or "nm". Defaults to None (guessed per element: values > 1 are nm, otherwise m).
+
+        Returns:
+            Union[float, np.ndarray]: Wavelength(s) [m]
+        """
+
+        if unit is None:
+            wavelength = np.asarray(wavelength, dtype = np.float64)
+            metres = np.where(wavelength > 1, wavelength * 1e-9, wavelength)
+            return metres if metres.ndim else float(metres)
+
+        if unit not in DipoleTrapLi.WAVELENGTH_UNITS:
+            raise ValueError(f"Unknown unit '{unit}', must be one of {list(DipoleTrapLi.WAVELENGTH_UNITS.keys())}")
+
+        return np.multiply(wavelength, DipoleTrapLi.WAVELENGTH_UNITS[unit])
+
     @staticmethod
-    def to_freq_ang(wavelength: float) -> float:
+    def to_freq_ang(wavelength: Union[float, np.ndarray], unit: Union[str, None] = None) -> Union[float, np.ndarray]:
         """Converts a wavelength to its angular frequency using the formula 
         omega = 2*pi*c / lambda
 
         Args:
-            wavelength (float): Wavelength [m, nm]
+            wavelength (Union[float, np.ndarray]): Wavelength(s) [m, nm]
+            unit (Union[str, None], optional): Unit of the wavelength, see wavelength_in_metres. Defaults to None (guessed).
 
         Returns:
-            float: Angular frequency in s^-1
+            Union[float, np.ndarray]: Angular frequency in s^-1
         """
 
-        if wavelength > 1:
-            # its in nm
-            # Converts a wavelength in nanometers of light to radians
-            return (2*np.pi*sc.speed_of_light*1e9)/(wavelength)
-        else:
-            return (2*np.pi*sc.speed_of_light)/(wavelength)
+        return (2*np.pi*sc.speed_of_light)/DipoleTrapLi.wavelength_in_metres(wavelength = wavelength, unit = unit)
 
     @staticmethod
-    def alpha(wavelength: float) -> complex:
+    def alpha(wavelength: Union[float, np.ndarray], unit: Union[str, None] = None) -> Union[complex, np.ndarray]:
         """Calculates the polarizability alpha using equation (8) from the Grimm review paper
 
         Args:
-            wavelength (float): wavelength [nm]
+            wavelength (Union[float, np.ndarray]): Wavelength(s) [m, nm]
+            unit (Union[str, None], optional): Unit of the wavelength, see wavelength_in_metres. Defaults to None (guessed).
 
         Returns:
-            complex: Complex polarizability alpha
+            Union[complex, np.ndarray]: Complex polarizability alpha (complex128 array for array input)
         """
         # Units = (A^2s^4)/(kg rad)
         # Use Equation (8)
 
         # https://jet.physics.ncsu.edu/techdocs/pdf/PropertiesOfLi.pdf
 
-        omega_0       = DipoleTrapLi.to_freq_ang(wavelength = 671)
-        omega         = DipoleTrapLi.to_freq_ang(wavelength = wavelength)
+        omega_0       = DipoleTrapLi.to_freq_ang(wavelength = 671, unit = "nm")
+        omega         = DipoleTrapLi.to_freq_ang(wavelength = wavelength, unit = unit)
         gamma_omega_0 = 36.898e6  
         # Line width of the transition (We are only interested in the damping there)
 
         result  = 6 * np.pi * sc.epsilon_0 * (sc.speed_of_light**3)
         result *= gamma_omega_0 / (omega_0**2)
-        result /= complex(omega_0**2 - omega**2, - (omega**3/omega_0**2)*gamma_omega_0)
+        result  = result / ((omega_0**2 - omega**2) - 1j * (omega**3/omega_0**2)*gamma_omega_0)
+
+        return result if np.ndim(result) else complex(result)
+
+    @staticmethod
+    def alpha_multilevel(wavelength: Union[float, np.ndarray], unit: Union[str, None] = None, polarisation: float = 0, g_F_m_F: float = 0) -> Union[complex, np.ndarray]:
+        """Calculates the polarizability alpha from the D1 and D2 lines of lithium-6 (LI6_D1, LI6_D2), 
+        each with the damped oscillator of equation (8) from the Grimm review paper, i.e. including the counter-rotating term.
+
+        The ground state couples to the lines with the weights of equation (20) of Grimm, 
+        (1 - P g_F m_F)/3 for D1 and (2 + P g_F m_F)/3 for D2, where P is the polarisation of the light (0 linear, +-1 circular).
+
+        Args:
+            wavelength (Union[float, np.ndarray]): Wavelength(s) [m, nm]
+            unit (Union[str, None], optional): Unit of the wavelength, see wavelength_in_metres. Defaults to None (guessed).
+            polarisation (float, optional): Polarisation P of the light. Defaults to 0 (linear).
+            g_F_m_F (float, optional): Product of the Lande factor and the magnetic quantum number of the state. Defaults to 0.
+
+        Returns:
+            Union[complex, np.ndarray]: Complex polarizability alpha (complex128 array for array input)
+        """
+
+        omega = DipoleTrapLi.to_freq_ang(wavelength = wavelength, unit = unit)
+        state = polarisation * g_F_m_F
+
+        result = 0
+        for line, weight in ((LI6_D1, (1 - state) / 3), (LI6_D2, (2 + state) / 3)):
+            omega_0 = DipoleTrapLi.to_freq_ang(wavelength = line.wavelength, unit = "m")
+
+            _alpha  = 6 * np.pi * sc.epsilon_0 * (sc.speed_of_light**3) * line.gamma / (omega_0**2)
+            _alpha  = _alpha / ((omega_0**2 - omega**2) - 1j * (omega**3/omega_0**2)*line.gamma)
+
+            result  = result + weight * _alpha
+
+        return result if np.ndim(result) else complex(result)
+
+    # Models of the polarizability, see alpha and alpha_multilevel
+    POLARIZABILITY_MODELS = ("two-level", "multi-level")
+
+    @staticmethod
+    def alpha_cached(wavelength: float, unit: Union[str, None] = None, model: str = "two-level", polarisation: float = 0, g_F_m_F: float = 0) -> complex:
+        """alpha (model "two-level") or alpha_multilevel (model "multi-level") of a single wavelength and state, 
+        looked up in a table of the wavelengths and states used so far (see _alpha_table)"""
 
-        return result
+        if model not in DipoleTrapLi.POLARIZABILITY_MODELS:
+            raise ValueError(f"Unknown model '{model}', must be one of {list(DipoleTrapLi.POLARIZABILITY_MODELS)}")
+
+        return _alpha_table(float(DipoleTrapLi.wavelength_in_metres(wavelength = wavelength, unit = unit)), model, float(polarisation), float(g_F_m_F))
 
     @staticmethod
-    def potential(intensity: Union[float, np.ndarray], wavelength: float) -> Union[float, np.ndarray]:
-        """Calculates the dipole potential using equation (2) of the Grimms Review Paper
+    def potential(
+            intensity: Union[float, np.ndarray], 
+            wavelength: Union[float, np.ndarray], 
+            unit: Union[str, None] = None, 
+            model: str = "two-level", 
+            polarisation: float = 0, 
+            g_F_m_F: float = 0
+        ) -> Union[float, np.ndarray]:
+        """Calculates the dipole potential using equation (2) of the Grimms Review Paper.
+        For a single wavelength the polarizability is a cached scalar, so this is one multiplication per point for either model.
 
         Args:
-            intensity (float): Intensity   [W/m^2]
-            wavelength (float): Wavelength [nm]
+            intensity (Union[float, np.ndarray]): Intensity   [W/m^2]
+            wavelength (Union[float, np.ndarray]): Wavelength(s), broadcast against the intensity [m, nm]
+            unit (Union[str, None], optional): Unit of the wavelength, see wavelength_in_metres. Defaults to None (guessed).
+            model (str, optional): "two-level" (alpha) or "multi-level" (alpha_multilevel). Defaults to "two-level".
+            polarisation (float, optional): Polarisation of the light for the multi-level model. Defaults to 0.
+            g_F_m_F (float, optional): g_F m_F of the state for the multi-level model. Defaults to 0.
 
         Returns:
-            float: Potential [J]
+            Union[float, np.ndarray]: Potential [J]
         """
         
         # Equation (2) of Grimm
-        _alpha = DipoleTrapLi.alpha(wavelength = wavelength)
+        if not np.ndim(wavelength):
+            _alpha = DipoleTrapLi.alpha_cached(wavelength = wavelength, unit = unit, model = model, polarisation = polarisation, g_F_m_F = g_F_m_F) # type: ignore
+        elif model == "multi-level":
+            _alpha = DipoleTrapLi.alpha_multilevel(wavelength = wavelength, unit = unit, polarisation = polarisation, g_F_m_F = g_F_m_F)
+        else:
+            _alpha = DipoleTrapLi.alpha(wavelength = wavelength, unit = unit)
 
         U_dip  = - np.real(_alpha) * intensity
         U_dip /= 2 * sc.epsilon_0 * sc.speed_of_light
@@ -88,7 +190,7 @@ class DipoleTrapLi():
         return -trap_depth/sc.Boltzmann
 
     @staticmethod
-    def gaussian_beam_width(z: Union[float, np.ndarray], w_0: float , z_0: float, Msq: float, wavelength: float) -> Union[float, np.ndarray]:
+    def gaussian_beam_width(z: Union[float, np.ndarray], w_0: float , z_0: float, Msq: float, wavelength: float, backend: Union[str, None] = None) -> Union[float, np.ndarray]:
         """ Returns the gaussian beam width based on a gaussian beam propagation
         
         Note that this function is normalized if:
@@ -102,11 +204,17 @@ class DipoleTrapLi():
             z_0 (float): Position of beam waist                             [m, mm]
             Msq (float): M-squared beam quality factor                      [no unit]
             wavelength (float): Wavelength of light                         [m, nm]
+            backend (Union[str, None], optional): "numpy" or "numba", see resolve_backend. Defaults to None.
 
         Returns:
             float: Gaussian beam width [m, um]
         """
 
+        if resolve_backend(backend) == "numba" and isinstance(z, np.ndarray) and z.ndim == 1:
+            out = np.empty(len(z), dtype = np.float64)
+            _gaussian_beam_width_kernel(np.ascontiguousarray(z, dtype = np.float64), w_0, z_0, Msq, wavelength, out)
+            return out
+
         return w_0 * np.sqrt(
             1 + ((z - z_0)**2)*((
                 (Msq * wavelength)/
@@ -143,7 +251,9 @@ class DipoleTrapLi():
             wavelength: float,
             w_0: Tuple[float, float],
             z_0: Tuple[float, float],
-            Msq: Tuple[float, float]
+            Msq: Tuple[float, float],
+            verbose: bool = True,
+            backend: Union[str, None] = None
         ) -> Union[float, np.ndarray]:
 
         """Returns the intensity of a guassian beam at a point in 3D space. Assumes a simple astigmatic beam
@@ -161,11 +271,24 @@ class DipoleTrapLi():
             w_0 (Tuple[float, float]): Tuple of the beam waist (x, y axes)      [m, um]
             z_0 (Tuple[float, float]): Tuple of the rayleigh length (x, y axes) [m, mm]
             Msq (Tuple[float, float]): Tuple of the beam quality factor M^2 (x, y axes)
+            verbose (bool, optional): Print progress. Defaults to True.
+            backend (Union[str, None], optional): "numpy" or "numba", see resolve_backend. Defaults to None.
 
         Returns:
             float: The intensity at that point [W/m^2, W/um^2]
         """ 
 
+        if resolve_backend(backend) == "numba" and _jit_compatible(x, y, z):
+            if verbose:
+                print("Calculating Intensities (numba)...", end = "\r")
+            intensity = DipoleTrapLi._intensity_jit(
+                x = x, y = y, z = z, power = power, wavelength = wavelength, 
+                w_0 = w_0, z_0 = z_0, Msq = Msq, 
+                shifts = np.zeros(1), weights = np.ones(1))
+            if verbose:
+                print("Calculating Intensities (numba)...Done!")
+            return intensity
+
         # the x and y are the main axes for astigmatism
 
         x_params = { "w_0": w_0[0], "z_0": z_0[0], "Msq": Msq[0], "wavelength": wavelength }
@@ -187,12 +310,58 @@ class DipoleTrapLi():
             w_x = w_x[:, np.newaxis]
             w_y = w_y[:, np.newaxis]
         
-        print("Calculating Intensities...", end = "\r")
+        if verbose:
+            print("Calculating Intensities...", end = "\r")
         intensity = I0 * np.exp(-2*((x/w_x)**2 + (y/w_y)**2))
-        print("Calculating Intensities...Done!")
+        if verbose:
+            print("Calculating Intensities...Done!")
 
         return intensity
 
+    @staticmethod
+    def _intensity_jit(
+            x: Union[float, np.ndarray], y: Union[float, np.ndarray], z: Union[float, np.ndarray],
+            power: float, 
+            wavelength: float,
+            w_0: Tuple[float, float],
+            z_0: Tuple[float, float],
+            Msq: Tuple[float, float],
+            shifts: np.ndarray,
+            weights: np.ndarray
+        ) -> np.ndarray:
+        """sum_j weights[j] * intensity(x - shifts[j], y, z) with the numba kernel, see intensity and intensity_average"""
+
+        x, y, z = (np.ascontiguousarray(a, dtype = np.float64) for a in np.broadcast_arrays(x, y, z))
+        out = np.empty(len(x), dtype = np.float64)
+
+        _intensity_kernel(
+            x, y, z, power, wavelength, 
+            w_0[0], w_0[1], z_0[0], z_0[1], Msq[0], Msq[1], 
+            np.ascontiguousarray(shifts, dtype = np.float64), np.ascontiguousarray(weights, dtype = np.float64), 
+            out)
+
+        return out
+
+    @staticmethod
+    def _intensity_profile(
+            x: Union[float, np.ndarray], y: Union[float, np.ndarray], z: Union[float, np.ndarray],
+            power: float, 
+            wavelength: float,
+            w_0: Tuple[float, float],
+            z_0: Tuple[float, float],
+            Msq: Tuple[float, float]
+        ) -> Union[float, np.ndarray]:
+        """Same as intensity, but x, y and z follow the plain numpy broadcasting rules. 
+        Quantities that only depend on z are therefore only evaluated on the shape of z.
+        """
+
+        w_x = DipoleTrapLi.gaussian_beam_width(z = z, w_0 = w_0[0], z_0 = z_0[0], Msq = Msq[0], wavelength = wavelength)
+        w_y = DipoleTrapLi.gaussian_beam_width(z = z, w_0 = w_0[1], z_0 = z_0[1], Msq = Msq[1], wavelength = wavelength)
+
+        I0 = DipoleTrapLi.max_intensity(power = power, width_x = w_x, width_y = w_y)
+
+        return I0 * np.exp(-2*((x/w_x)**2 + (y/w_y)**2))
+
     @staticmethod
     def intensity_average(
             x: Union[float, np.ndarray], y: Union[float, np.ndarray], z: Union[float, np.ndarray],
@@ -203,7 +372,10 @@ class DipoleTrapLi():
             Msq: Tuple[float, float],
             numsamples: int, 
             deviation: float,
-            modulation_function: Callable
+            modulation_function: Callable,
+            max_bytes: Union[int, None] = None,
+            verbose: bool = True,
+            backend: Union[str, None] = None
         ) -> Union[float, np.ndarray]:
         """Returns the intensity of a guassian beam at a point in 3D space averaged over time using the modulation function. Assumes a simple astigmatic beam
 
@@ -223,6 +395,12 @@ class DipoleTrapLi():
             numsamples (int): Number of samples to take for the integration
             deviation (float): Amplitude of the modulation for the propagation axis [m, um]
             modulation_function (Callable): Function to modulate the position with. This function should take one parameter t (0 to 1) and have range -1 to 1
+            max_bytes (Union[int, None], optional): Memory budget for the (points x numsamples) intermediates [bytes]. 
+                If given, the points are streamed through the time integration in blocks that fit into this budget, 
+                the peak of all temporaries stays below it (see AVERAGE_TEMPORARIES). Defaults to None (all points at once).
+            verbose (bool, optional): Print progress. Defaults to True.
+            backend (Union[str, None], optional): "numpy" or "numba", see resolve_backend. 
+                The numba kernel accumulates the simpson sum per point and needs no (points x numsamples) intermediates. Defaults to None.
 
         Returns:
             float: The averaged intensity at that point [W/m^2, W/um^2]
@@ -230,51 +408,1620 @@ class DipoleTrapLi():
 
         # https://docs.scipy.org/doc/scipy/reference/generated/scipy.integrate.simpson.html?highlight=simps#scipy.integrate.simpson
 
-        if isinstance(x, np.ndarray) and isinstance(y, np.ndarray):
-            xs_t = x[:, np.newaxis]
-        else:
-            xs_t = x
+        if resolve_backend(backend) == "numba" and _jit_compatible(x, y, z):
+            ts = np.linspace(start = 0, stop = 1, endpoint = True, num = numsamples)
+
+            if verbose:
+                print("Calculating Averaged Intensities (numba)...", end = "\r")
+            integrated = DipoleTrapLi._intensity_jit(
+                x = x, y = y, z = z, power = power, wavelength = wavelength, 
+                w_0 = w_0, z_0 = z_0, Msq = Msq, 
+                shifts = deviation * np.broadcast_to(modulation_function(ts), ts.shape),
+                weights = _unit_simpson_weights(numsamples))
+            if verbose:
+                print("Calculating Averaged Intensities (numba)...Done!")
+            return integrated
+
+        if max_bytes is not None and isinstance(x, np.ndarray):
+            # Every point is independent in the time integration, so we can stream blocks of points through it
+            # and write them into a preallocated output. The blocks are computed exactly as in the unchunked case.
+            # y and z are sliced along with x if they are given per point, a single value (e.g. y = 0 for the x-z plane) is passed on as is
+            shape = x.shape
+            x, y, z = (np.ravel(c) if np.shape(c) == shape else c for c in (x, y, z))
+
+            def _per_point(c: Union[float, np.ndarray], _slice: slice) -> Union[float, np.ndarray]:
+                return c[_slice] if np.shape(c) == x.shape else c
+
+            numpoints = len(x)
+            chunksize = DipoleTrapLi.average_chunksize(numsamples = numsamples, max_bytes = max_bytes)
+            numchunks = -(-numpoints // chunksize)
+
+            averaged = np.empty(numpoints, dtype = np.float64)
+
+            _message = "Calculating Averaged Intensities..."
+
+            for i in range(numchunks):
+                if verbose:
+                    print(f"{_message}{i + 1}/{numchunks}", end = "\r")
+
+                _slice = slice(i * chunksize, (i + 1) * chunksize)
+                averaged[_slice] = DipoleTrapLi.intensity_average(
+                    x = x[_slice], 
+                    y = _per_point(y, _slice), 
+                    z = _per_point(z, _slice), 
+                    power = power,
+                    wavelength = wavelength,
+                    w_0 = w_0, z_0 = z_0, Msq = Msq,
+                    numsamples = numsamples,
+                    deviation = deviation,
+                    modulation_function = modulation_function,
+                    verbose = False,
+                    backend = "numpy")
+
+            if verbose:
+                print(f"{_message}Done!".ljust(len(_message) + 2 * len(str(numchunks)) + 1))
+
+            return averaged.reshape(shape)
+
+        w_x = DipoleTrapLi.gaussian_beam_width(z = z, w_0 = w_0[0], z_0 = z_0[0], Msq = Msq[0], wavelength = wavelength)
+        w_y = DipoleTrapLi.gaussian_beam_width(z = z, w_0 = w_0[1], z_0 = z_0[1], Msq = Msq[1], wavelength = wavelength)
 
-        # sample t from 0 to 1
-        ts     = np.linspace(start = 0, stop = 1, endpoint = True, num = numsamples)
-        f_of_t = DipoleTrapLi.intensity(
-            x = xs_t - deviation * modulation_function(ts), 
+        I0 = DipoleTrapLi.max_intensity(power = power, width_x = w_x, width_y = w_y)
+
+        if verbose:
+            print("Calculating Averaged Intensities...", end = "\r")
+
+        # Only the x factor depends on t
+        x_average  = DipoleTrapLi._x_average_sampled(x = x, w_x = w_x, deviation = deviation, modulation_function = modulation_function, numsamples = numsamples)
+        integrated = I0 * x_average * np.exp(-2*(y/w_y)**2)
+
+        if verbose:
+            print("Calculating Averaged Intensities...Done!")
+
+        return integrated
+
+    @staticmethod
+    def intensity_average_analytic(
+            x: Union[float, np.ndarray], y: Union[float, np.ndarray], z: Union[float, np.ndarray],
+            power: float, 
+            wavelength: float,
+            w_0: Tuple[float, float],
+            z_0: Tuple[float, float],
+            Msq: Tuple[float, float],
+            deviation: float,
+            modulation: str,
+            validate: bool = False,
+            numsamples: int = 200,
+            verbose: bool = True
+        ) -> Union[float, np.ndarray]:
+        """Returns the time-averaged intensity of a gaussian beam swept with one of the standard modulation functions, 
+        without sampling the modulation in time. Gives the same result as intensity_average in the limit of numsamples -> infinity.
+
+        - "ramp" (ramp_mod): the beam spends equal time at every position in [-deviation, deviation], 
+          so the average is the gaussian integrated over that interval, i.e. a difference of error functions.
+        - "sine" (sine_mod): the dwell-time density is the arcsine distribution. The convolution is evaluated with 
+          Gauss-Chebyshev quadrature, which converges spectrally; the number of nodes only depends on deviation / w.
+
+        Note that this function is normalized if:
+        - Everything is in SI-Units, or
+        - w, w_0: [um], z, z_0: [mm], lmbda: [nm] (preferred)
+
+        Args:
+            x (Union[float, np.ndarray]): x position (one of the main axes)     [m, um]
+            y (Union[float, np.ndarray]): y position (one of the main axes)     [m, um]
+            z (Union[float, np.ndarray]): z position (propagation direction)    [m, mm]
+            power (float): Power of the beam                                    [W]
+            wavelength (float): Wavelength of the light                         [m, nm]
+            w_0 (Tuple[float, float]): Tuple of the beam waist (x, y axes)      [m, um]
+            z_0 (Tuple[float, float]): Tuple of the rayleigh length (x, y axes) [m, mm]
+            Msq (Tuple[float, float]): Tuple of the beam quality factor M^2 (x, y axes)
+            deviation (float): Amplitude of the modulation for the propagation axis [m, um]
+            modulation (str): Modulation function, one of "ramp" or "sine"
+            validate (bool, optional): Also compute intensity_average with numsamples samples and print the deviation. Defaults to False.
+            numsamples (int, optional): Number of samples for the validation. Defaults to 200.
+            verbose (bool, optional): Print progress. Defaults to True.
+
+        Returns:
+            float: The averaged intensity at that point [W/m^2, W/um^2]
+        """
+
+        if modulation not in MODULATION_FUNCTIONS:
+            raise ValueError(f"Unknown modulation '{modulation}', must be one of {list(MODULATION_FUNCTIONS.keys())}")
+
+        x_params = { "w_0": w_0[0], "z_0": z_0[0], "Msq": Msq[0], "wavelength": wavelength }
+        y_params = { "w_0": w_0[1], "z_0": z_0[1], "Msq": Msq[1], "wavelength": wavelength }
+
+        w_x = DipoleTrapLi.gaussian_beam_width(z = z, **x_params)
+        w_y = DipoleTrapLi.gaussian_beam_width(z = z, **y_params)
+
+        I0 = DipoleTrapLi.max_intensity(power = power, width_x = w_x, width_y = w_y)
+
+        if verbose:
+            print("Calculating Averaged Intensities (analytic)...", end = "\r")
+
+        x_average  = DipoleTrapLi._x_average_analytic(x = x, w_x = w_x, deviation = deviation, modulation = modulation)
+        integrated = I0 * x_average * np.exp(-2*(y/w_y)**2)
+
+        if verbose:
+            print("Calculating Averaged Intensities (analytic)...Done!")
+
+        if validate:
+            sampled = DipoleTrapLi.intensity_average(
+                x = x, y = y, z = z,
+                power = power,
+                wavelength = wavelength,
+                w_0 = w_0, z_0 = z_0, Msq = Msq,
+                numsamples = numsamples,
+                deviation = deviation,
+                modulation_function = MODULATION_FUNCTIONS[modulation],
+                verbose = False)
+
+            max_deviation = np.max(np.abs(integrated - sampled))
+            print(f"Max deviation from simpson ({numsamples} samples) = {max_deviation} ({max_deviation / np.max(np.abs(sampled)):.3e} of peak)")
+
+        return integrated
+
+    @staticmethod
+    def intensity_average_convolved(
+            x: np.ndarray, y: float, z: np.ndarray,
+            power: float, 
+            wavelength: float,
+            w_0: Tuple[float, float],
+            z_0: Tuple[float, float],
+            Msq: Tuple[float, float],
+            deviation: float,
+            modulation_function: Union[Callable, None] = None,
+            waveform: Union[np.ndarray, None] = None,
+            density: Union[Tuple[np.ndarray, np.ndarray], None] = None,
+            numsamples: int = 2**16,
+            verbose: bool = True
+        ) -> np.ndarray:
+        """Returns the time-averaged intensity of a gaussian beam on a structured grid in the frame of the beam, 
+        for an arbitrary periodic modulation.
+
+        The time average is the static intensity convolved along the sweep axis with the dwell-time density of the beam position,
+        so we evaluate the static intensity once on a padded grid and apply the convolution row by row with an FFT.
+        The density is built once (see dwell_density) and can be passed in to be reused between beams and calls.
+
+        Note that this function is normalized if:
+        - Everything is in SI-Units, or
+        - w, w_0: [um], z, z_0: [mm], lmbda: [nm] (preferred)
+
+        Args:
+            x (np.ndarray): Evenly spaced axis along the sweep direction                    [m, um]
+            y (float): y position (one of the main axes)                                     [m, um]
+            z (np.ndarray): Axis along the propagation direction                            [m, mm]
+            power (float): Power of the beam                                                [W]
+            wavelength (float): Wavelength of the light                                     [m, nm]
+            w_0 (Tuple[float, float]): Tuple of the beam waist (x, y axes)                  [m, um]
+            z_0 (Tuple[float, float]): Tuple of the rayleigh length (x, y axes)             [m, mm]
+            Msq (Tuple[float, float]): Tuple of the beam quality factor M^2 (x, y axes)
+            deviation (float): Amplitude of the modulation for the propagation axis         [m, um]
+            modulation_function (Union[Callable, None], optional): Function to modulate the position with, see intensity_average. Defaults to None.
+            waveform (Union[np.ndarray, None], optional): Samples of the modulation over one period with range -1 to 1 (e.g. a Rigol arbitrary waveform). Defaults to None.
+            density (Union[Tuple[np.ndarray, np.ndarray], None], optional): Precomputed dwell_density for this deviation and grid spacing. Defaults to None.
+            numsamples (int, optional): Number of samples of the modulation used to build the density. Defaults to 2**16.
+            verbose (bool, optional): Print progress. Defaults to True.
+
+        Returns:
+            np.ndarray: The averaged intensity in the (len(z), len(x)) layout [W/m^2, W/um^2]
+        """
+
+        x = np.asarray(x, dtype = np.float64)
+        z = np.atleast_1d(np.asarray(z, dtype = np.float64))
+
+        spacing = x[1] - x[0]
+        assert np.allclose(np.diff(x), spacing), "x has to be evenly spaced"
+
+        if density is None:
+            density = dwell_density(
+                deviation = deviation, spacing = spacing, 
+                modulation_function = modulation_function, waveform = waveform, 
+                numsamples = numsamples)
+
+        offsets, weights = density
+        k_min = int(np.rint(offsets[0] / spacing))
+        k_max = k_min + len(weights) - 1
+
+        # Pad the axis so that every shifted beam position lies on the padded grid
+        x_padded = x[0] + np.arange(-k_max, len(x) - k_min) * spacing
+
+        if verbose:
+            print("Calculating Averaged Intensities (convolution)...", end = "\r")
+
+        static = DipoleTrapLi._intensity_profile(
+            x = x_padded[np.newaxis, :], 
             y = y, 
-            z = z, 
+            z = z[:, np.newaxis], 
             power = power,
             wavelength = wavelength,
             w_0 = w_0, z_0 = z_0, Msq = Msq)
 
-        try:
-            integrated = scipy.integrate.simpson(y = f_of_t, x = ts)
-        except AttributeError as e:
-            integrated = scipy.integrate.simps(y = f_of_t, x = ts)
-        
+        integrated = scipy.signal.fftconvolve(static, weights[np.newaxis, :], mode = "valid", axes = 1)
+
+        if verbose:
+            print("Calculating Averaged Intensities (convolution)...Done!")
+
         return integrated
 
-def transform_quaternion_angle(axis: np.ndarray, degrees: float) -> Rotation: 
-    """Generates a scipy.spatial.transform.Rotation object from a rotation axis and how many degrees to rotate.
-    The Rotation object is generated using quarternions
+    @staticmethod
+    def intensity_average_2d(
+            x: np.ndarray, y: Union[float, np.ndarray], z: Union[float, np.ndarray],
+            power: float, 
+            wavelength: float,
+            w_0: Tuple[float, float],
+            z_0: Tuple[float, float],
+            Msq: Tuple[float, float],
+            deviation_x: float,
+            deviation_y: float,
+            modulation_x: Union[Callable, None] = None,
+            modulation_y: Union[Callable, None] = None,
+            density: Union[Tuple[np.ndarray, np.ndarray, np.ndarray], None] = None,
+            numsamples: int = 2**16,
+            verbose: bool = True
+        ) -> np.ndarray:
+        """Returns the time-averaged intensity of a gaussian beam painted along both transverse axes, 
+        at (deviation_x * modulation_x(t), deviation_y * modulation_y(t)), e.g. with two AOMs (see lissajous_mod, raster_mod and spiral_mod).
+
+        The time average is the static intensity convolved with the 2D dwell-time density of the beam position (see dwell_density_2d).
+        The beam profile is separable in x and y, so the 2D convolution is done as two 1D FFT convolutions, first along x and then along y, 
+        and costs about as much as two 1D averages (intensity_average_convolved) instead of one evaluation of the beam per sample of t.
 
-    q = cos(a/2) + sin(a/2)(x*i + y*j + z*k)
+        Note that this function is normalized if:
+        - Everything is in SI-Units, or
+        - w, w_0: [um], z, z_0: [mm], lmbda: [nm] (preferred)
 
-    Args:
-        axis (np.ndarray): Rotation axis in the form of (1,3) or (3,1) np array
-        degrees (float): Degrees to rotate
+        Args:
+            x (np.ndarray): Evenly spaced axis along the first sweep direction                                      [m, um]
+            y (Union[float, np.ndarray]): Evenly spaced axis along the second sweep direction, or a single value     [m, um]
+            z (Union[float, np.ndarray]): Axis along the propagation direction                                      [m, mm]
+            power (float): Power of the beam                                                [W]
+            wavelength (float): Wavelength of the light                                     [m, nm]
+            w_0 (Tuple[float, float]): Tuple of the beam waist (x, y axes)                  [m, um]
+            z_0 (Tuple[float, float]): Tuple of the rayleigh length (x, y axes)             [m, mm]
+            Msq (Tuple[float, float]): Tuple of the beam quality factor M^2 (x, y axes)
+            deviation_x (float): Amplitude of the modulation along x                        [m, um]
+            deviation_y (float): Amplitude of the modulation along y                        [m, um]
+            modulation_x (Union[Callable, None], optional): Modulation along x, function of t (0 to 1) with range -1 to 1. Defaults to None.
+            modulation_y (Union[Callable, None], optional): Modulation along y, function of t (0 to 1) with range -1 to 1. Defaults to None.
+            density (Union[Tuple[np.ndarray, np.ndarray, np.ndarray], None], optional): Precomputed dwell_density_2d for these deviations and spacings. Defaults to None.
+            numsamples (int, optional): Number of samples of the modulation used to build the density. Defaults to 2**16.
+            verbose (bool, optional): Print progress. Defaults to True.
 
-    Returns:
-        Rotation: scipy.spatial.transform.Rotation object
-    """
+        Returns:
+            np.ndarray: The averaged intensity in the (len(z), len(y), len(x)) layout, or (len(z), len(x)) for a single y [W/m^2, W/um^2]
+        """
 
-    halfangle = np.deg2rad(degrees)/2
+        x = np.asarray(x, dtype = np.float64)
+        y = np.atleast_1d(np.asarray(y, dtype = np.float64))
+        z = np.atleast_1d(np.asarray(z, dtype = np.float64))
+
+        spacing_x = x[1] - x[0]
+        assert np.allclose(np.diff(x), spacing_x), "x has to be evenly spaced"
+
+        # For a single y value the bins along y only need to resolve the beam, so they take the spacing of x
+        spacing_y = y[1] - y[0] if len(y) > 1 else spacing_x
+        assert np.allclose(np.diff(y), spacing_y), "y has to be evenly spaced"
+
+        if density is None:
+            density = dwell_density_2d(
+                deviation_x = deviation_x, deviation_y = deviation_y, 
+                spacing_x = spacing_x, spacing_y = spacing_y, 
+                modulation_x = modulation_x, modulation_y = modulation_y, 
+                numsamples = numsamples)
+
+        offsets_x, offsets_y, weights = density
+        kx_min = int(np.rint(offsets_x[0] / spacing_x))
+        kx_max = kx_min + len(offsets_x) - 1
+        ky_min = int(np.rint(offsets_y[0] / spacing_y))
+        ky_max = ky_min + len(offsets_y) - 1
+
+        if verbose:
+            print("Calculating Averaged Intensities (2D convolution)...", end = "\r")
+
+        w_x = np.asarray(DipoleTrapLi.gaussian_beam_width(z = z, w_0 = w_0[0], z_0 = z_0[0], Msq = Msq[0], wavelength = wavelength))
+        w_y = np.asarray(DipoleTrapLi.gaussian_beam_width(z = z, w_0 = w_0[1], z_0 = z_0[1], Msq = Msq[1], wavelength = wavelength))
+        I0  = DipoleTrapLi.max_intensity(power = power, width_x = w_x, width_y = w_y)
+
+        # Along x on the padded axis, see intensity_average_convolved: (len(z), len(y bins), len(x))
+        x_padded = x[0] + np.arange(-kx_max, len(x) - kx_min) * spacing_x
+        profile_x = np.exp(-2*(x_padded[np.newaxis, :] / w_x[:, np.newaxis])**2)
+        along_x = scipy.signal.fftconvolve(profile_x[:, np.newaxis, :], weights[np.newaxis, :, :], mode = "valid", axes = 2)
+
+        if len(y) > 1:
+            y_padded = y[0] + np.arange(-ky_max, len(y) - ky_min) * spacing_y
+            profile_y = I0[:, np.newaxis] * np.exp(-2*(y_padded[np.newaxis, :] / w_y[:, np.newaxis])**2)
+            integrated = scipy.signal.fftconvolve(profile_y[:, :, np.newaxis], along_x, mode = "valid", axes = 1)
+        else:
+            # A single y is a plain sum over the y bins
+            profile_y = I0[:, np.newaxis] * np.exp(-2*((y[0] - offsets_y[np.newaxis, :]) / w_y[:, np.newaxis])**2)
+            integrated = np.einsum("zk,zkx->zx", profile_y, along_x)
 
-    unit_axis = axis.flatten()
-    unit_axis = unit_axis / np.linalg.norm(unit_axis)
+        if verbose:
+            print("Calculating Averaged Intensities (2D convolution)...Done!")
 
-    ax = np.sin(halfangle) * unit_axis
-    q  = np.concatenate(([np.cos(halfangle)], ax))
+        return integrated
 
-    return Rotation.from_quat(q)
+    @staticmethod
+    def _x_average_analytic(x: Union[float, np.ndarray], w_x: Union[float, np.ndarray], deviation: float, modulation: str) -> Union[float, np.ndarray]:
+        """Time average of exp(-2 (x - deviation * modulation(t))^2 / w_x^2), see intensity_average_analytic"""
+
+        if deviation == 0:
+            return np.exp(-2*(x/w_x)**2)
+
+        if modulation == "ramp":
+            # 1/(2d) * int_{-d}^{d} exp(-2 (x - u)^2 / w^2) du
+            return np.sqrt(np.pi/2) * w_x / (4 * deviation) * (
+                scipy.special.erf(np.sqrt(2) * (x + deviation) / w_x) - scipy.special.erf(np.sqrt(2) * (x - deviation) / w_x)
+            )
+
+        # 1/pi * int_0^pi exp(-2 (x - d cos(theta))^2 / w^2) dtheta on the Gauss-Chebyshev nodes of modulation_quadrature
+        shifts, weights = DipoleTrapLi.modulation_quadrature(deviation = deviation, modulation_function = modulation, w_min = np.min(w_x))
+
+        x_average = 0
+        for shift, weight in zip(shifts, weights):
+            x_average = x_average + weight * np.exp(-2*((x - shift)/w_x)**2)
+
+        return x_average
+
+    @staticmethod
+    def _x_average_sampled(x: Union[float, np.ndarray], w_x: Union[float, np.ndarray], deviation: float, modulation_function: Callable, numsamples: int) -> np.ndarray:
+        # Simpson average over t of exp(-2 ((x - deviation * modulation(t)) / w_x)^2), x and w_x broadcast against each other.
+        # The exponent is evaluated in place in a single (points x numsamples) buffer, which is what AVERAGE_TEMPORARIES counts
+        ts     = np.linspace(start = 0, stop = 1, endpoint = True, num = numsamples)
+        shifts = deviation * np.broadcast_to(modulation_function(ts), ts.shape)
+
+        x, w_x = np.broadcast_arrays(np.asarray(x, dtype = np.float64), np.asarray(w_x, dtype = np.float64))
+
+        f_of_t = np.subtract.outer(x, shifts)
+        np.divide(f_of_t, w_x[..., np.newaxis], out = f_of_t)
+        np.square(f_of_t, out = f_of_t)
+        np.multiply(f_of_t, -2, out = f_of_t)
+        np.exp(f_of_t, out = f_of_t)
+
+        return f_of_t @ _unit_simpson_weights(numsamples)
+
+    # Number of (points x numsamples) float64 arrays alive at the same time in intensity_average and _intensity_separable,
+    # the single buffer of _x_average_sampled. The (points) arrays next to it are counted by GRID_TEMPORARIES.
+    # Measured peak of the temporaries (tracemalloc and RSS) for 1e5 - 1.6e6 points: 0.97 - 0.98 times max_bytes
+    AVERAGE_TEMPORARIES = 1
+    # Allocations of every block that do not depend on its size, e.g. the ufunc and BLAS buffers (measured at about 130 kB)
+    AVERAGE_BLOCK_OVERHEAD = 256 * 1024
+
+    @staticmethod
+    def average_chunksize(numsamples: int, max_bytes: int) -> int:
+        """Returns the number of points that can be passed through intensity_average at once
+        while keeping the (points x numsamples) intermediates within the memory budget
+
+        Args:
+            numsamples (int): Number of samples taken for the integration
+            max_bytes (int): Memory budget [bytes]
+
+        Returns:
+            int: Number of points per block (at least 1)
+        """
+
+        bytes_per_point = (DipoleTrapLi.AVERAGE_TEMPORARIES * numsamples + DipoleTrapLi.GRID_TEMPORARIES) * np.dtype(np.float64).itemsize
+
+        return max(1, int((max_bytes - DipoleTrapLi.AVERAGE_BLOCK_OVERHEAD) // bytes_per_point))
+
+    @staticmethod
+    def _intensity_separable(
+            x: np.ndarray, y: np.ndarray, z: np.ndarray,
+            power: float, 
+            wavelength: float,
+            w_0: Tuple[float, float],
+            z_0: Tuple[float, float],
+            Msq: Tuple[float, float],
+            deviation: float,
+            modulation_function: Union[Callable, str, None],
+            numsamples: int
+        ) -> np.ndarray:
+        """Intensity of a beam aligned with the grid axes in the (len(z), len(y), len(x)) layout, see intensity_grid.
+        I(x, y, z) = I0(z) * X(x, z) * Y(y, z), so the widths and I0 are evaluated once per z row and the exponentials once per (z, x) and (z, y).
+        """
+
+        w_x = DipoleTrapLi.gaussian_beam_width(z = z, w_0 = w_0[0], z_0 = z_0[0], Msq = Msq[0], wavelength = wavelength)[:, np.newaxis]
+        w_y = DipoleTrapLi.gaussian_beam_width(z = z, w_0 = w_0[1], z_0 = z_0[1], Msq = Msq[1], wavelength = wavelength)[:, np.newaxis]
+
+        I0 = DipoleTrapLi.max_intensity(power = power, width_x = w_x, width_y = w_y)
+
+        if modulation_function is None or deviation == 0:
+            x_factor = np.exp(-2*(x[np.newaxis, :]/w_x)**2)
+        elif isinstance(modulation_function, str):
+            x_factor = DipoleTrapLi._x_average_analytic(x = x[np.newaxis, :], w_x = w_x, deviation = deviation, modulation = modulation_function)
+        else:
+            x_factor = DipoleTrapLi._x_average_sampled(x = x[np.newaxis, :], w_x = w_x, deviation = deviation, modulation_function = modulation_function, numsamples = numsamples)
+
+        y_factor = np.exp(-2*(y[np.newaxis, :]/w_y)**2)
+
+        return (I0 * y_factor)[:, :, np.newaxis] * x_factor[:, np.newaxis, :]
+
+    # Default memory budget for one tile of intensity_grid
+    GRID_TILE_BYTES = 64 * 1024**2
+    # Number of (points) float64 arrays alive at the same time for a static tile (3 beam coordinates + temporaries)
+    GRID_TEMPORARIES = 8
+
+    @staticmethod
+    def grid_rows_per_tile(numpoints_x: int, numpoints_y: int, max_bytes: int, numsamples: Union[int, None] = None, separable: bool = False) -> int:
+        """Returns the number of z rows of a structured grid that intensity_grid evaluates at once within the memory budget
+
+        Args:
+            numpoints_x (int): Length of the x axis
+            numpoints_y (int): Length of the y axis
+            max_bytes (int): Memory budget [bytes]
+            numsamples (Union[int, None], optional): Number of time samples for a sampled time average. Defaults to None (static or closed form).
+            separable (bool, optional): Whether the beam is evaluated as an outer product. Defaults to False.
+
+        Returns:
+            int: Number of z rows per tile (at least 1)
+        """
+
+        if numsamples is not None:
+            # the time samples only multiply the x-z part when separable
+            bytes_per_point = (DipoleTrapLi.AVERAGE_TEMPORARIES * numsamples + DipoleTrapLi.GRID_TEMPORARIES) * np.dtype(np.float64).itemsize
+            points_per_row  = numpoints_x if separable else numpoints_x * numpoints_y
+        else:
+            bytes_per_point = DipoleTrapLi.GRID_TEMPORARIES * np.dtype(np.float64).itemsize
+            points_per_row  = numpoints_x * numpoints_y
+
+        return max(1, int(max_bytes // (bytes_per_point * points_per_row)))
+
+    @staticmethod
+    def intensity_grid(
+            x: np.ndarray, y: Union[float, np.ndarray], z: np.ndarray,
+            power: float, 
+            wavelength: float,
+            w_0: Tuple[float, float],
+            z_0: Tuple[float, float],
+            Msq: Tuple[float, float],
+            rotation_axis: Union[np.ndarray, None] = None,
+            degrees: float = 0,
+            deviation: float = 0,
+            modulation_function: Union[Callable, str, None] = None,
+            numsamples: int = 200,
+            max_bytes: Union[int, None] = None,
+            separable: Union[bool, None] = None,
+            verbose: bool = True,
+            backend: Union[str, None] = None
+        ) -> np.ndarray:
+        """Returns the (optionally time-averaged) intensity of a gaussian beam on the structured grid spanned by the axes x, y and z, 
+        with the beam rotated against the grid like rotate_points(cartesian_product(x, y, z), rotation_axis, degrees).
+
+        The beam coordinates are computed tile by tile (blocks of z rows) as an affine transform of the axes, 
+        so the full point cloud is never allocated.
+
+        If the beam is aligned with the grid axes, the beam widths and the peak intensity only depend on z 
+        and the transverse profile factorises into an x and a y part. They are then computed once per z row (and per x or y value) 
+        and the field is formed as an outer product.
+
+        Note that this function is normalized if:
+        - Everything is in SI-Units, or
+        - w, w_0: [um], z, z_0: [mm], lmbda: [nm] (preferred)
+
+        Args:
+            x (np.ndarray): Grid axis x                                                     [m, um]
+            y (Union[float, np.ndarray]): Grid axis y, or a single value for the x-z plane [m, um]
+            z (np.ndarray): Grid axis z                                                     [m, mm]
+            power (float): Power of the beam                                                [W]
+            wavelength (float): Wavelength of the light                                     [m, nm]
+            w_0 (Tuple[float, float]): Tuple of the beam waist (x, y axes)                  [m, um]
+            z_0 (Tuple[float, float]): Tuple of the rayleigh length (x, y axes)             [m, mm]
+            Msq (Tuple[float, float]): Tuple of the beam quality factor M^2 (x, y axes)
+            rotation_axis (Union[np.ndarray, None], optional): Rotation axis of the beam, see rotate_points. Defaults to None (no rotation).
+            degrees (float, optional): Degrees to rotate. Defaults to 0.
+            deviation (float, optional): Amplitude of the modulation [m, um]. Defaults to 0.
+            modulation_function (Union[Callable, str, None], optional): Function to modulate the position with (see intensity_average), 
+                or the name of a modulation with a closed form (see intensity_average_analytic). Defaults to None (static beam).
+            numsamples (int, optional): Number of samples to take for the integration. Defaults to 200.
+            max_bytes (Union[int, None], optional): Memory budget for one tile [bytes]. Defaults to None (GRID_TILE_BYTES).
+            separable (Union[bool, None], optional): Use the outer-product evaluation for a beam aligned with the grid axes, 
+                raises a ValueError for a rotated beam. Defaults to None (detect from the rotation).
+            verbose (bool, optional): Print progress. Defaults to True.
+            backend (Union[str, None], optional): Backend for rotated beams, see resolve_backend. Defaults to None.
+
+        Returns:
+            np.ndarray: The intensity in the (len(z), len(x)) layout, or (len(z), len(y), len(x)) if y has more than one value [W/m^2, W/um^2]
+        """
+
+        x = np.asarray(x, dtype = np.float64)
+        y = np.atleast_1d(np.asarray(y, dtype = np.float64))
+        z = np.asarray(z, dtype = np.float64)
+
+        if rotation_axis is None:
+            R = np.identity(3)
+        else:
+            R = rotation_matrix(axis = rotation_axis, degrees = degrees)
+
+        aligned = bool(np.allclose(R, np.identity(3)))
+
+        if separable is None:
+            separable = aligned
+        elif separable and not aligned:
+            raise ValueError("separable evaluation requires a beam aligned with the grid axes, the rotation would be ignored")
+
+        if max_bytes is None:
+            max_bytes = DipoleTrapLi.GRID_TILE_BYTES
+
+        static = modulation_function is None or deviation == 0
+
+        rows_per_tile = DipoleTrapLi.grid_rows_per_tile(
+            numpoints_x = len(x), numpoints_y = len(y), 
+            max_bytes = max_bytes, 
+            numsamples = None if static or not callable(modulation_function) else numsamples,
+            separable = separable)
+        numtiles = -(-len(z) // rows_per_tile)
+
+        out = np.empty((len(z), len(y), len(x)), dtype = np.float64)
+
+        _message = "Calculating Intensities on Grid..."
+        
+        for i in range(numtiles):
+            if verbose:
+                print(f"{_message}{i + 1}/{numtiles}", end = "\r")
+
+            _slice = slice(i * rows_per_tile, (i + 1) * rows_per_tile)
+
+            if separable:
+                out[_slice] = DipoleTrapLi._intensity_separable(
+                    x = x, y = y, z = z[_slice],
+                    power = power, wavelength = wavelength,
+                    w_0 = w_0, z_0 = z_0, Msq = Msq,
+                    deviation = 0 if static else deviation,
+                    modulation_function = modulation_function,
+                    numsamples = numsamples)
+                continue
+
+            xb, yb, zb = beam_coordinates(x = x, y = y, z = z[_slice], R = R)
+
+            if static and resolve_backend(backend) == "numba":
+                out[_slice] = DipoleTrapLi.intensity(
+                    x = xb.ravel(), y = yb.ravel(), z = zb.ravel(),
+                    power = power, wavelength = wavelength,
+                    w_0 = w_0, z_0 = z_0, Msq = Msq,
+                    verbose = False,
+                    backend = backend).reshape(xb.shape)
+            elif static:
+                out[_slice] = DipoleTrapLi._intensity_profile(
+                    x = xb, y = yb, z = zb,
+                    power = power, wavelength = wavelength,
+                    w_0 = w_0, z_0 = z_0, Msq = Msq)
+            elif isinstance(modulation_function, str):
+                out[_slice] = DipoleTrapLi.intensity_average_analytic(
+                    x = xb, y = yb, z = zb,
+                    power = power, wavelength = wavelength,
+                    w_0 = w_0, z_0 = z_0, Msq = Msq,
+                    deviation = deviation,
+                    modulation = modulation_function,
+                    verbose = False)
+            else:
+                out[_slice] = DipoleTrapLi.intensity_average(
+                    x = xb.ravel(), y = yb.ravel(), z = zb.ravel(),
+                    power = power, wavelength = wavelength,
+                    w_0 = w_0, z_0 = z_0, Msq = Msq,
+                    numsamples = numsamples,
+                    deviation = deviation,
+                    modulation_function = modulation_function,
+                    verbose = False,
+                    backend = backend).reshape(xb.shape)
+
+        if verbose:
+            print(f"{_message}Done!".ljust(len(_message) + 2 * len(str(numtiles)) + 1))
+
+        if len(y) == 1:
+            return out[:, 0, :]
+
+        return out
+
+    @staticmethod
+    def _inverse_square_width(z: np.ndarray, w_0: float, z_0: float, Msq: float, wavelength: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Returns a = 1/w(z)^2 and its first and second derivative in z, see gaussian_beam_width"""
+        z_R = np.pi * w_0**2 / (Msq * wavelength)
+        u   = (z - z_0) / z_R
+        q   = 1 + u**2
+
+        a   = 1 / (w_0**2 * q)
+        da  = -a * 2 * u / (z_R * q)
+        dda = a * (8 * u**2 / (z_R * q)**2 - 2 / (z_R**2 * q))
+
+        return a, da, dda
+
+    @staticmethod
+    def intensity_derivatives(
+            x: Union[float, np.ndarray], y: Union[float, np.ndarray], z: Union[float, np.ndarray],
+            power: float, 
+            wavelength: float,
+            w_0: Tuple[float, float],
+            z_0: Tuple[float, float],
+            Msq: Tuple[float, float],
+            order: int = 2
+        ) -> Tuple[np.ndarray, np.ndarray, Union[np.ndarray, None]]:
+        """Returns the intensity of a gaussian beam together with its analytic gradient and Hessian in the frame of the beam.
+
+        With a = 1/w^2 the logarithm of the intensity is L = log(2P/pi) + (log a_x + log a_y)/2 - 2 x^2 a_x - 2 y^2 a_y, 
+        whose derivatives are simple, and grad I = I grad L, H(I) = I (H(L) + grad L grad L^T).
+
+        Args:
+            x (Union[float, np.ndarray]): x position (one of the main axes)     [m]
+            y (Union[float, np.ndarray]): y position (one of the main axes)     [m]
+            z (Union[float, np.ndarray]): z position (propagation direction)    [m]
+            power (float): Power of the beam                                    [W]
+            wavelength (float): Wavelength of the light                         [m]
+            w_0 (Tuple[float, float]): Tuple of the beam waist (x, y axes)      [m]
+            z_0 (Tuple[float, float]): Tuple of the rayleigh length (x, y axes) [m]
+            Msq (Tuple[float, float]): Tuple of the beam quality factor M^2 (x, y axes)
+            order (int, optional): 2 for the Hessian too, 1 for the gradient only (e.g. the force in an integrator). Defaults to 2.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, Union[np.ndarray, None]]: Intensity [W/m^2] in the broadcast shape S of x, y and z, 
+                its gradient [W/m^3] of shape (*S, 3) and its Hessian [W/m^4] of shape (*S, 3, 3) (None for order 1)
+        """
+
+        x, y, z = np.broadcast_arrays(*(np.asarray(c, dtype = np.float64) for c in (x, y, z)))
+
+        a_x, da_x, dda_x = DipoleTrapLi._inverse_square_width(z = z, w_0 = w_0[0], z_0 = z_0[0], Msq = Msq[0], wavelength = wavelength)
+        a_y, da_y, dda_y = DipoleTrapLi._inverse_square_width(z = z, w_0 = w_0[1], z_0 = z_0[1], Msq = Msq[1], wavelength = wavelength)
+
+        I = (2 * power / np.pi) * np.sqrt(a_x * a_y) * np.exp(-2 * (x**2 * a_x + y**2 * a_y))
+
+        L = np.empty((*x.shape, 3))
+        L[..., 0] = -4 * x * a_x
+        L[..., 1] = -4 * y * a_y
+        L[..., 2] = (da_x / a_x + da_y / a_y) / 2 - 2 * (x**2 * da_x + y**2 * da_y)
+
+        gradient = I[..., np.newaxis] * L
+
+        if order == 1:
+            return I, gradient, None
+
+        H = np.zeros((*x.shape, 3, 3))
+        H[..., 0, 0] = -4 * a_x
+        H[..., 1, 1] = -4 * a_y
+        H[..., 0, 2] = H[..., 2, 0] = -4 * x * da_x
+        H[..., 1, 2] = H[..., 2, 1] = -4 * y * da_y
+        H[..., 2, 2] = (dda_x / a_x - (da_x / a_x)**2 + dda_y / a_y - (da_y / a_y)**2) / 2 - 2 * (x**2 * dda_x + y**2 * dda_y)
+
+        hessian  = I[..., np.newaxis, np.newaxis] * (H + L[..., :, np.newaxis] * L[..., np.newaxis, :])
+
+        return I, gradient, hessian
+
+    @staticmethod
+    def modulation_quadrature(deviation: float, modulation_function: Union[Callable, str], w_min: float, numsamples: int = 200) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns beam shifts and weights such that the time average of f(x - deviation * modulation(t)) is sum(weights * f(x - shifts)).
+
+        - "sine": Gauss-Chebyshev nodes of the arcsine dwell-time density, as in intensity_average_analytic
+        - "ramp": Gauss-Legendre nodes of the uniform dwell-time density
+        - Callable: Simpson samples of t, as in intensity_average
+
+        Args:
+            deviation (float): Amplitude of the modulation                      [m, um]
+            modulation_function (Union[Callable, str]): Modulation function, or "ramp" or "sine"
+            w_min (float): Smallest beam width along the sweep, sets the number of nodes for "ramp" and "sine" [m, um]
+            numsamples (int, optional): Number of samples for a callable. Defaults to 200.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Shifts [m, um] and weights (summing to 1)
+        """
+
+        if not isinstance(modulation_function, str):
+            ts = np.linspace(start = 0, stop = 1, endpoint = True, num = numsamples)
+            return deviation * np.broadcast_to(modulation_function(ts), ts.shape), _unit_simpson_weights(numsamples)
+
+        if modulation_function not in MODULATION_FUNCTIONS:
+            raise ValueError(f"Unknown modulation '{modulation_function}', must be one of {list(MODULATION_FUNCTIONS.keys())}")
+
+        # 8 nodes per beam width swept over reaches machine precision
+        numnodes = int(np.ceil(8 * deviation / w_min)) + 16
+
+        if modulation_function == "sine":
+            thetas = (2 * np.arange(1, numnodes + 1) - 1) * np.pi / (2 * numnodes)
+            return deviation * np.cos(thetas), np.full(numnodes, 1 / numnodes)
+
+        nodes, weights = _unit_leggauss(numnodes)
+        return deviation * nodes, weights
+
+    @staticmethod
+    def intensity_average_derivatives(
+            x: Union[float, np.ndarray], y: Union[float, np.ndarray], z: Union[float, np.ndarray],
+            power: float, 
+            wavelength: float,
+            w_0: Tuple[float, float],
+            z_0: Tuple[float, float],
+            Msq: Tuple[float, float],
+            deviation: float,
+            modulation_function: Union[Callable, str],
+            numsamples: int = 200,
+            order: int = 2
+        ) -> Tuple[np.ndarray, np.ndarray, Union[np.ndarray, None]]:
+        """Time-averaged intensity of a swept gaussian beam with its gradient and Hessian in the frame of the beam. 
+        Averaging and differentiation commute, so this is the weighted sum of intensity_derivatives over the quadrature 
+        of modulation_quadrature. The arguments are the ones of intensity_average and intensity_average_analytic, and order the one of intensity_derivatives.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, Union[np.ndarray, None]]: Intensity [W/m^2], gradient [W/m^3] and Hessian [W/m^4], see intensity_derivatives
+        """
+
+        params = { "power": power, "wavelength": wavelength, "w_0": w_0, "z_0": z_0, "Msq": Msq, "order": order }
+
+        if deviation == 0:
+            return DipoleTrapLi.intensity_derivatives(x = x, y = y, z = z, **params)
+
+        x, y, z = np.broadcast_arrays(*(np.asarray(c, dtype = np.float64) for c in (x, y, z)))
+        w_min = np.min(DipoleTrapLi.gaussian_beam_width(z = z, w_0 = w_0[0], z_0 = z_0[0], Msq = Msq[0], wavelength = wavelength))
+
+        shifts, weights = DipoleTrapLi.modulation_quadrature(deviation = deviation, modulation_function = modulation_function, w_min = w_min, numsamples = numsamples)
+
+        # All nodes in one call along a leading axis, which the weights then contract
+        shifts = np.reshape(shifts, (-1, *([1] * x.ndim)))
+        I, gradient, hessian = DipoleTrapLi.intensity_derivatives(x = x - shifts, y = y, z = z, **params)
+
+        return tuple(None if value is None else np.tensordot(weights, value, axes = 1) for value in (I, gradient, hessian)) # type: ignore
+
+    # Mass of a lithium-6 atom [kg]
+    LI6_MASS = 9.9883414e-27
+
+    @staticmethod
+    def trap_frequencies(hessian: np.ndarray, mass: float = LI6_MASS) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the trap frequencies omega = sqrt(lambda / m) of the eigenvalues lambda of the Hessian of the potential, 
+        i.e. of the harmonic approximation around a minimum
+
+        Args:
+            hessian (np.ndarray): (3,3) Hessian of the potential [J/m^2]
+            mass (float, optional): Mass of the atom [kg]. Defaults to LI6_MASS.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Angular trap frequencies [rad/s], ascending (nan for a direction that is not confining),
+                and the principal axes as the columns of a (3,3) matrix
+        """
+
+        eigenvalues, axes = np.linalg.eigh(hessian)
+
+        with np.errstate(invalid = "ignore"):
+            omega = np.sqrt(eigenvalues / mass)
+
+        return omega, axes
+
+
+def resolve_backend(backend: Union[str, None] = None) -> str:
+    """Returns the backend used for the point-wise kernels. 
+    None selects numba if it is installed, and "numba" falls back to "numpy" if it is not.
+
+    Args:
+        backend (Union[str, None], optional): "numpy", "numba" or None. Defaults to None.
+
+    Returns:
+        str: "numpy" or "numba"
+    """
+
+    if backend not in (None, "numpy", "numba"):
+        raise ValueError(f"Unknown backend '{backend}', must be 'numpy' or 'numba'")
+
+    if backend == "numpy" or numba is None:
+        return "numpy"
+
+    return "numba"
+
+def set_jit_threads(threads: Union[int, None]) -> None:
+    """Limits the threads of the parallel numba kernels in this process, e.g. to 1 in every worker of a pool 
+    or MPI rank that already has its own core. Does nothing without numba.
+
+    Args:
+        threads (Union[int, None]): Number of threads, at most NUMBA_NUM_THREADS. None keeps the current setting.
+    """
+
+    if numba is None or threads is None:
+        return
+
+    numba.set_num_threads(max(1, min(int(threads), numba.config.NUMBA_NUM_THREADS)))
+
+def _jit_compatible(x: Union[float, np.ndarray], y: Union[float, np.ndarray], z: Union[float, np.ndarray]) -> bool:
+    """The kernels take flat arrays of points, with y and z either of the same length or scalar"""
+    if not (isinstance(x, np.ndarray) and x.ndim == 1):
+        return False
+    return all(np.ndim(a) == 0 or np.shape(a) == x.shape for a in (y, z))
+
+def simpson_weights(ts: np.ndarray) -> np.ndarray:
+    """Returns the weights w such that scipy.integrate.simpson(y, x = ts) = sum(w * y) for evenly spaced samples, in closed form.
+
+    For an odd number of samples these are the composite Simpson weights h/3 * (1, 4, 2, 4, ..., 4, 1).
+    For an even number, the first len(ts) - 1 samples get the composite weights and the last interval is integrated 
+    with the parabola through the last three samples, h/12 * (-1, 8, 5), which is the default of scipy >= 1.11. Two samples are the trapezoid.
+
+    Args:
+        ts (np.ndarray): Evenly spaced sample positions
+
+    Returns:
+        np.ndarray: Weights
+    """
+
+    ts = np.asarray(ts, dtype = np.float64)
+    numsamples = len(ts)
+
+    weights = np.zeros(numsamples)
+    if numsamples < 2:
+        return weights
+
+    h = (ts[-1] - ts[0]) / (numsamples - 1)
+    if not np.allclose(np.diff(ts), h):
+        raise ValueError("ts has to be evenly spaced")
+
+    if numsamples == 2:
+        weights[:] = h / 2
+        return weights
+
+    # Composite Simpson over an odd number of samples
+    odd = numsamples if numsamples % 2 == 1 else numsamples - 1
+    weights[1:odd - 1:2] = 4
+    weights[2:odd - 1:2] = 2
+    weights[[0, odd - 1]] = 1
+    weights *= h / 3
+
+    if odd < numsamples:
+        weights[-3:] += np.array([-1, 8, 5]) * h / 12
+
+    return weights
+
+if numba is not None:
+    @numba.njit(parallel = True, cache = True)
+    def _gaussian_beam_width_kernel(z, w_0, z_0, Msq, wavelength, out):
+        factor = ((Msq * wavelength) / (np.pi * (w_0**2)))**2
+        for i in numba.prange(z.shape[0]):
+            out[i] = w_0 * np.sqrt(1 + ((z[i] - z_0)**2) * factor)
+
+    @numba.njit(parallel = True, cache = True)
+    def _intensity_kernel(x, y, z, power, wavelength, w_0x, w_0y, z_0x, z_0y, Msq_x, Msq_y, shifts, weights, out):
+        factor_x = ((Msq_x * wavelength) / (np.pi * (w_0x**2)))**2
+        factor_y = ((Msq_y * wavelength) / (np.pi * (w_0y**2)))**2
+
+        for i in numba.prange(x.shape[0]):
+            w_x = w_0x * np.sqrt(1 + ((z[i] - z_0x)**2) * factor_x)
+            w_y = w_0y * np.sqrt(1 + ((z[i] - z_0y)**2) * factor_y)
+            I0  = (2 * power) / (np.pi * (w_x * w_y))
+
+            # inline quadrature over the shifted beam positions
+            acc = 0.0
+            for j in range(shifts.shape[0]):
+                acc += weights[j] * np.exp(-2*((x[i] - shifts[j])/w_x)**2)
+
+            out[i] = I0 * np.exp(-2*(y[i]/w_y)**2) * acc
+
+class Beam():
+    def __init__(self, 
+            power: float,
+            w_0: Tuple[float, float],
+            z_0: Tuple[float, float],
+            Msq: Tuple[float, float],
+            rotation_axis: Union[np.ndarray, None] = None,
+            degrees: float = 0,
+            deviation: float = 0,
+            modulation_function: Union[Callable, str, None] = None,
+            numsamples: int = 200
+        ) -> None:
+        """A single (optionally painted) gaussian beam of a trap configuration. The parameters are the ones of DipoleTrapLi.intensity_grid.
+
+        Args:
+            power (float): Power of the beam                                                [W]
+            w_0 (Tuple[float, float]): Tuple of the beam waist (x, y axes)                  [m]
+            z_0 (Tuple[float, float]): Tuple of the rayleigh length (x, y axes)             [m]
+            Msq (Tuple[float, float]): Tuple of the beam quality factor M^2 (x, y axes)
+            rotation_axis (Union[np.ndarray, None], optional): Rotation axis of the beam, see rotate_points. Defaults to None (no rotation).
+            degrees (float, optional): Degrees to rotate. Defaults to 0.
+            deviation (float, optional): Amplitude of the modulation [m]. Defaults to 0.
+            modulation_function (Union[Callable, str, None], optional): Modulation of the beam position. Defaults to None (static beam).
+            numsamples (int, optional): Number of samples to take for the time integration. Defaults to 200.
+        """
+
+        self.power = power
+        self.w_0 = w_0
+        self.z_0 = z_0
+        self.Msq = Msq
+        self.rotation_axis = rotation_axis
+        self.degrees = degrees
+        self.deviation = deviation
+        self.modulation_function = modulation_function
+        self.numsamples = numsamples
+
+    @property
+    def R(self) -> np.ndarray:
+        """(3,3) rotation matrix from the grid frame into the beam frame"""
+        if self.rotation_axis is None:
+            return np.identity(3)
+        return _cached_rotation_matrix(axis = tuple(np.ravel(self.rotation_axis)), degrees = self.degrees)
+
+    @property
+    def static(self) -> bool:
+        return self.modulation_function is None or self.deviation == 0
+
+    @property
+    def key(self) -> tuple:
+        """Everything except the power that determines the field of the beam"""
+        return (
+            tuple(self.w_0), tuple(self.z_0), tuple(self.Msq),
+            None if self.rotation_axis is None else tuple(np.ravel(self.rotation_axis)), self.degrees,
+            self.deviation, self.modulation_function, self.numsamples)
+
+    def rows_per_tile(self, numpoints_x: int, numpoints_y: int, max_bytes: int) -> int:
+        """See DipoleTrapLi.grid_rows_per_tile"""
+        return DipoleTrapLi.grid_rows_per_tile(
+            numpoints_x = numpoints_x, numpoints_y = numpoints_y, 
+            max_bytes = max_bytes, 
+            numsamples = None if self.static or not callable(self.modulation_function) else self.numsamples,
+            separable = bool(np.allclose(self.R, np.identity(3))))
+
+    def intensity_grid(self, x: np.ndarray, y: Union[float, np.ndarray], z: np.ndarray, wavelength: float, power: Union[float, None] = None, **kwargs) -> np.ndarray:
+        """Intensity of the beam on the grid spanned by x, y and z, see DipoleTrapLi.intensity_grid
+
+        Args:
+            x (np.ndarray): Grid axis x                                                     [m]
+            y (Union[float, np.ndarray]): Grid axis y, or a single value for the x-z plane [m]
+            z (np.ndarray): Grid axis z                                                     [m]
+            wavelength (float): Wavelength of the light                                     [m]
+            power (Union[float, None], optional): Overrides the power of the beam [W]. Defaults to None.
+
+        Returns:
+            np.ndarray: Intensity [W/m^2]
+        """
+        return DipoleTrapLi.intensity_grid(
+            x = x, y = y, z = z,
+            power = self.power if power is None else power,
+            wavelength = wavelength,
+            w_0 = self.w_0, z_0 = self.z_0, Msq = self.Msq,
+            rotation_axis = self.rotation_axis, degrees = self.degrees,
+            deviation = self.deviation,
+            modulation_function = self.modulation_function,
+            numsamples = self.numsamples,
+            **kwargs)
+
+    def intensity_points(self, x: Union[float, np.ndarray], y: Union[float, np.ndarray], z: Union[float, np.ndarray], wavelength: float, power: Union[float, None] = None) -> np.ndarray:
+        """Intensity of the beam at arbitrary points given in the grid frame, e.g. for local optimisers
+
+        Args:
+            x (Union[float, np.ndarray]): x-coordinates of the points                         [m]
+            y (Union[float, np.ndarray]): y-coordinates of the points                         [m]
+            z (Union[float, np.ndarray]): z-coordinates of the points                         [m]
+            wavelength (float): Wavelength of the light                                     [m]
+            power (Union[float, None], optional): Overrides the power of the beam [W]. Defaults to None.
+
+        Returns:
+            np.ndarray: Intensity [W/m^2] in the broadcast shape of x, y and z
+        """
+
+        x, y, z = np.broadcast_arrays(*(np.asarray(c, dtype = np.float64) for c in (x, y, z)))
+        R = self.R
+
+        # Same transform as beam_coordinates, point by point
+        xb, yb, zb = (R[i, 0] * x + R[i, 1] * y + R[i, 2] * z for i in range(3))
+
+        params = {
+            "power": self.power if power is None else power, "wavelength": wavelength,
+            "w_0": self.w_0, "z_0": self.z_0, "Msq": self.Msq
+        }
+
+        if self.static:
+            return DipoleTrapLi._intensity_profile(x = xb, y = yb, z = zb, **params)
+
+        if isinstance(self.modulation_function, str):
+            return DipoleTrapLi.intensity_average_analytic(x = xb, y = yb, z = zb, deviation = self.deviation, modulation = self.modulation_function, verbose = False, **params)
+
+        return DipoleTrapLi.intensity_average(
+            x = xb.ravel(), y = yb.ravel(), z = zb.ravel(),
+            deviation = self.deviation, modulation_function = self.modulation_function, numsamples = self.numsamples,
+            verbose = False, **params).reshape(xb.shape)
+
+    def intensity_derivatives(self, 
+            x: Union[float, np.ndarray], y: Union[float, np.ndarray], z: Union[float, np.ndarray], 
+            wavelength: float, 
+            power: Union[float, None] = None,
+            order: int = 2,
+            phase: Union[float, None] = None
+        ) -> Tuple[np.ndarray, np.ndarray, Union[np.ndarray, None]]:
+        """Intensity of the beam with its analytic gradient and Hessian at points given in the grid frame, 
+        see DipoleTrapLi.intensity_derivatives and DipoleTrapLi.intensity_average_derivatives
+
+        Args:
+            x (Union[float, np.ndarray]): x-coordinates of the points                         [m]
+            y (Union[float, np.ndarray]): y-coordinates of the points                         [m]
+            z (Union[float, np.ndarray]): z-coordinates of the points                         [m]
+            wavelength (float): Wavelength of the light                                     [m]
+            power (Union[float, None], optional): Overrides the power of the beam [W]. Defaults to None.
+            order (int, optional): 2 for the Hessian too, 1 for the gradient only. Defaults to 2.
+            phase (Union[float, None], optional): Time in units of the modulation period. If given, the instantaneous intensity 
+                with the beam at deviation * modulation(phase) is returned instead of the time average. Defaults to None.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, Union[np.ndarray, None]]: Intensity [W/m^2], gradient [W/m^3] and Hessian [W/m^4] (None for order 1) in the grid frame
+        """
+
+        x, y, z = np.broadcast_arrays(*(np.asarray(c, dtype = np.float64) for c in (x, y, z)))
+        R = self.R
+
+        xb, yb, zb = (R[i, 0] * x + R[i, 1] * y + R[i, 2] * z for i in range(3))
+
+        params = {
+            "power": self.power if power is None else power, "wavelength": wavelength,
+            "w_0": self.w_0, "z_0": self.z_0, "Msq": self.Msq, "order": order
+        }
+
+        if self.static:
+            I, gradient, hessian = DipoleTrapLi.intensity_derivatives(x = xb, y = yb, z = zb, **params)
+        elif phase is not None:
+            modulation = MODULATION_FUNCTIONS[self.modulation_function] if isinstance(self.modulation_function, str) else self.modulation_function
+            I, gradient, hessian = DipoleTrapLi.intensity_derivatives(x = xb - self.deviation * modulation(phase), y = yb, z = zb, **params) # type: ignore
+        else:
+            I, gradient, hessian = DipoleTrapLi.intensity_average_derivatives(
+                x = xb, y = yb, z = zb, 
+                deviation = self.deviation, modulation_function = self.modulation_function, numsamples = self.numsamples, # type: ignore
+                **params)
+
+        # Beam frame b = R p, so grad_p = R^T grad_b and H_p = R^T H_b R
+        return I, gradient @ R, None if hessian is None else R.T @ hessian @ R
+
+class FieldCache():
+    def __init__(self, maxsize: Union[int, None] = None) -> None:
+        """Cache of the intensity of beams at a power of 1 W on a grid.
+        The intensity (and thereby the potential) is linear in the power, so the field at any power is a scaling of the cached one.
+
+        Args:
+            maxsize (Union[int, None], optional): Maximum number of cached fields, the least recently used is dropped first. Defaults to None (unlimited).
+        """
+
+        self.maxsize = maxsize
+        self.fields: Dict[tuple, np.ndarray] = OrderedDict()
+
+    def unit_intensity(self, 
+            beam: Beam, 
+            x: np.ndarray, y: Union[float, np.ndarray], z: np.ndarray, 
+            wavelength: float, 
+            **kwargs
+        ) -> np.ndarray:
+        """Intensity of the beam per watt on the grid spanned by x, y and z, computed on the first request.
+        The keyword arguments are passed on to Beam.intensity_grid.
+
+        Args:
+            beam (Beam): Beam, its power is ignored
+            x (np.ndarray): Grid axis x                                                     [m]
+            y (Union[float, np.ndarray]): Grid axis y, or a single value for the x-z plane [m]
+            z (np.ndarray): Grid axis z                                                     [m]
+            wavelength (float): Wavelength of the light                                     [m]
+
+        Returns:
+            np.ndarray: Intensity per watt [W/m^2/W], read-only
+        """
+
+        x = np.asarray(x, dtype = np.float64)
+        y = np.atleast_1d(np.asarray(y, dtype = np.float64))
+        z = np.asarray(z, dtype = np.float64)
+
+        key = (beam.key, wavelength, x.tobytes(), y.tobytes(), z.tobytes())
+
+        if key in self.fields:
+            self.fields.move_to_end(key)
+            return self.fields[key]
+
+        field = beam.intensity_grid(x = x, y = y, z = z, wavelength = wavelength, power = 1, **kwargs)
+        field.setflags(write = False)
+
+        self.fields[key] = field
+        if self.maxsize is not None and len(self.fields) > self.maxsize:
+            self.fields.popitem(last = False)
+
+        return field
+
+    def clear(self) -> None:
+        self.fields.clear()
+
+class TrapConfiguration():
+    def __init__(self, 
+            beams: List[Beam], 
+            wavelength: float, 
+            cache: Union[FieldCache, None] = None, 
+            model: str = "two-level", 
+            polarisation: float = 0, 
+            g_F_m_F: float = 0
+        ) -> None:
+        """A dipole trap made up of several (crossed, painted) beams of the same wavelength
+
+        Args:
+            beams (List[Beam]): Beams of the trap
+            wavelength (float): Wavelength of the light [m]
+            cache (Union[FieldCache, None], optional): Cache of the per-watt fields of the beams. 
+                If given, potential_grid only scales and sums the cached fields after the first call. Defaults to None.
+            model (str, optional): Model of the polarizability, see DipoleTrapLi.potential. Defaults to "two-level".
+            polarisation (float, optional): Polarisation of the light for the multi-level model. Defaults to 0 (linear).
+            g_F_m_F (float, optional): g_F m_F of the trapped state for the multi-level model. Defaults to 0.
+        """
+
+        self.beams = beams
+        self.wavelength = wavelength
+        self.cache = cache
+        self.model = model
+        self.polarisation = polarisation
+        self.g_F_m_F = g_F_m_F
+
+    @property
+    def prefactor(self) -> float:
+        """Potential per intensity [J / (W/m^2)]"""
+        return DipoleTrapLi.potential(intensity = 1, wavelength = self.wavelength, model = self.model, polarisation = self.polarisation, g_F_m_F = self.g_F_m_F) # type: ignore
+
+    def potential_grid(self, 
+            x: np.ndarray, y: Union[float, np.ndarray], z: np.ndarray, 
+            max_bytes: Union[int, None] = None, 
+            out: Union[np.ndarray, None] = None,
+            powers: Union[Sequence[float], None] = None,
+            verbose: bool = True
+        ) -> np.ndarray:
+        """Total dipole potential of all beams on the grid spanned by x, y and z. 
+        The potential is accumulated tile by tile (blocks of z rows) into a single output buffer, 
+        so only one tile of temporaries is alive at a time, independent of the number of beams.
+
+        With a cache, the per-watt field of every beam is computed once on the whole grid 
+        and the potential is the sum of the cached fields scaled by the powers, e.g. for power scans or beam balance studies.
+
+        Args:
+            x (np.ndarray): Grid axis x                                                     [m]
+            y (Union[float, np.ndarray]): Grid axis y, or a single value for the x-z plane [m]
+            z (np.ndarray): Grid axis z                                                     [m]
+            max_bytes (Union[int, None], optional): Memory budget for one tile [bytes]. Defaults to None (DipoleTrapLi.GRID_TILE_BYTES).
+            out (Union[np.ndarray, None], optional): Preallocated output in the layout of DipoleTrapLi.intensity_grid. Defaults to None.
+            powers (Union[Sequence[float], None], optional): Power of every beam [W]. Defaults to None (the powers of the beams).
+            verbose (bool, optional): Print progress. Defaults to True.
+
+        Returns:
+            np.ndarray: Potential [J] in the (len(z), len(x)) layout, or (len(z), len(y), len(x)) if y has more than one value
+        """
+
+        x = np.asarray(x, dtype = np.float64)
+        y = np.atleast_1d(np.asarray(y, dtype = np.float64))
+        z = np.asarray(z, dtype = np.float64)
+
+        if max_bytes is None:
+            max_bytes = DipoleTrapLi.GRID_TILE_BYTES
+
+        shape = (len(z), len(y), len(x)) if len(y) > 1 else (len(z), len(x))
+
+        if out is None:
+            out = np.zeros(shape, dtype = np.float64)
+        else:
+            assert out.shape == shape, f"out has to have the shape {shape}"
+            out[...] = 0
+
+        if powers is None:
+            powers = [beam.power for beam in self.beams]
+
+        assert len(powers) == len(self.beams), "Give one power per beam"
+
+        # U = prefactor * I, the prefactor only depends on the wavelength
+        prefactor = self.prefactor
+
+        if self.cache is not None:
+            for beam, power in zip(self.beams, powers):
+                field = self.cache.unit_intensity(beam, x = x, y = y, z = z, wavelength = self.wavelength, max_bytes = max_bytes, verbose = verbose)
+                out += (prefactor * power) * field
+
+            return out
+
+        rows_per_tile = self.rows_per_tile(numpoints_x = len(x), numpoints_y = len(y), max_bytes = max_bytes)
+        numtiles = -(-len(z) // rows_per_tile)
+
+        _message = f"Calculating Potential of {len(self.beams)} Beams..."
+
+        for i in range(numtiles):
+            if verbose:
+                print(f"{_message}{i + 1}/{numtiles}", end = "\r")
+
+            _slice = slice(i * rows_per_tile, (i + 1) * rows_per_tile)
+            self._add_tile(out[_slice], x = x, y = y, z = z[_slice], powers = powers, prefactor = prefactor, max_bytes = max_bytes)
+
+        if verbose:
+            print(f"{_message}Done!".ljust(len(_message) + 2 * len(str(numtiles)) + 1))
+
+        return out
+
+    def potential_points(self, x: Union[float, np.ndarray], y: Union[float, np.ndarray], z: Union[float, np.ndarray], powers: Union[Sequence[float], None] = None) -> np.ndarray:
+        """Total dipole potential of all beams at arbitrary points, see Beam.intensity_points
+
+        Args:
+            x (Union[float, np.ndarray]): x-coordinates of the points                         [m]
+            y (Union[float, np.ndarray]): y-coordinates of the points                         [m]
+            z (Union[float, np.ndarray]): z-coordinates of the points                         [m]
+            powers (Union[Sequence[float], None], optional): Power of every beam [W]. Defaults to None (the powers of the beams).
+
+        Returns:
+            np.ndarray: Potential [J] in the broadcast shape of x, y and z
+        """
+
+        if powers is None:
+            powers = [beam.power for beam in self.beams]
+
+        prefactor = self.prefactor
+
+        return prefactor * sum(beam.intensity_points(x = x, y = y, z = z, wavelength = self.wavelength, power = power) for beam, power in zip(self.beams, powers))
+
+    def potential_derivatives(self, 
+            x: Union[float, np.ndarray], y: Union[float, np.ndarray], z: Union[float, np.ndarray], 
+            powers: Union[Sequence[float], None] = None,
+            order: int = 2,
+            phase: Union[float, None] = None
+        ) -> Tuple[np.ndarray, np.ndarray, Union[np.ndarray, None]]:
+        """Total dipole potential of all beams with its analytic gradient and Hessian at arbitrary points, see Beam.intensity_derivatives
+
+        Args:
+            x (Union[float, np.ndarray]): x-coordinates of the points                         [m]
+            y (Union[float, np.ndarray]): y-coordinates of the points                         [m]
+            z (Union[float, np.ndarray]): z-coordinates of the points                         [m]
+            powers (Union[Sequence[float], None], optional): Power of every beam [W]. Defaults to None (the powers of the beams).
+            order (int, optional): 2 for the Hessian too, 1 for the gradient only. Defaults to 2.
+            phase (Union[float, None], optional): Time in units of the modulation period for the instantaneous potential of the painted beams. 
+                Defaults to None (time average).
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, Union[np.ndarray, None]]: Potential [J] in the broadcast shape S of x, y and z, 
+                its gradient [J/m] of shape (*S, 3) and its Hessian [J/m^2] of shape (*S, 3, 3) (None for order 1)
+        """
+
+        if powers is None:
+            powers = [beam.power for beam in self.beams]
+
+        prefactor = self.prefactor
+
+        U, gradient, hessian = 0, 0, 0
+        for beam, power in zip(self.beams, powers):
+            _I, _gradient, _hessian = beam.intensity_derivatives(x = x, y = y, z = z, wavelength = self.wavelength, power = power, order = order, phase = phase)
+
+            U        = U + prefactor * _I
+            gradient = gradient + prefactor * _gradient
+            hessian  = None if _hessian is None else hessian + prefactor * _hessian
+
+        return U, gradient, hessian # type: ignore
+
+    def trap_frequencies(self, x: float, y: float, z: float, powers: Union[Sequence[float], None] = None, mass: float = DipoleTrapLi.LI6_MASS) -> Tuple[np.ndarray, np.ndarray]:
+        """Trap frequencies of the harmonic approximation at a point, usually the minimum of the trap, see DipoleTrapLi.trap_frequencies
+
+        Args:
+            x (float): x-coordinate of the point [m]
+            y (float): y-coordinate of the point [m]
+            z (float): z-coordinate of the point [m]
+            powers (Union[Sequence[float], None], optional): Power of every beam [W]. Defaults to None (the powers of the beams).
+            mass (float, optional): Mass of the atom [kg]. Defaults to DipoleTrapLi.LI6_MASS.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Angular trap frequencies [rad/s] and the principal axes as the columns of a (3,3) matrix
+        """
+
+        _, _, hessian = self.potential_derivatives(x = x, y = y, z = z, powers = powers)
+
+        return DipoleTrapLi.trap_frequencies(hessian = hessian, mass = mass)
+
+    def rows_per_tile(self, numpoints_x: int, numpoints_y: int, max_bytes: int) -> int:
+        """Number of z rows per tile such that the temporaries of every beam fit into max_bytes, see DipoleTrapLi.grid_rows_per_tile"""
+        return min(beam.rows_per_tile(numpoints_x = numpoints_x, numpoints_y = numpoints_y, max_bytes = max_bytes) for beam in self.beams)
+
+    def _add_tile(self, out: np.ndarray, x: np.ndarray, y: np.ndarray, z: np.ndarray, powers: Sequence[float], prefactor: float, max_bytes: int) -> None:
+        for beam, power in zip(self.beams, powers):
+            out += prefactor * beam.intensity_grid(x = x, y = y, z = z, wavelength = self.wavelength, power = power, max_bytes = max_bytes, verbose = False).reshape(out.shape)
+
+    def potential_volume(self, 
+            x: np.ndarray, y: np.ndarray, z: np.ndarray, 
+            filename: str,
+            max_bytes: Union[int, None] = None, 
+            powers: Union[Sequence[float], None] = None,
+            verbose: bool = True
+        ) -> np.memmap:
+        """Total dipole potential of all beams in the volume spanned by x, y and z, written slab by slab (blocks of z rows) 
+        into a memory-mapped .npy file. Every slab is flushed to disk once it is done, so neither the volume 
+        nor the cartesian product of the axes is ever held in memory. The cache is not used.
+
+        Args:
+            x (np.ndarray): Grid axis x                                                     [m]
+            y (np.ndarray): Grid axis y                                                     [m]
+            z (np.ndarray): Grid axis z                                                     [m]
+            filename (str): .npy file to write the volume to, overwritten if it exists
+            max_bytes (Union[int, None], optional): Memory budget for one slab [bytes]. Defaults to None (DipoleTrapLi.GRID_TILE_BYTES).
+            powers (Union[Sequence[float], None], optional): Power of every beam [W]. Defaults to None (the powers of the beams).
+            verbose (bool, optional): Print progress. Defaults to True.
+
+        Returns:
+            np.memmap: Potential [J] in the (len(z), len(y), len(x)) layout, read-only (reopen with np.load(filename, mmap_mode = "r+") to modify)
+        """
+
+        x = np.asarray(x, dtype = np.float64)
+        y = np.atleast_1d(np.asarray(y, dtype = np.float64))
+        z = np.asarray(z, dtype = np.float64)
+
+        if max_bytes is None:
+            max_bytes = DipoleTrapLi.GRID_TILE_BYTES
+
+        if powers is None:
+            powers = [beam.power for beam in self.beams]
+
+        assert len(powers) == len(self.beams), "Give one power per beam"
+
+        prefactor = self.prefactor
+
+        # open_memmap creates a sparse file filled with zeros
+        volume = np.lib.format.open_memmap(filename, mode = "w+", dtype = np.float64, shape = (len(z), len(y), len(x)))
+
+        rows_per_slab = self.rows_per_tile(numpoints_x = len(x), numpoints_y = len(y), max_bytes = max_bytes)
+        numslabs = -(-len(z) // rows_per_slab)
+
+        _message = f"Calculating Potential Volume of {len(self.beams)} Beams..."
+
+        for i in range(numslabs):
+            if verbose:
+                print(f"{_message}{i + 1}/{numslabs}", end = "\r")
+
+            _slice = slice(i * rows_per_slab, (i + 1) * rows_per_slab)
+            self._add_tile(volume[_slice], x = x, y = y, z = z[_slice], powers = powers, prefactor = prefactor, max_bytes = max_bytes)
+            volume.flush()
+
+        if verbose:
+            print(f"{_message}Done!".ljust(len(_message) + 2 * len(str(numslabs)) + 1))
+
+        del volume
+        return np.load(filename, mmap_mode = "r")
+
+def sine_mod(t: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+    return np.sin(2*np.pi*t)
+
+def ramp_mod(t: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+    return 2*(t - 0.5)
+
+# Modulation functions with a closed-form time average, see DipoleTrapLi.intensity_average_analytic
+MODULATION_FUNCTIONS = {
+    "ramp": ramp_mod,
+    "sine": sine_mod
+}
+
+def dwell_density(
+        deviation: float, 
+        spacing: float, 
+        modulation_function: Union[Callable, None] = None, 
+        waveform: Union[np.ndarray, None] = None,
+        numsamples: int = 2**16
+    ) -> Tuple[np.ndarray, np.ndarray]:
+    """Builds the probability density of the beam position deviation * modulation(t) over one period, 
+    binned onto a grid with the given spacing. Each sample is shared linearly between its two neighbouring bins (cloud-in-cell),
+    which keeps the binning error second order in the spacing.
+
+    Args:
+        deviation (float): Amplitude of the modulation                                         [m, um]
+        spacing (float): Bin spacing, i.e. the grid spacing along the sweep axis                [m, um]
+        modulation_function (Union[Callable, None], optional): Function of t (0 to 1) with range -1 to 1. Defaults to None.
+        waveform (Union[np.ndarray, None], optional): Samples of the modulation over one period (evenly spaced in t, without the endpoint). Defaults to None.
+        numsamples (int, optional): Number of samples of t over one period. Defaults to 2**16.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Bin positions [m, um] and their weights (summing to 1)
+    """
+
+    assert (modulation_function is None) != (waveform is None), "Give exactly one of modulation_function and waveform"
+
+    ts = np.linspace(start = 0, stop = 1, endpoint = False, num = numsamples)
+
+    if modulation_function is not None:
+        modulation = modulation_function(ts)
+    else:
+        assert waveform is not None
+        waveform   = np.asarray(waveform, dtype = np.float64)
+        table_ts   = np.linspace(start = 0, stop = 1, endpoint = False, num = len(waveform))
+        modulation = np.interp(ts, table_ts, waveform, period = 1)
+
+    positions = deviation * np.broadcast_to(modulation, ts.shape) / spacing
+
+    lower    = np.floor(positions)
+    fraction = positions - lower
+    lower    = lower.astype(np.int64)
+    k_min    = lower.min()
+
+    weights = np.bincount(lower - k_min, weights = 1 - fraction, minlength = lower.max() - k_min + 2) \
+            + np.bincount(lower - k_min + 1, weights = fraction, minlength = lower.max() - k_min + 2)
+    weights /= numsamples
+
+    offsets = (k_min + np.arange(len(weights))) * spacing
+
+    return offsets, weights
+
+def dwell_density_2d(
+        deviation_x: float, 
+        deviation_y: float, 
+        spacing_x: float, 
+        spacing_y: float, 
+        modulation_x: Union[Callable, None] = None, 
+        modulation_y: Union[Callable, None] = None, 
+        numsamples: int = 2**16
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Builds the probability density of the beam position (deviation_x * modulation_x(t), deviation_y * modulation_y(t)) over one period,
+    binned onto a 2D grid with the given spacings. Each sample is shared bilinearly between its four neighbouring bins (cloud-in-cell), see dwell_density.
+
+    Args:
+        deviation_x (float): Amplitude of the modulation along x                               [m, um]
+        deviation_y (float): Amplitude of the modulation along y                               [m, um]
+        spacing_x (float): Bin spacing along x, i.e. the grid spacing                           [m, um]
+        spacing_y (float): Bin spacing along y                                                  [m, um]
+        modulation_x (Union[Callable, None], optional): Function of t (0 to 1) with range -1 to 1. Defaults to None (no modulation).
+        modulation_y (Union[Callable, None], optional): Function of t (0 to 1) with range -1 to 1. Defaults to None (no modulation).
+        numsamples (int, optional): Number of samples of t over one period. Defaults to 2**16.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: Bin positions along x and y [m, um] and the (len(y bins), len(x bins)) weights (summing to 1)
+    """
+
+    ts = np.linspace(start = 0, stop = 1, endpoint = False, num = numsamples)
+
+    def bins(deviation: float, spacing: float, modulation: Union[Callable, None]) -> Tuple[np.ndarray, np.ndarray, int, int]:
+        # Lower bin (from 0), fraction towards the upper bin, lowest bin and number of bins along one axis
+        if modulation is None or deviation == 0:
+            positions = np.zeros(numsamples)
+        else:
+            positions = deviation * np.broadcast_to(modulation(ts), ts.shape) / spacing
+
+        lower    = np.floor(positions)
+        fraction = positions - lower
+        lower    = lower.astype(np.int64)
+        k_min    = lower.min()
+
+        return lower - k_min, fraction, k_min, lower.max() - k_min + 2
+
+    lower_x, fraction_x, kx_min, numbins_x = bins(deviation_x, spacing_x, modulation_x)
+    lower_y, fraction_y, ky_min, numbins_y = bins(deviation_y, spacing_y, modulation_y)
+
+    weights = np.zeros(numbins_y * numbins_x)
+    for dy, weight_y in ((0, 1 - fraction_y), (1, fraction_y)):
+        for dx, weight_x in ((0, 1 - fraction_x), (1, fraction_x)):
+            weights += np.bincount((lower_y + dy) * numbins_x + lower_x + dx, weights = weight_y * weight_x, minlength = len(weights))
+    weights = weights.reshape((numbins_y, numbins_x)) / numsamples
+
+    offsets_x = (kx_min + np.arange(numbins_x)) * spacing_x
+    offsets_y = (ky_min + np.arange(numbins_y)) * spacing_y
+
+    return offsets_x, offsets_y, weights
+
+def lissajous_mod(a: int = 1, b: int = 2, phase: float = np.pi/2) -> Tuple[Callable, Callable]:
+    """Lissajous figure: x = sin(2 pi a t + phase), y = sin(2 pi b t), for dwell_density_2d and DipoleTrapLi.intensity_average_2d
+
+    Returns:
+        Tuple[Callable, Callable]: Modulations along x and y
+    """
+    return functools.partial(_sine_harmonic, n = a, phase = phase), functools.partial(_sine_harmonic, n = b, phase = 0)
+
+def raster_mod(lines: int = 16) -> Tuple[Callable, Callable]:
+    """Raster: x runs back and forth (triangle) lines times per period while y ramps once from -1 to 1
+
+    Returns:
+        Tuple[Callable, Callable]: Modulations along x and y
+    """
+    return functools.partial(_triangle, n = lines / 2), ramp_mod
+
+def spiral_mod(turns: int = 16) -> Tuple[Callable, Callable]:
+    """Spiral: turns revolutions per period while the radius runs out and back in (triangle in t)
+
+    Returns:
+        Tuple[Callable, Callable]: Modulations along x and y
+    """
+    return functools.partial(_spiral, turns = turns, phase = np.pi/2), functools.partial(_spiral, turns = turns, phase = 0)
+
+def _sine_harmonic(t: Union[float, np.ndarray], n: int, phase: float) -> Union[float, np.ndarray]:
+    return np.sin(2*np.pi*n*t + phase)
+
+def _triangle(t: Union[float, np.ndarray], n: float) -> Union[float, np.ndarray]:
+    # n periods of a triangle from -1 to 1 and back
+    return 1 - 4*np.abs((n*np.asarray(t) + 0.25) % 1 - 0.5)
+
+def _spiral(t: Union[float, np.ndarray], turns: int, phase: float) -> Union[float, np.ndarray]:
+    radius = 1 - 2*np.abs(np.asarray(t) - 0.5)
+    return radius * np.sin(2*np.pi*turns*np.asarray(t) + phase)
+
+def volume_below(volume: np.ndarray, x: np.ndarray, y: Union[float, np.ndarray], z: np.ndarray, threshold: float, rows_per_slab: int = 64) -> float:
+    """Volume of the region where a (memory-mapped) potential volume lies below threshold, e.g. the trap volume at a given energy.
+    The volume is read slab by slab along z, so it does not have to fit into memory.
+    Axes with a single value do not contribute, so for the x-z plane (a single y) this is the area.
+
+    Args:
+        volume (np.ndarray): Potential in the (len(z), len(y), len(x)) or (len(z), len(x)) layout, see TrapConfiguration.potential_volume
+        x (np.ndarray): Evenly spaced grid axis x                                       [m]
+        y (Union[float, np.ndarray]): Evenly spaced grid axis y, or a single value     [m]
+        z (np.ndarray): Evenly spaced grid axis z                                       [m]
+        threshold (float): Potential threshold, same units as volume
+        rows_per_slab (int, optional): Number of z rows read at a time. Defaults to 64.
+
+    Returns:
+        float: Volume [m^3], or area [m^2] for a single y
+    """
+
+    axes = [np.atleast_1d(np.asarray(axis, dtype = np.float64)) for axis in (x, y, z)]
+    cell = float(np.prod([np.ptp(axis) / (len(axis) - 1) for axis in axes if len(axis) > 1]))
+
+    count = 0
+    for start in range(0, volume.shape[0], rows_per_slab):
+        count += np.count_nonzero(volume[start:start + rows_per_slab] < threshold)
+
+    return count * cell
+
+def transform_quaternion_angle(axis: np.ndarray, degrees: float) -> Rotation: 
+    """Generates a scipy.spatial.transform.Rotation object from a rotation axis and how many degrees to rotate.
+    The Rotation object is generated using quarternions
+
+    q = cos(a/2) + sin(a/2)(x*i + y*j + z*k)
+
+    Args:
+        axis (np.ndarray): Rotation axis in the form of (1,3) or (3,1) np array
+        degrees (float): Degrees to rotate
+
+    Returns:
+        Rotation: scipy.spatial.transform.Rotation object
+    """
+
+    halfangle = np.deg2rad(degrees)/2
+
+    unit_axis = axis.flatten()
+    unit_axis = unit_axis / np.linalg.norm(unit_axis)
+
+    ax = np.sin(halfangle) * unit_axis
+    q  = np.concatenate(([np.cos(halfangle)], ax))
+
+    return Rotation.from_quat(q)
+
+def rotation_matrix(axis: np.ndarray, degrees: float) -> np.ndarray:
+    """Returns the matrix of the rotation used in rotate_points, i.e. rotate_points(p) = p @ R.T
+
+    Args:
+        axis (np.ndarray): Rotation axis in the form of (1,3) or (3,1) np array
+        degrees (float): Degrees to rotate
+
+    Returns:
+        np.ndarray: (3,3) rotation matrix
+    """
+    return transform_quaternion_angle(axis = axis, degrees = degrees).as_matrix()
+
+# Every grid and point evaluation needs alpha of the same few wavelengths and states
+@functools.lru_cache(maxsize = 1024)
+def _alpha_table(wavelength: float, model: str, polarisation: float, g_F_m_F: float) -> complex:
+    if model == "multi-level":
+        return DipoleTrapLi.alpha_multilevel(wavelength = wavelength, unit = "m", polarisation = polarisation, g_F_m_F = g_F_m_F) # type: ignore
+    return DipoleTrapLi.alpha(wavelength = wavelength, unit = "m") # type: ignore
+
+# The quadratures of the time average only depend on the number of nodes, and optimisers ask for the same ones at every step
+@functools.lru_cache(maxsize = 64)
+def _unit_simpson_weights(numsamples: int) -> np.ndarray:
+    weights = simpson_weights(np.linspace(start = 0, stop = 1, endpoint = True, num = numsamples))
+    weights.setflags(write = False)
+    return weights
+
+@functools.lru_cache(maxsize = 64)
+def _unit_leggauss(numnodes: int) -> Tuple[np.ndarray, np.ndarray]:
+    # Gauss-Legendre nodes on -1 to 1 with the weights of the mean, i.e. summing to 1
+    nodes, weights = np.polynomial.legendre.leggauss(numnodes)
+    weights = weights / 2
+    nodes.setflags(write = False)
+    weights.setflags(write = False)
+    return nodes, weights
+
+@functools.lru_cache(maxsize = 256)
+def _cached_rotation_matrix(axis: Tuple[float, ...], degrees: float) -> np.ndarray:
+    # Beams are evaluated point by point in optimisers, building the scipy Rotation every time would dominate
+    R = rotation_matrix(axis = np.array(axis), degrees = degrees)
+    R.setflags(write = False)
+    return R
+
+def beam_coordinates(x: np.ndarray, y: np.ndarray, z: np.ndarray, R: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns the coordinates of the grid points spanned by the axes x, y and z in the frame of a beam rotated by R,
+    in the (len(z), len(y), len(x)) layout. Equivalent to rotate_points on the cartesian_product, but computed as an affine transform of the axes.
+
+    Args:
+        x (np.ndarray): Grid axis x
+        y (np.ndarray): Grid axis y
+        z (np.ndarray): Grid axis z
+        R (np.ndarray): (3,3) rotation matrix, see rotation_matrix
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: x, y and z coordinates in the frame of the beam
+    """
+
+    X = x[np.newaxis, np.newaxis, :]
+    Y = y[np.newaxis, :, np.newaxis]
+    Z = z[:, np.newaxis, np.newaxis]
+
+    return tuple(R[i, 0] * X + R[i, 1] * Y + R[i, 2] * Z for i in range(3)) # type: ignore
 
 def rotate_points(points: np.ndarray, axis: np.ndarray, degrees: float) -> np.ndarray:
     """Rotate a point or multiple points by rotating them
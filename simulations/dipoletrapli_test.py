@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+# Checks of the numerical shortcuts in dipoletrapli.py against their straightforward counterparts, run with pytest
+
+import tracemalloc
+import numpy as np
+import scipy.integrate
+
+from dipoletrapli import DipoleTrapLi, simpson_weights, sine_mod
+
+beam_params = {
+    "power": 100,              # W
+    "wavelength": 1070e-9,     # m
+    "w_0": (25e-6, 30e-6),     # m
+    "z_0": (0, 1e-4),          # m
+    "Msq": (1.1, 1.2)
+}
+
+def test_intensity_average_chunked_scalar_y():
+    # x-z plane: per-point x and z with a single y, the blocks of max_bytes have to give the unchunked result
+    rng = np.random.default_rng(0)
+    x = rng.uniform(-100e-6, 100e-6, 5000)
+    z = rng.uniform(-1e-3, 1e-3, 5000)
+
+    params = { **beam_params, "numsamples": 200, "deviation": 50e-6, "modulation_function": sine_mod, "verbose": False, "backend": "numpy" }
+
+    max_bytes = 2 * 1024**2
+    unchunked = DipoleTrapLi.intensity_average(x = x, y = 0, z = z, **params)
+
+    tracemalloc.start()
+    chunked = DipoleTrapLi.intensity_average(x = x, y = 0, z = z, max_bytes = max_bytes, **params)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # The unchunked (points x numsamples) buffer alone would be 8 MB
+    assert peak - chunked.nbytes < max_bytes
+    assert np.shape(chunked) == np.shape(unchunked)
+    np.testing.assert_allclose(chunked, unchunked, rtol = 1e-14)
+
+def test_simpson_weights_match_scipy():
+    # Odd and even numbers of samples, the even ones use the correction of the last interval
+    for numsamples in (2, 3, 4, 5, 200, 201, 2000, 2001):
+        ts = np.linspace(start = -0.3, stop = 1.7, num = numsamples)
+        f_of_t = np.exp(-2 * (ts - 0.4)**2) * np.cos(7 * ts)
+
+        np.testing.assert_allclose(simpson_weights(ts) @ f_of_t, scipy.integrate.simpson(y = f_of_t, x = ts), rtol = 1e-13, atol = 1e-15)
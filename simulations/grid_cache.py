@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+# On-disk cache for computed grids, so re-running a plotting script only recomputes what actually changed
+# Every grid is stored as a .npy file named by the hash of all its physical inputs, next to a .json file with its metadata
+
+import os
+import json
+import time
+import hashlib
+import numpy as np
+from typing import Any, Callable, Dict, List, Sequence, Union
+
+from dipoletrapli import DipoleTrapLi, TrapConfiguration
+
+# Bump to invalidate all entries when the physics of the cached functions changes
+CACHE_VERSION = 1
+
+# Number of samples of t (0 to 1) a modulation function is hashed by
+WAVEFORM_SAMPLES = 4096
+
+DEFAULT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".grid_cache")
+DEFAULT_MAX_BYTES = 8 * 1024**3
+
+def _update_hash(h: Any, value: Any) -> None:
+    # Every value is prefixed with its type, so e.g. 1 and "1" or [1, 2] and (1, 2) hash differently
+    if value is None or isinstance(value, (bool, int, float, complex, str)):
+        h.update(f"{type(value).__name__}:{value!r};".encode())
+    elif isinstance(value, np.generic):
+        _update_hash(h, value.item())
+    elif isinstance(value, np.ndarray):
+        array = np.ascontiguousarray(value)
+        h.update(f"ndarray:{array.dtype.str}:{array.shape};".encode())
+        h.update(array.tobytes())
+    elif isinstance(value, (list, tuple)):
+        h.update(f"{type(value).__name__}:{len(value)};".encode())
+        for item in value:
+            _update_hash(h, item)
+    elif isinstance(value, dict):
+        h.update(f"dict:{len(value)};".encode())
+        for key in sorted(value, key = str):
+            _update_hash(h, str(key))
+            _update_hash(h, value[key])
+    elif callable(value):
+        # Modulation functions are hashed by their waveform, so renaming or redefining them does not matter
+        ts = np.linspace(start = 0, stop = 1, num = WAVEFORM_SAMPLES, endpoint = False)
+        _update_hash(h, np.asarray(value(ts), dtype = np.float64))
+    else:
+        raise TypeError(f"Cannot hash {type(value).__name__} for the grid cache")
+
+def input_hash(inputs: Dict[str, Any]) -> str:
+    """SHA256 of the inputs of a computation.
+    Arrays are hashed by their contents and callables by their samples on WAVEFORM_SAMPLES points of t in [0, 1).
+
+    Args:
+        inputs (Dict[str, Any]): Nested dicts, lists and tuples of numbers, strings, arrays and modulation functions
+
+    Returns:
+        str: Hex digest
+    """
+    h = hashlib.sha256()
+    _update_hash(h, CACHE_VERSION)
+    _update_hash(h, inputs)
+    return h.hexdigest()
+
+class GridCache():
+    def __init__(self, directory: str = DEFAULT_DIRECTORY, max_bytes: int = DEFAULT_MAX_BYTES, verbose: bool = True) -> None:
+        """Content-addressed on-disk cache of computed grids.
+        Hits are memory-mapped instead of read, and the least recently used entries are deleted once the cache grows beyond max_bytes.
+        The key is the hash of the physical inputs only, so every rerun of a script with the same inputs loads its grids 
+        from the directory (simulations/.grid_cache unless given) instead of computing them again.
+
+        Args:
+            directory (str, optional): Cache directory. Defaults to DEFAULT_DIRECTORY (simulations/.grid_cache).
+            max_bytes (int, optional): Size limit of the cache [bytes]. Defaults to DEFAULT_MAX_BYTES (8 GiB).
+            verbose (bool, optional): Print hits and misses. Defaults to True.
+        """
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.verbose = verbose
+
+        os.makedirs(self.directory, exist_ok = True)
+
+    def _paths(self, key: str):
+        base = os.path.join(self.directory, key)
+        return f"{base}.npy", f"{base}.json"
+
+    def load(self, key: str) -> Union[np.ndarray, None]:
+        """Returns the memory-mapped (read-only) grid stored under key, or None if there is none"""
+        data_path, meta_path = self._paths(key)
+
+        try:
+            with open(meta_path, "r") as f:
+                metadata = json.load(f)
+            array = np.load(data_path, mmap_mode = "r")
+        except (OSError, ValueError):
+            return None
+
+        metadata["last_used"] = time.time()
+        self._write_metadata(meta_path, metadata)
+
+        return array
+
+    def store(self, key: str, array: np.ndarray, metadata: Union[Dict[str, Any], None] = None) -> None:
+        """Stores a grid under key, then evicts the least recently used entries if the cache is over its size limit"""
+        data_path, meta_path = self._paths(key)
+
+        # Write to a temporary file first, so an interrupted run never leaves a truncated entry behind
+        tmp_path = f"{data_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.asarray(array))
+        os.replace(tmp_path, data_path)
+
+        now = time.time()
+        self._write_metadata(meta_path, {
+            **(metadata or {}),
+            "shape": list(np.shape(array)),
+            "dtype": np.asarray(array).dtype.str,
+            "nbytes": os.path.getsize(data_path),
+            "created": now,
+            "last_used": now,
+        })
+
+        self.evict()
+
+    @staticmethod
+    def _write_metadata(meta_path: str, metadata: Dict[str, Any]) -> None:
+        tmp_path = f"{meta_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(metadata, f, indent = 4)
+        os.replace(tmp_path, meta_path)
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """Metadata of all entries, with their key"""
+        entries = []
+
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(".json"):
+                continue
+
+            try:
+                with open(os.path.join(self.directory, filename), "r") as f:
+                    metadata = json.load(f)
+            except (OSError, ValueError):
+                continue
+
+            metadata["key"] = filename[:-len(".json")]
+            entries.append(metadata)
+
+        return entries
+
+    def evict(self) -> None:
+        """Deletes the least recently used entries until the cache fits into max_bytes"""
+        entries = sorted(self.entries(), key = lambda entry: entry.get("last_used", 0))
+        total = sum(entry.get("nbytes", 0) for entry in entries)
+
+        for entry in entries:
+            if total <= self.max_bytes:
+                break
+
+            for path in self._paths(entry["key"]):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+            total -= entry.get("nbytes", 0)
+
+            if self.verbose:
+                print(f"Grid cache: evicted {entry['key'][:12]} ({entry.get('description', '')})")
+
+    def clear(self) -> None:
+        for entry in self.entries():
+            for path in self._paths(entry["key"]):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def get_or_compute(self, inputs: Dict[str, Any], compute: Callable[[], np.ndarray], description: str = "") -> np.ndarray:
+        """Returns the cached grid for the inputs, or computes and stores it on a miss
+
+        Args:
+            inputs (Dict[str, Any]): All physical inputs of the computation, see input_hash
+            compute (Callable[[], np.ndarray]): Computes the grid
+            description (str, optional): Human-readable description stored in the metadata. Defaults to "".
+
+        Returns:
+            np.ndarray: The grid, memory-mapped and read-only on a hit
+        """
+
+        key = input_hash(inputs)
+
+        array = self.load(key)
+        if array is not None:
+            if self.verbose:
+                print(f"Grid cache: hit {key[:12]} ({description})")
+            return array
+
+        if self.verbose:
+            print(f"Grid cache: miss {key[:12]} ({description})")
+
+        array = compute()
+        self.store(key, array, metadata = { "description": description })
+
+        return array
+
+    @staticmethod
+    def _axes(x: np.ndarray, y: Union[float, np.ndarray], z: np.ndarray) -> Dict[str, np.ndarray]:
+        # Same normalisation as DipoleTrapLi.intensity_grid, so y = 0 and y = np.array([0]) share an entry
+        return {
+            "x": np.asarray(x, dtype = np.float64),
+            "y": np.atleast_1d(np.asarray(y, dtype = np.float64)),
+            "z": np.asarray(z, dtype = np.float64)
+        }
+
+    def intensity_grid(self, x: np.ndarray, y: Union[float, np.ndarray], z: np.ndarray, **kwargs) -> np.ndarray:
+        """Cached DipoleTrapLi.intensity_grid, takes the same arguments"""
+        # Arguments that do not change the result are not part of the key
+        physical = { key: value for key, value in kwargs.items() if key not in ("max_bytes", "verbose", "backend", "separable") }
+
+        return self.get_or_compute(
+            inputs = { "function": "DipoleTrapLi.intensity_grid", **self._axes(x, y, z), **physical },
+            compute = lambda: DipoleTrapLi.intensity_grid(x = x, y = y, z = z, **kwargs),
+            description = "intensity_grid")
+
+    def potential_inputs(self, trap: TrapConfiguration, x: np.ndarray, y: Union[float, np.ndarray], z: np.ndarray, powers: Union[Sequence[float], None] = None) -> Dict[str, Any]:
+        """Inputs that the cache key of TrapConfiguration.potential_grid is computed from, see input_hash"""
+        if powers is None:
+            powers = [beam.power for beam in trap.beams]
+
+        return {
+            "function": "TrapConfiguration.potential_grid",
+            "wavelength": trap.wavelength,
+            "polarizability": [trap.model, trap.polarisation, trap.g_F_m_F],
+            "beams": [beam.key for beam in trap.beams],
+            "powers": list(powers),
+            **self._axes(x, y, z)
+        }
+
+    def potential_grid(self, trap: TrapConfiguration, x: np.ndarray, y: Union[float, np.ndarray], z: np.ndarray, **kwargs) -> np.ndarray:
+        """Cached TrapConfiguration.potential_grid, takes the same arguments except out"""
+        assert "out" not in kwargs, "A cache hit cannot be written into out"
+
+        return self.get_or_compute(
+            inputs = self.potential_inputs(trap, x = x, y = y, z = z, powers = kwargs.get("powers")),
+            compute = lambda: trap.potential_grid(x = x, y = y, z = z, **kwargs),
+            description = f"potential_grid of {len(trap.beams)} beams")
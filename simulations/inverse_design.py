@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+# Inverse design of the modulation waveform: finds the periodic beam modulation whose time-averaged potential matches a target shape
+# The forward model is the dwell-density convolution of intensity_average_convolved, differentiated by hand so L-BFGS-B gets exact gradients
+
+import numpy as np
+import scipy.optimize
+import scipy.signal
+from typing import NamedTuple, Tuple, Union
+
+from dipoletrapli import DipoleTrapLi
+
+WAVEFORM_BASES = ("table", "fourier")
+
+class WaveformDesign(NamedTuple):
+    parameters: np.ndarray      # Optimised parameters of the basis
+    waveform: np.ndarray        # Modulation over one period, evenly spaced in t without the endpoint, range -1 to 1
+    potential: np.ndarray       # Time-averaged potential of the waveform, including the scale         [J]
+    scale: float                # Factor of the power that fits the target best (1 if the scale is not matched)
+    loss: float                 # Weighted squared error relative to the weighted squared target
+    result: scipy.optimize.OptimizeResult
+
+    def modulation_function(self, t: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+        """The designed waveform as a modulation function of t (period 1), e.g. for intensity_average or a Beam"""
+        ts = np.linspace(start = 0, stop = 1, num = len(self.waveform), endpoint = False)
+        return np.interp(t, ts, self.waveform, period = 1)
+
+def box_target(x: np.ndarray, depth: float, width: float) -> np.ndarray:
+    """Flat-bottom box: -depth for |x| < width/2 and 0 outside
+
+    Args:
+        x (np.ndarray): Axis along the sweep direction [m]
+        depth (float): Depth of the box [J]
+        width (float): Width of the box [m]
+
+    Returns:
+        np.ndarray: Target potential [J]
+    """
+    return np.where(np.abs(x) < width / 2, -depth, 0.0)
+
+class WaveformDesigner():
+    def __init__(self,
+            x: np.ndarray,
+            target: np.ndarray,
+            power: float,
+            wavelength: float,
+            w_0: Tuple[float, float],
+            z_0: Tuple[float, float],
+            Msq: Tuple[float, float],
+            deviation: float,
+            y: float = 0,
+            z: Union[float, np.ndarray] = 0,
+            weights: Union[np.ndarray, None] = None,
+            basis: str = "table",
+            numparameters: int = 64,
+            numsamples: int = 4096,
+            smoothness: float = 0,
+            match_scale: bool = True
+        ) -> None:
+        """Optimises the modulation of a single beam, swept along its x axis, such that its time-averaged potential matches a target.
+
+        The time average is the static potential convolved with the dwell density of the beam position (see dwell_density and
+        DipoleTrapLi.intensity_average_convolved), which is linear in the density, and the cloud-in-cell density is piecewise linear in the waveform.
+        The gradient of the loss is therefore the correlation of the residual with the static potential (one FFT per row),
+        pulled back through the cloud-in-cell weights onto the waveform samples and through the basis onto the parameters.
+
+        The waveform is a linear function of the parameters:
+        - "table": numparameters samples over one period, linearly interpolated (periodic), bounded to -1 to 1
+        - "fourier": offset, cosine and sine amplitudes of (numparameters - 1) // 2 harmonics, the range -1 to 1 is enforced by a penalty
+
+        Args:
+            x (np.ndarray): Evenly spaced axis along the sweep direction                         [m]
+            target (np.ndarray): Target potential on x, or on (len(z), len(x)) for a 2D target     [J]
+            power (float): Power of the beam                                                     [W]
+            wavelength (float): Wavelength of the light                                          [m]
+            w_0 (Tuple[float, float]): Tuple of the beam waist (x, y axes)                       [m]
+            z_0 (Tuple[float, float]): Tuple of the rayleigh length (x, y axes)                  [m]
+            Msq (Tuple[float, float]): Tuple of the beam quality factor M^2 (x, y axes)
+            deviation (float): Amplitude of the modulation                                       [m]
+            y (float, optional): y position [m]. Defaults to 0.
+            z (Union[float, np.ndarray], optional): z position, or the z axis of a 2D target [m]. Defaults to 0.
+            weights (Union[np.ndarray, None], optional): Weights of the squared error, in the shape of target. Defaults to None (uniform).
+            basis (str, optional): "table" or "fourier". Defaults to "table".
+            numparameters (int, optional): Number of table samples or Fourier coefficients. Defaults to 64.
+            numsamples (int, optional): Number of samples of t the dwell density is built from. Defaults to 4096.
+            smoothness (float, optional): Weight of the squared slope of the waveform in the loss, e.g. for the bandwidth of the AOM driver. Defaults to 0.
+            match_scale (bool, optional): Fit the power of the beam too, i.e. only match the shape of the target. Defaults to True.
+        """
+
+        if basis not in WAVEFORM_BASES:
+            raise ValueError(f"Unknown basis '{basis}', must be one of {list(WAVEFORM_BASES)}")
+
+        self.x = np.asarray(x, dtype = np.float64)
+        self.spacing = self.x[1] - self.x[0]
+        assert np.allclose(np.diff(self.x), self.spacing), "x has to be evenly spaced"
+
+        z = np.atleast_1d(np.asarray(z, dtype = np.float64))
+        self.shape = np.shape(target)
+        self.target = np.asarray(target, dtype = np.float64).reshape((len(z), len(self.x)))
+        self.weights = np.ones_like(self.target) if weights is None else np.asarray(weights, dtype = np.float64).reshape(self.target.shape)
+        self.norm = float(np.sum(self.weights * self.target**2)) or 1.0
+
+        self.deviation = deviation
+        self.basis = basis
+        self.numsamples = numsamples
+        self.smoothness = smoothness
+        self.match_scale = match_scale
+
+        # Bins of the dwell density, in units of the spacing. One extra bin on the top, so the upper neighbour of every position exists
+        self.k_max = int(np.ceil(deviation / self.spacing)) + 1
+        self.k_min = -self.k_max
+
+        # Static potential on the axis padded by the bins, see intensity_average_convolved
+        x_padded = self.x[0] + np.arange(-self.k_max, len(self.x) - self.k_min) * self.spacing
+        intensity = DipoleTrapLi._intensity_profile(
+            x = x_padded[np.newaxis, :], y = y, z = z[:, np.newaxis],
+            power = power, wavelength = wavelength, w_0 = w_0, z_0 = z_0, Msq = Msq)
+        self.static = DipoleTrapLi.potential(intensity = intensity, wavelength = wavelength)
+
+        # (numsamples, numparameters) matrix mapping the parameters onto the waveform samples
+        ts = np.linspace(start = 0, stop = 1, num = numsamples, endpoint = False)
+
+        if basis == "table":
+            table_ts = np.linspace(start = 0, stop = 1, num = numparameters, endpoint = False)
+            self.basis_matrix = np.stack([np.interp(ts, table_ts, unit, period = 1) for unit in np.identity(numparameters)], axis = 1)
+        else:
+            harmonics = np.arange(1, (numparameters - 1) // 2 + 1)
+            self.basis_matrix = np.concatenate([
+                np.ones((numsamples, 1)),
+                np.cos(2 * np.pi * np.outer(ts, harmonics)),
+                np.sin(2 * np.pi * np.outer(ts, harmonics))
+            ], axis = 1)
+
+        self.numparameters = self.basis_matrix.shape[1]
+
+    def waveform(self, parameters: np.ndarray) -> np.ndarray:
+        """Samples of the waveform over one period"""
+        return self.basis_matrix @ parameters
+
+    def initial_parameters(self) -> np.ndarray:
+        """Parameters of a sine modulation"""
+        if self.basis == "table":
+            return np.sin(2 * np.pi * np.linspace(start = 0, stop = 1, num = self.numparameters, endpoint = False))
+
+        parameters = np.zeros(self.numparameters)
+        parameters[1 + (self.numparameters - 1) // 2] = 1 # Amplitude of the first sine
+        return parameters
+
+    def _density(self, waveform: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Cloud-in-cell density on the bins k_min to k_max, the lower bin of every sample and whether it is inside the range
+        positions = self.deviation * waveform / self.spacing
+        inside = np.abs(positions) <= self.k_max - 1
+        positions = np.clip(positions, self.k_min, self.k_max - 1)
+
+        lower = np.floor(positions)
+        fraction = positions - lower
+        lower = lower.astype(np.int64) - self.k_min
+
+        numbins = self.k_max - self.k_min + 1
+        density = np.bincount(lower, weights = 1 - fraction, minlength = numbins) + np.bincount(lower + 1, weights = fraction, minlength = numbins)
+
+        return density / self.numsamples, lower, inside
+
+    def _convolve(self, density: np.ndarray) -> np.ndarray:
+        return scipy.signal.fftconvolve(self.static, density[np.newaxis, :], mode = "valid", axes = 1)
+
+    def potential(self, parameters: np.ndarray) -> np.ndarray:
+        """Time-averaged potential of the waveform of the parameters, at the power of the beam [J]"""
+        density, _, _ = self._density(self.waveform(parameters))
+        return self._convolve(density)
+
+    def loss(self, parameters: np.ndarray) -> Tuple[float, np.ndarray]:
+        """Relative weighted squared error of the potential and its gradient with respect to the parameters"""
+        waveform = self.waveform(parameters)
+        density, lower, inside = self._density(waveform)
+        potential = self._convolve(density)
+
+        # With a matched scale, the loss is taken at the best scale, which does not change the gradient (envelope theorem)
+        scale = self._best_scale(potential) if self.match_scale else 1.0
+
+        residual = scale * potential - self.target
+        loss = float(np.sum(self.weights * residual**2)) / self.norm
+
+        # d loss / d potential, then the correlation with the static potential summed over the rows gives d loss / d density
+        d_potential = 2 * scale * self.weights * residual / self.norm
+        d_density = np.sum(scipy.signal.fftconvolve(self.static, d_potential[:, ::-1], mode = "valid", axes = 1), axis = 0)[::-1]
+
+        # Moving a sample moves its weight from the lower to the upper bin
+        d_waveform = (d_density[lower + 1] - d_density[lower]) * inside * self.deviation / (self.spacing * self.numsamples)
+
+        if self.smoothness > 0:
+            # Integral of (dw/dt)^2 over one period
+            slope = np.roll(waveform, -1) - waveform
+            loss += self.smoothness * self.numsamples * float(np.sum(slope**2))
+            d_waveform += self.smoothness * self.numsamples * 2 * (np.roll(slope, 1) - slope)
+
+        if self.basis == "fourier":
+            # Penalty on leaving the range of the modulation
+            excess = np.maximum(np.abs(waveform) - 1, 0)
+            loss += float(np.sum(excess**2))
+            d_waveform += 2 * excess * np.sign(waveform)
+
+        return loss, self.basis_matrix.T @ d_waveform
+
+    def _best_scale(self, potential: np.ndarray) -> float:
+        # Least squares factor of the potential onto the target
+        denominator = float(np.sum(self.weights * potential**2))
+        return float(np.sum(self.weights * potential * self.target)) / denominator if denominator > 0 else 1.0
+
+    def optimise(self, initial: Union[np.ndarray, None] = None, maxiter: int = 500, verbose: bool = True) -> WaveformDesign:
+        """Optimises the parameters with L-BFGS-B
+
+        Args:
+            initial (Union[np.ndarray, None], optional): Initial parameters. Defaults to None (see initial_parameters).
+            maxiter (int, optional): Maximum number of iterations. Defaults to 500.
+            verbose (bool, optional): Print progress. Defaults to True.
+
+        Returns:
+            WaveformDesign: The optimised waveform and its potential
+        """
+
+        if verbose:
+            print("Optimising Waveform...", end = "\r")
+
+        bounds = [(-1, 1)] * self.numparameters if self.basis == "table" else None
+
+        result = scipy.optimize.minimize(
+            self.loss, self.initial_parameters() if initial is None else np.asarray(initial, dtype = np.float64),
+            jac = True, method = "L-BFGS-B", bounds = bounds, options = { "maxiter": maxiter })
+
+        potential = self.potential(result.x)
+        scale = self._best_scale(potential) if self.match_scale else 1.0
+
+        if verbose:
+            print(f"Optimising Waveform...Done! ({result.nit} iterations, loss {result.fun:.3e})")
+
+        return WaveformDesign(
+            parameters = result.x,
+            waveform = self.waveform(result.x),
+            potential = (scale * potential).reshape(self.shape),
+            scale = scale,
+            loss = float(result.fun),
+            result = result)
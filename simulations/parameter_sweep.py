@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+# Batched parameter sweeps of the crossed (painted) trap over the angle between the beams, the deviation, the power and the waist
+# The potential is linear in the power, so only the grid of every (angle, deviation, waist) at 1 W is computed and every power is a scaling of it
+
+import os
+import numpy as np
+from typing import Any, Callable, Dict, List, NamedTuple, Sequence, Tuple, Union
+
+from dipoletrapli import Beam, TrapConfiguration
+from grid_cache import GridCache, input_hash
+from shared_pool import run_shared_pool
+from trap_analysis import escape_saddle, find_trap_minimum
+
+# Order of the axes of all results
+SWEEP_AXES = ("angle", "deviation", "power", "waist")
+
+class SweepResult(NamedTuple):
+    axes: Dict[str, np.ndarray]         # Values of every swept parameter, in the order of SWEEP_AXES       [degrees, m, W, m]
+    potentials: Union[np.ndarray, None] # (angle, deviation, power, waist, *grid) potentials, in the layout of TrapConfiguration.potential_grid [J]
+    minimum: np.ndarray                 # (angle, deviation, power, waist, 3) (x, y, z) of the minimum      [m]
+    minimum_potential: np.ndarray       # (angle, deviation, power, waist) potential at the minimum         [J]
+    depth: np.ndarray                   # -minimum_potential, the depth below the potential far away from the beams [J]
+    saddle_depth: np.ndarray            # Height of the lowest escape saddle above the minimum on the grid, nan if not computed [J]
+
+    def index(self, **values: float) -> Tuple[int, ...]:
+        """Index of the combination closest to the given parameter values, e.g. result.depth[result.index(angle = 10, power = 50)].
+        Axes that are not given are taken whole."""
+        index: List[Any] = []
+        for name in SWEEP_AXES:
+            if name in values:
+                index.append(int(np.argmin(np.abs(self.axes[name] - values[name]))))
+            else:
+                index.append(slice(None))
+        return tuple(index)
+
+def sweep_trap(
+        angle: float,
+        deviation: float,
+        power: float,
+        waist: float,
+        wavelength: float,
+        rotation_axis: np.ndarray = np.array([0,1,0]),
+        z_0: Tuple[float, float] = (0, 0),
+        Msq: Tuple[float, float] = (1.1, 1.1),
+        modulation_function: Union[Callable, str, None] = None,
+        numsamples: int = 200,
+        **kwargs
+    ) -> TrapConfiguration:
+    """The trap of one combination of a sweep: two beams rotated by +-angle/2 about rotation_axis, both painted with modulation_function.
+    The keyword arguments are passed on to TrapConfiguration (e.g. the polarizability model).
+
+    Args:
+        angle (float): Angle between the beams                                  [degrees]
+        deviation (float): Amplitude of the modulation                          [m]
+        power (float): Power of each beam                                       [W]
+        waist (float): Waist of the beams, the same along both axes             [m]
+        wavelength (float): Wavelength of the light                             [m]
+        rotation_axis (np.ndarray, optional): Rotation axis of the beams. Defaults to the y-axis.
+        z_0 (Tuple[float, float], optional): Tuple of the rayleigh length (x, y axes) [m]. Defaults to (0, 0).
+        Msq (Tuple[float, float], optional): Tuple of the beam quality factor M^2 (x, y axes). Defaults to (1.1, 1.1).
+        modulation_function (Union[Callable, str, None], optional): Modulation of the beam positions. Defaults to None (static beams).
+        numsamples (int, optional): Number of samples for the time integration. Defaults to 200.
+
+    Returns:
+        TrapConfiguration: The trap
+    """
+
+    beams = [
+        Beam(
+            power = power,
+            w_0 = (waist, waist), z_0 = tuple(z_0), Msq = tuple(Msq), # type: ignore
+            rotation_axis = rotation_axis, degrees = degrees,
+            deviation = deviation, modulation_function = modulation_function, numsamples = numsamples)
+        for degrees in (angle/2, -angle/2)
+    ]
+
+    return TrapConfiguration(beams = beams, wavelength = wavelength, **kwargs)
+
+def _unit_potential(task: Tuple[float, float, float, Dict[str, Any]], x: np.ndarray, y: np.ndarray, z: np.ndarray) -> np.ndarray:
+    # Potential of one (angle, deviation, waist) at 1 W per beam, run by the workers of run_shared_pool
+    angle, deviation, waist, settings = task
+    settings = dict(settings)
+    max_bytes = settings.pop("max_bytes", None)
+
+    trap = sweep_trap(angle = angle, deviation = deviation, power = 1, waist = waist, **settings)
+
+    return trap.potential_grid(x = x, y = y, z = z, max_bytes = max_bytes, verbose = False)
+
+def sweep(
+        x: np.ndarray, y: Union[float, np.ndarray], z: np.ndarray,
+        angles: Sequence[float],
+        deviations: Sequence[float] = (0,),
+        powers: Sequence[float] = (100,),
+        waists: Sequence[float] = (25e-6,),
+        wavelength: float = 1070e-9,
+        refine: bool = True,
+        escape: bool = False,
+        keep_potentials: bool = True,
+        cache: Union[GridCache, None] = None,
+        max_bytes: Union[int, None] = None,
+        processes: Union[int, None] = None,
+        verbose: bool = True,
+        **kwargs
+    ) -> SweepResult:
+    """Potential and trap metrics of the crossed trap (see sweep_trap) for every combination of angles x deviations x powers x waists.
+
+    Only the grids at 1 W of the combinations of angles, deviations and waists are computed, on a pool of processes
+    sharing the axes (run_shared_pool), the most expensive (widest painted) first. Every power is a scaling of these,
+    so the minimum position does not depend on the power and the depths scale with it, i.e. the power axis costs nothing.
+    With a cache the grids at 1 W are looked up in and stored into the GridCache, so repeated or extended sweeps only compute new combinations.
+
+    The keyword arguments are passed on to sweep_trap (rotation_axis, z_0, Msq, modulation_function, numsamples and the arguments of TrapConfiguration).
+    A callable modulation_function has to be picklable, i.e. defined at the top level of a module.
+
+    Args:
+        x (np.ndarray): Grid axis x                                                     [m]
+        y (Union[float, np.ndarray]): Grid axis y, or a single value for the x-z plane [m]
+        z (np.ndarray): Grid axis z                                                     [m]
+        angles (Sequence[float]): Angles between the beams                             [degrees]
+        deviations (Sequence[float], optional): Amplitudes of the modulation [m]. Defaults to (0,).
+        powers (Sequence[float], optional): Powers of each beam, positive [W]. Defaults to (100,).
+        waists (Sequence[float], optional): Waists of the beams [m]. Defaults to (25e-6,).
+        wavelength (float, optional): Wavelength of the light [m]. Defaults to 1070e-9.
+        refine (bool, optional): Refine the grid minimum on the analytic model with find_trap_minimum. Defaults to True.
+        escape (bool, optional): Compute the escape saddle on the grid with escape_saddle. Defaults to False.
+        keep_potentials (bool, optional): Return the potentials of all combinations. Defaults to True.
+        cache (Union[GridCache, None], optional): On-disk cache of the grids at 1 W. Defaults to None.
+        max_bytes (Union[int, None], optional): Memory budget for one tile of a worker [bytes]. Defaults to None (DipoleTrapLi.GRID_TILE_BYTES).
+        processes (Union[int, None], optional): Number of worker processes, 1 computes in this process. Defaults to None (os.cpu_count()).
+        verbose (bool, optional): Print progress. Defaults to True.
+
+    Returns:
+        SweepResult: Labelled potentials and metrics of all combinations
+    """
+
+    x = np.asarray(x, dtype = np.float64)
+    y = np.atleast_1d(np.asarray(y, dtype = np.float64))
+    z = np.asarray(z, dtype = np.float64)
+
+    axes = { name: np.atleast_1d(np.asarray(values, dtype = np.float64)) for name, values in zip(SWEEP_AXES, (angles, deviations, powers, waists)) }
+    assert np.all(axes["power"] > 0), "The powers have to be positive, the minimum position is shared between them"
+
+    settings = { "wavelength": wavelength, **kwargs }
+
+    grid_shape = (len(z), len(x)) if len(y) == 1 else (len(z), len(y), len(x))
+    shape = tuple(len(axes[name]) for name in ("angle", "deviation", "waist"))
+
+    combinations = list(np.ndindex(*shape))
+    def parameters(index: Tuple[int, ...]) -> Tuple[float, float, float]:
+        return axes["angle"][index[0]], axes["deviation"][index[1]], axes["waist"][index[2]]
+
+    unit_potentials = np.empty((*shape, *grid_shape), dtype = np.float64)
+
+    # Look up the grids at 1 W in the cache first
+    keys: Dict[Tuple[int, ...], str] = {}
+    missing = combinations
+    if cache is not None:
+        missing = []
+        for index in combinations:
+            trap = sweep_trap(*parameters(index)[:2], power = 1, waist = parameters(index)[2], **settings)
+            keys[index] = input_hash(cache.potential_inputs(trap, x = x, y = y, z = z))
+
+            cached = cache.load(keys[index])
+            if cached is None:
+                missing.append(index)
+            else:
+                unit_potentials[index] = cached
+
+        if verbose:
+            print(f"Grid cache: {len(combinations) - len(missing)} of {len(combinations)} combinations cached")
+
+    # The time integration grows with the deviation, so hand out the widest painted combinations first
+    missing = sorted(missing, key = lambda index: -parameters(index)[1])
+    tasks = [(*parameters(index), { **settings, "max_bytes": max_bytes }) for index in missing]
+
+    if len(tasks) > 0:
+        if processes is None:
+            processes = os.cpu_count() or 1
+
+        if processes == 1:
+            results = []
+            for i, task in enumerate(tasks):
+                if verbose:
+                    print(f"Calculating combination {i + 1}/{len(tasks)}...", end = "\r")
+                results.append(_unit_potential(task, x = x, y = y, z = z))
+            if verbose:
+                print(f"Calculating combination {len(tasks)}/{len(tasks)}...Done!")
+        else:
+            results = run_shared_pool(
+                function = _unit_potential,
+                tasks = tasks,
+                inputs = { "x": x, "y": y, "z": z },
+                result_shape = grid_shape,
+                processes = processes,
+                verbose = verbose)
+
+        for index, result in zip(missing, results):
+            unit_potentials[index] = result
+            if cache is not None:
+                angle, deviation, waist = parameters(index)
+                cache.store(keys[index], result, metadata = { "description": f"sweep at 1 W, {angle} degrees, deviation {deviation}, waist {waist}" })
+
+    if verbose:
+        print("Analysing Combinations...", end = "\r")
+
+    unit_minimum = np.empty((*shape, 3))
+    unit_minimum_potential = np.empty(shape)
+    unit_saddle_depth = np.full(shape, np.nan)
+
+    for index in combinations:
+        potential = unit_potentials[index]
+        minimum_index = np.unravel_index(np.argmin(potential), potential.shape)
+
+        if len(y) == 1:
+            grid_minimum = np.array([x[minimum_index[1]], y[0], z[minimum_index[0]]])
+        else:
+            grid_minimum = np.array([x[minimum_index[2]], y[minimum_index[1]], z[minimum_index[0]]])
+
+        unit_minimum[index] = grid_minimum
+        unit_minimum_potential[index] = potential[minimum_index]
+
+        if refine:
+            trap = sweep_trap(*parameters(index)[:2], power = 1, waist = parameters(index)[2], **settings)
+            refined = find_trap_minimum(trap, start = grid_minimum)
+
+            # Keep the grid point if the refinement wandered off to another minimum or outside the grid
+            inside = all(lo <= c <= hi for c, lo, hi in zip(refined.position, (x[0], y[0], z[0]), (x[-1], y[-1], z[-1])) if lo < hi)
+            if refined.converged and inside and refined.potential <= potential[minimum_index]:
+                unit_minimum[index] = refined.position
+                unit_minimum_potential[index] = refined.potential
+
+        if escape:
+            minimum_grid_index, saddle_grid_index = escape_saddle(potential)
+            unit_saddle_depth[index] = potential[saddle_grid_index] - potential[minimum_grid_index]
+
+    if verbose:
+        print("Analysing Combinations...Done!")
+
+    # Insert the power axis, everything but the positions scales with it
+    def scaled(unit: np.ndarray) -> np.ndarray:
+        p = axes["power"].reshape((1, 1, -1, 1) + (1,) * (unit.ndim - 3))
+        return unit[:, :, np.newaxis] * p
+
+    minimum_potential = scaled(unit_minimum_potential)
+    minimum = np.broadcast_to(unit_minimum[:, :, np.newaxis], (shape[0], shape[1], len(axes["power"]), shape[2], 3)).copy()
+
+    return SweepResult(
+        axes = axes,
+        potentials = scaled(unit_potentials) if keep_potentials else None,
+        minimum = minimum,
+        minimum_potential = minimum_potential,
+        depth = -minimum_potential,
+        saddle_depth = scaled(unit_saddle_depth))
@@ -2,7 +2,9 @@
 
 import sys
 import numpy as np
-from dipoletrapli import DipoleTrapLi, rotate_points, cartesian_product 
+from dipoletrapli import DipoleTrapLi, Beam, TrapConfiguration
+from grid_cache import GridCache
+from trap_analysis import trap_depth, find_trap_minimum
 
 import __init__
 from plotter import Plotter
@@ -36,34 +38,18 @@ x = np.linspace(start = -200, stop = 200, num = 5000, endpoint = True) * 1e-6
 z = np.linspace(start = -0.5, stop = 0.5, num = 5000, endpoint = True) * 1e-3
 y = np.array([0])
 
-points = cartesian_product(x, y, z)
+# The beams are evaluated directly on the grid axes, in the (len(z), len(x)) layout
+trap = TrapConfiguration(beams = [
+    Beam(power = power, rotation_axis = rotation_axis, degrees =  angle_between_beams/2, **beam_params[0]),
+    Beam(power = power, rotation_axis = rotation_axis, degrees = -angle_between_beams/2, **beam_params[1])
+], wavelength = wavelength)
 
-points_beam1 = rotate_points(points = points, axis = rotation_axis, degrees =  angle_between_beams/2)
-points_beam2 = rotate_points(points = points, axis = rotation_axis, degrees = -angle_between_beams/2)
-
-intensities_1 = DipoleTrapLi.intensity(
-    x = points_beam1[:,0], y = points_beam1[:,1], z = points_beam1[:,2], 
-    power = power, wavelength = wavelength,
-    **beam_params[0]
-)
-intensities_2 = DipoleTrapLi.intensity(
-    x = points_beam2[:,0], y = points_beam2[:,1], z = points_beam2[:,2], 
-    power = power, wavelength = wavelength,
-    **beam_params[1]
-)
-
-potential_1 = DipoleTrapLi.potential(intensity = intensities_1, wavelength = wavelength)*1e27 # Turn into reasonable units
-potential_2 = DipoleTrapLi.potential(intensity = intensities_2, wavelength = wavelength)*1e27
-potentials = potential_1 + potential_2
-
-assert isinstance(potentials, np.ndarray)
-assert isinstance(potential_1, np.ndarray)
-assert isinstance(potential_2, np.ndarray)
+potentials = GridCache().potential_grid(trap, x = x, y = y, z = z)*1e27 # Turn into reasonable units
 
 potentials_mk = DipoleTrapLi.trap_temperature(trap_depth = potentials*1e-27)*1e3
 
 # https://matplotlib.org/stable/gallery/images_contours_and_fields/contour_demo.html
-potentials_for_contour_plotting = potentials_mk.reshape((len(x), len(z))).T
+potentials_for_contour_plotting = potentials_mk
 X, Z = np.meshgrid(x * 1e6, z * 1e3)
 
 # fig, ax = plt.subplots()
@@ -123,6 +109,12 @@ else:
 
     plotter.show()
 
-min_point = np.argmin(potentials)
-print("Min Potential at =", points[min_point] * 1e6, "um")
-print("Trap Depth =", DipoleTrapLi.trap_temperature(trap_depth = potentials[min_point]*1e-27)*1e3, "mK")
\ No newline at end of file
+# The minimum is found on the analytic potential, the grid is only needed for the figure
+minimum = find_trap_minimum(trap)
+print("Min Potential at =", minimum.position * 1e6, "um")
+print("Trap Depth =", DipoleTrapLi.trap_temperature(trap_depth = minimum.potential)*1e3, "mK")
+
+# The atoms leave over the lowest saddle of the potential, which is shallower than the minimum itself
+depth = trap_depth(trap, x = x, y = y, z = z, potential = potentials*1e-27)
+print("Escape Saddle at =", depth.saddle * 1e6, "um", "(edge of the grid)" if depth.on_boundary else "")
+print("Trap Depth over Escape Saddle =", DipoleTrapLi.trap_temperature(trap_depth = -depth.depth)*1e3, "mK")
\ No newline at end of file
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 
 import numpy as np
-from dipoletrapli import DipoleTrapLi, cartesian_product 
+from dipoletrapli import DipoleTrapLi
+from grid_cache import GridCache
 
 import __init__
 from plotter import Plotter
@@ -28,10 +29,9 @@ x = np.linspace(start = -100, stop = 100, num = 3000, endpoint = True) * 1e-6
 z = np.linspace(start = -6, stop = 6, num = 3000, endpoint = True) * 1e-3
 y = np.array([0])
 
-points = cartesian_product(x, y, z)
-
-intensities = DipoleTrapLi.intensity(
-    x = points[:,0], y = points[:,1], z = points[:,2], 
+# The beam is aligned with the grid, so this is evaluated as an outer product in the (len(z), len(x)) layout
+intensities = GridCache().intensity_grid(
+    x = x, y = y, z = z, 
     power = power, wavelength = wavelength,
     **beam_params
 )
@@ -43,7 +43,7 @@ assert isinstance(potential, np.ndarray)
 potentials_mk = DipoleTrapLi.trap_temperature(trap_depth = potential*1e-27)*1e3
 
 # https://matplotlib.org/stable/gallery/images_contours_and_fields/contour_demo.html
-potentials_for_contour_plotting = potentials_mk.reshape((len(x), len(z))).T
+potentials_for_contour_plotting = potentials_mk
 X, Z = np.meshgrid(x * 1e6, z * 1e3)
 
 # fig, ax = plt.subplots()
@@ -100,6 +100,6 @@ else:
     # plotter.show()
     plotter.savefig(os.path.join(base_dir, "generated", "static_potential_2D_single_beam.pdf"), backend = "pdf", dpi = 600)
 
-min_point = np.argmin(potential)
-print("Min Potential at =", points[min_point] * 1e6, "um")
+min_point = np.unravel_index(np.argmin(potential), potential.shape)
+print("Min Potential at =", np.array([x[min_point[1]], y[0], z[min_point[0]]]) * 1e6, "um")
 print("Trap Depth =", DipoleTrapLi.trap_temperature(trap_depth = potential[min_point]*1e-27)*1e3, "mK")
\ No newline at end of file
@@ -2,7 +2,8 @@
 
 import numpy as np
 from sympy import false
-from dipoletrapli import DipoleTrapLi, rotate_points, cartesian_product 
+from dipoletrapli import DipoleTrapLi, Beam, TrapConfiguration
+from grid_cache import GridCache
 
 import __init__
 
@@ -42,8 +43,6 @@ x = np.linspace(start = -150, stop = 150, num = numpoints_x, endpoint = True) *
 z = np.linspace(start = -0.5, stop = 0.5, num = numpoints_z, endpoint = True) * 1e-3 # 5000
 y = np.array([0])
 
-points = cartesian_product(x, y, z)
-
 X, Z = np.meshgrid(x * 1e6, z * 1e3)
 
 plotter = Plotter(nrows = nrows, ncols = ncols, sharex = 'col', sharey = 'row', squeeze = False, figsize=(figwidth, figheight))
@@ -51,36 +50,23 @@ assert isinstance(plotter.axs, np.ndarray)
 
 allpotentials = []
 
+cache = GridCache()
+
 for angle in angle_between_beams:
     print(f"Calculating for angle = {angle} degrees...")
-    points_beam1 = rotate_points(points = points, axis = rotation_axis, degrees =  angle/2)
-    points_beam2 = rotate_points(points = points, axis = rotation_axis, degrees = -angle/2)
-
-    intensities_1 = DipoleTrapLi.intensity(
-        x = points_beam1[:,0], y = points_beam1[:,1], z = points_beam1[:,2], 
-        power = power, wavelength = wavelength,
-        **beam_params[0]
-    )
-    intensities_2 = DipoleTrapLi.intensity(
-        x = points_beam2[:,0], y = points_beam2[:,1], z = points_beam2[:,2], 
-        power = power, wavelength = wavelength,
-        **beam_params[1]
-    )
-
-    potential_1 = DipoleTrapLi.potential(intensity = intensities_1, wavelength = wavelength)*1e27 # Turn into reasonable units
-    potential_2 = DipoleTrapLi.potential(intensity = intensities_2, wavelength = wavelength)*1e27
-    potentials = potential_1 + potential_2
-
-    assert isinstance(potentials, np.ndarray)
-    assert isinstance(potential_1, np.ndarray)
-    assert isinstance(potential_2, np.ndarray)
+    trap = TrapConfiguration(beams = [
+        Beam(power = power, rotation_axis = rotation_axis, degrees =  angle/2, **beam_params[0]),
+        Beam(power = power, rotation_axis = rotation_axis, degrees = -angle/2, **beam_params[1])
+    ], wavelength = wavelength)
+
+    potentials = cache.potential_grid(trap, x = x, y = y, z = z)*1e27 # Turn into reasonable units
 
     potentials_mk = DipoleTrapLi.trap_temperature(trap_depth = potentials*1e-27)*1e3
     
     assert isinstance(potentials_mk, np.ndarray)
 
     # https://matplotlib.org/stable/gallery/images_contours_and_fields/contour_demo.html
-    potentials_for_contour_plotting = potentials_mk.reshape((len(x), len(z))).T
+    potentials_for_contour_plotting = potentials_mk
     allpotentials.append(potentials_for_contour_plotting)
     print(f"Calculating for angle = {angle} degrees...Done")
 
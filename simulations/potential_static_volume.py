@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+# Calculates the full 3D potential of the static crossed trap, streamed to disk slab by slab
+
+import os
+import numpy as np
+from dipoletrapli import DipoleTrapLi, Beam, TrapConfiguration, volume_below
+
+beam_params = [
+    {
+        "w_0": [25e-6  , 25e-6 ], # m
+        "z_0": [0   , 0  ], # m
+        "Msq": [1.1 , 1.1],
+    },
+    {
+        "w_0": [25e-6  , 25e-6 ], # m
+        "z_0": [0   , 0  ], # m
+        "Msq": [1.1 , 1.1],
+    }
+]
+
+wavelength = 1070e-9  #nm
+
+# BEG SETTINGS
+rotation_axis = np.array([0,1,0]) # y-axis
+angle_between_beams = 20          # degrees
+power = 100                       # W
+numpoints_x = 500
+numpoints_y = 200
+numpoints_z = 1000
+max_bytes = 256 * 1024**2         # memory budget per slab
+# END SETTINGS
+
+base_dir = os.path.dirname(os.path.realpath(__file__))
+filename = os.path.join(base_dir, "potential_static_volume.npy")
+
+x = np.linspace(start = -200, stop = 200, num = numpoints_x, endpoint = True) * 1e-6
+y = np.linspace(start = -50, stop = 50, num = numpoints_y, endpoint = True) * 1e-6
+z = np.linspace(start = -0.5, stop = 0.5, num = numpoints_z, endpoint = True) * 1e-3
+
+trap = TrapConfiguration(beams = [
+    Beam(power = power, rotation_axis = rotation_axis, degrees =  angle_between_beams/2, **beam_params[0]),
+    Beam(power = power, rotation_axis = rotation_axis, degrees = -angle_between_beams/2, **beam_params[1])
+], wavelength = wavelength)
+
+# (len(z), len(y), len(x)) volume in J, memory-mapped from filename
+potentials = trap.potential_volume(x = x, y = y, z = z, filename = filename, max_bytes = max_bytes)
+
+minimum_potential = potentials.min()
+minimum_mk = DipoleTrapLi.trap_temperature(trap_depth = minimum_potential)*1e3
+
+print(f"Trap depth = {minimum_mk:.3f} mK")
+
+for fraction in [0.1, 0.5, 0.9]:
+    volume = volume_below(potentials, x = x, y = y, z = z, threshold = (1 - fraction) * minimum_potential)
+    print(f"Volume within {fraction*100:.0f}% of the depth = {volume * 1e18:.3e} um^3")
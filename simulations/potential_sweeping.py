@@ -4,7 +4,9 @@
 
 from importlib.metadata import files
 import numpy as np
-from dipoletrapli import DipoleTrapLi, rotate_points, cartesian_product 
+from dipoletrapli import DipoleTrapLi, Beam, TrapConfiguration, MODULATION_FUNCTIONS
+from grid_cache import GridCache
+from trap_analysis import trap_depth, find_trap_minimum
 
 import __init__
 from plotter import Plotter
@@ -40,20 +42,15 @@ z_numsamples = 1000
 
 PLOTSchnitt = False
 
-def sine_mod(t):
-    return np.sin(2*np.pi*t)
-
-def ramp_mod(t):
-    return 2*(t - 0.5)
-
 # modulation_function = sine_mod
 # modulation_function_name = "Simple Sinusoidal Modulation"
 
 # modulation_function = ramp_mod
 # modulation_function_name = "Simple Ramp Modulation"
 
-mod_funcs = [ramp_mod, sine_mod]
+mod_func_keys = ["ramp", "sine"]   # keys of MODULATION_FUNCTIONS, see DipoleTrapLi.intensity_average_analytic
 mod_func_names = ["Ramp Modulation", "Sinusoidal Modulation"]
+ANALYTIC = True                    # skip the time sampling for ramp/sine
 filenames = ["sweeping_potential_3D_ramp.pdf", "sweeping_potential_3D_sine.pdf"]
 
 # END SETTINGS
@@ -61,45 +58,37 @@ x = np.linspace(start = -200, stop = 200, num = x_numsamples, endpoint = True) *
 z = np.linspace(start = -1.7, stop = 1.7, num = z_numsamples, endpoint = True) * 1e-3
 y = np.array([0])
 
-points = cartesian_product(x, y, z)
+cache = GridCache()
 
-points_beam1 = rotate_points(points = points, axis = rotation_axis, degrees =  angle_between_beams/2)
-points_beam2 = rotate_points(points = points, axis = rotation_axis, degrees = -angle_between_beams/2)
-
-for i in range(len(mod_funcs)):
-    modulation_function = mod_funcs[i]
+for i in range(len(mod_func_keys)):
+    modulation_function = mod_func_keys[i] if ANALYTIC else MODULATION_FUNCTIONS[mod_func_keys[i]]
     modulation_function_name = mod_func_names[i]
     filename = filenames[i]
 
-    intensities_1 = DipoleTrapLi.intensity_average(
-        x = points_beam1[:,0], y = points_beam1[:,1], z = points_beam1[:,2], 
-        power = power, wavelength = wavelength,
-        numsamples = numsamples,
-        modulation_function = modulation_function,
-        **beam_params[0]
-    )
-    intensities_2 = DipoleTrapLi.intensity_average(
-        x = points_beam2[:,0], y = points_beam2[:,1], z = points_beam2[:,2], 
-        power = power, wavelength = wavelength,
-        numsamples = numsamples,
-        modulation_function = modulation_function,
-        **beam_params[1]
-    )
-
-    potential_1 = DipoleTrapLi.potential(intensity = intensities_1, wavelength = wavelength)*1e27 # Turn into reasonable units
-    potential_2 = DipoleTrapLi.potential(intensity = intensities_2, wavelength = wavelength)*1e27
-    potentials = potential_1 + potential_2
+    # The beams are evaluated directly on the grid axes, in the (len(z), len(x)) layout
+    trap = TrapConfiguration(beams = [
+        Beam(
+            power = power, rotation_axis = rotation_axis, degrees =  angle_between_beams/2, 
+            numsamples = numsamples, modulation_function = modulation_function,
+            **beam_params[0]
+        ),
+        Beam(
+            power = power, rotation_axis = rotation_axis, degrees = -angle_between_beams/2, 
+            numsamples = numsamples, modulation_function = modulation_function,
+            **beam_params[1]
+        )
+    ], wavelength = wavelength)
+
+    potentials = cache.potential_grid(trap, x = x, y = y, z = z)*1e27 # Turn into reasonable units
 
     assert isinstance(potentials, np.ndarray)
-    assert isinstance(potential_1, np.ndarray)
-    assert isinstance(potential_2, np.ndarray)
 
     potentials_mk = DipoleTrapLi.trap_temperature(trap_depth = potentials*1e-27)*1e3
 
     assert isinstance(potentials_mk, np.ndarray)
 
     # https://matplotlib.org/stable/gallery/images_contours_and_fields/contour_demo.html
-    potentials_for_contour_plotting = potentials_mk.reshape((len(x), len(z))).T
+    potentials_for_contour_plotting = potentials_mk
     X, Z = np.meshgrid(x * 1e6, z * 1e3)
 
     # fig, ax = plt.subplots()
@@ -159,6 +148,12 @@ for i in range(len(mod_funcs)):
 
         plotter.show()
 
-    min_point = np.argmin(potentials)
-    print("Min Potential at =", points[min_point] * 1e6, "um")
-    print("Trap Depth =", DipoleTrapLi.trap_temperature(trap_depth = potentials[min_point]*1e-27)*1e3, "mK")
\ No newline at end of file
+    # The minimum is found on the analytic potential, the grid is only needed for the figure
+    minimum = find_trap_minimum(trap)
+    print("Min Potential at =", minimum.position * 1e6, "um")
+    print("Trap Depth =", DipoleTrapLi.trap_temperature(trap_depth = minimum.potential)*1e3, "mK")
+
+    # The atoms leave over the lowest saddle of the potential, which is shallower than the minimum itself
+    depth = trap_depth(trap, x = x, y = y, z = z, potential = potentials*1e-27)
+    print("Escape Saddle at =", depth.saddle * 1e6, "um", "(edge of the grid)" if depth.on_boundary else "")
+    print("Trap Depth over Escape Saddle =", DipoleTrapLi.trap_temperature(trap_depth = -depth.depth)*1e3, "mK")
\ No newline at end of file
@@ -3,7 +3,8 @@
 # Calculates the potential based on a sweeping dipole trap
 import sys, os
 import numpy as np
-from dipoletrapli import DipoleTrapLi, cartesian_product 
+from dipoletrapli import DipoleTrapLi, ramp_mod, sine_mod
+from grid_cache import GridCache
 
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 
@@ -29,12 +30,6 @@ numsamples = 200
 x_numsamples = 700
 z_numsamples = 700
 
-def sine_mod(t):
-    return np.sin(2*np.pi*t)
-
-def ramp_mod(t):
-    return 2*(t - 0.5)
-
 mod_funcs = [ramp_mod, sine_mod]
 mod_func_names = ["Ramp Modulation", "Sinusoidal Modulation"]
 filenames = ["sweeping_potential_single_beam_ramp.pdf", "sweeping_potential_single_beam_sine.pdf"]
@@ -44,15 +39,16 @@ x = np.linspace(start = -200, stop = 200, num = x_numsamples, endpoint = True) *
 z = np.linspace(start = -8, stop = 8, num = z_numsamples, endpoint = True) * 1e-3
 y = np.array([0])
 
-points = cartesian_product(x, y, z)
+cache = GridCache()
 
 for i in range(len(mod_funcs)):
     modulation_function = mod_funcs[i]
     modulation_function_name = mod_func_names[i]
     filename = filenames[i]
 
-    intensities = DipoleTrapLi.intensity_average(
-        x = points[:,0], y = points[:,1], z = points[:,2], 
+    # The beam is aligned with the grid, so this is evaluated as an outer product in the (len(z), len(x)) layout
+    intensities = cache.intensity_grid(
+        x = x, y = y, z = z, 
         power = power, wavelength = wavelength,
         numsamples = numsamples,
         modulation_function = modulation_function,
@@ -68,7 +64,7 @@ for i in range(len(mod_funcs)):
     assert isinstance(potentials_mk, np.ndarray)
 
     # https://matplotlib.org/stable/gallery/images_contours_and_fields/contour_demo.html
-    potentials_for_contour_plotting = potentials_mk.reshape((len(x), len(z))).T
+    potentials_for_contour_plotting = potentials_mk
     X, Z = np.meshgrid(x * 1e6, z * 1e3)
 
     # fig, ax = plt.subplots()
@@ -141,6 +137,6 @@ for i in range(len(mod_funcs)):
         # plotter.show()
         plotter.savefig(os.path.join(__init__.base_dir, "generated", filename), backend = "pdf", dpi = 600)
 
-    min_point = np.argmin(potential)
-    print("Min Potential at =", points[min_point] * 1e6, "um")
+    min_point = np.unravel_index(np.argmin(potential), potential.shape)
+    print("Min Potential at =", np.array([x[min_point[1]], y[0], z[min_point[0]]]) * 1e6, "um")
     print("Trap Depth =", DipoleTrapLi.trap_temperature(trap_depth = potential[min_point]*1e-27)*1e3, "mK")
\ No newline at end of file
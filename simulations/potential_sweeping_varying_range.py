@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
 
+import os
 import sys
 import numpy as np
 from sympy import false
-from dipoletrapli import DipoleTrapLi, rotate_points, cartesian_product 
+from dipoletrapli import DipoleTrapLi, ramp_mod, sine_mod, set_jit_threads
 
 from matplotlib.ticker import AutoMinorLocator
 
@@ -21,15 +22,14 @@ mpl.use('PDF')
 
 import matplotlib.cm as cm
 
-from mpi4py import MPI
-
-comm = MPI.COMM_WORLD
-mpisize = comm.Get_size()
-mpirank = comm.Get_rank()
+# mpi4py is only needed for the MPI run, run with --local (or without mpi4py) to use a process pool on this machine instead
+try:
+    from mpi4py import MPI
+except ImportError:
+    MPI = None
 
-# if size != 8:
-#     print("Please run with 8 nodes")
-#     sys.exit()
+from shared_pool import run_shared_pool
+from typing import Tuple
 
 ## GLOBAL SETTINGS
 waist = 25e-6
@@ -62,11 +62,10 @@ figwidth = 8; figheight = 4.8
 sweeping_range = [0, 1, 2, 4]
 
 t_samples = 200
-def sine_mod(t):
-    return np.sin(2*np.pi*t)
-
-def ramp_mod(t):
-    return 2*(t - 0.5)
+max_bytes = 2 * 1024**3           # memory budget for the time integration per rank
+local_processes = None            # number of processes for --local, None = all cores
+tile_rows = 35                    # z rows per work item handed out by the MPI master
+threads_per_rank = int(os.environ.get("SLURM_CPUS_PER_TASK", 1)) # numba threads of every MPI rank, the cores each rank was given
 
 modulation_functions = [ramp_mod, sine_mod]
 modulation_function_names = ["Ramp Modulation", "Sinusoidal Modulation"]
@@ -74,115 +73,173 @@ modulation_function_names = ["Ramp Modulation", "Sinusoidal Modulation"]
 
 angle_between_beams = 10
 
-num_elements = numpoints_x * numpoints_y * numpoints_z
-
-## GLOBAL SETTINGS
-x, y, z  = 0, 0, 0
-
-if mpirank == 0:
-    plotter = Plotter(nrows = nrows, ncols = ncols, sharex = 'col', sharey = 'row', squeeze = False, figsize=(figwidth, figheight))
-
-    assert isinstance(plotter.axs, np.ndarray)
+# Each beam is the grid rotated about rotation_axis by these angles
+beam_degrees = [angle_between_beams/2, -angle_between_beams/2]
 
+def generate_axes() -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
     # We generate in the x-z plane
     x = np.linspace(start = -150, stop = 150, num = numpoints_x, endpoint = True, dtype = np.float64) * 1e-6 # 5000
     z = np.linspace(start = -0.75, stop = 0.75, num = numpoints_z, endpoint = True, dtype = np.float64) * 1e-3 # 5000
     y = np.array([0], dtype = np.float64)
 
-    points = cartesian_product(x, y, z)
-
-    points_beam1 = rotate_points(points = points, axis = rotation_axis, degrees =  angle_between_beams/2)
-    points_beam2 = rotate_points(points = points, axis = rotation_axis, degrees = -angle_between_beams/2)
-else:
-    points_beam1 = np.empty((num_elements, 3), dtype = np.float64)
-    points_beam2 = np.empty((num_elements, 3), dtype = np.float64)
-
-# https://mpi4py.readthedocs.io/en/stable/tutorial.html > Broadcasting np array
-comm.Bcast(points_beam1, root = 0)
-comm.Bcast(points_beam2, root = 0)
-
-total_elements = len(modulation_functions) * len(sweeping_range)
-assert total_elements % mpisize == 0, f"Number of nodes not compatible; Total = {total_elements}, Nodes = {mpisize}"
-chunksize = int(total_elements / mpisize)
-
-settings_chunked = []
+    return x, y, z
 
-if mpirank == 0:
-    print(f"Chunksize = {chunksize}")
+def calculate_potentials(setting: tuple, x: np.ndarray, y: np.ndarray, z: np.ndarray, name: str = "", rows: slice = slice(None)) -> np.ndarray:
+    mod_func, rng = setting
+    print(f"{name}Calculating for {mod_func}, {rng}, rows {rows.start}:{rows.stop}...")
 
-    settings = []
+    # Only the requested z rows are generated, directly in the frame of each beam
+    potentials = np.zeros((len(z[rows]), len(x)), dtype = np.float64)
 
-    for mod_func in modulation_functions:
-        for rng in sweeping_range:
-            settings.append((mod_func, rng))
+    for params, degrees in zip(beam_params, beam_degrees):
+        intensities = DipoleTrapLi.intensity_grid(
+            x = x, y = y, z = z[rows],
+            power = power, wavelength = wavelength,
+            rotation_axis = rotation_axis, degrees = degrees,
+            numsamples = t_samples,
+            max_bytes = max_bytes,
+            modulation_function = mod_func,
+            deviation = rng * waist,
+            verbose = False,
+            **params
+        )
 
-    # https://www.geeksforgeeks.org/python-reshape-a-list-according-to-given-multi-list/
-    settings_iterator = iter(settings)
-    settings_chunked = [[next(settings_iterator) for _ in range(chunksize)] for __ in range(mpisize)]
-
-# https://mpi4py.readthedocs.io/en/stable/tutorial.html > Scattering Python Arrays
-mychunk = comm.scatter(settings_chunked, root = 0)
-print(f"Rank {mpirank}: {mychunk}")
-
-mypotentials = []
-for mod_func, rng in mychunk:
-    print(f"Rank {mpirank}: Calculating for {mod_func}, {rng}...")
-
-    intensities_1 = DipoleTrapLi.intensity_average(
-        x = points_beam1[:,0], y = points_beam1[:,1], z = points_beam1[:,2], 
-        power = power, wavelength = wavelength,
-        numsamples = t_samples,
-        modulation_function = mod_func,
-        deviation = rng * waist,
-        **beam_params[0]
-    )
-    intensities_2 = DipoleTrapLi.intensity_average(
-        x = points_beam2[:,0], y = points_beam2[:,1], z = points_beam2[:,2], 
-        power = power, wavelength = wavelength,
-        numsamples = t_samples,
-        modulation_function = mod_func,
-        deviation = rng * waist,
-        **beam_params[1]
-    )
-
-    potential_1 = DipoleTrapLi.potential(intensity = intensities_1, wavelength = wavelength)*1e27 # Turn into reasonable units
-    potential_2 = DipoleTrapLi.potential(intensity = intensities_2, wavelength = wavelength)*1e27
-    potentials = potential_1 + potential_2
-
-    assert isinstance(potentials, np.ndarray)
-    assert isinstance(potential_1, np.ndarray)
-    assert isinstance(potential_2, np.ndarray)
+        potentials += DipoleTrapLi.potential(intensity = intensities, wavelength = wavelength)*1e27 # Turn into reasonable units
 
     potentials_mk = DipoleTrapLi.trap_temperature(trap_depth = potentials*1e-27)*1e3
     
     assert isinstance(potentials_mk, np.ndarray)
 
+    print(f"{name}Calculating for {mod_func}, {rng}, rows {rows.start}:{rows.stop}...Done")
+
     # https://matplotlib.org/stable/gallery/images_contours_and_fields/contour_demo.html
-    potentials_for_contour_plotting = potentials_mk.reshape((numpoints_x, numpoints_z)).T
-    mypotentials.append(potentials_for_contour_plotting)
+    return potentials_mk
 
-    print(f"Rank {mpirank}: Calculating for {mod_func}, {rng}...Done")
+def get_settings() -> list:
+    settings = []
 
-print(f"Rank {mpirank}: Calculation Done")
+    for mod_func in modulation_functions:
+        for rng in sweeping_range:
+            settings.append((mod_func, rng))
+
+    return settings
 
-mypotentials  = np.array(mypotentials)
-allpotentials = np.empty((mpisize, *np.shape(mypotentials)), dtype = np.float64)
+# Tags of the master/worker protocol
+TAG_READY = 1
+TAG_TASK  = 2
+
+def get_tiles() -> list:
+    # (setting index, first row, last row + 1) for every setting and tile of z rows
+    tiles = []
 
-# https://stackoverflow.com/a/36082684
-# https://www.kth.se/blogs/pdc/2019/11/parallel-programming-in-python-mpi4py-part-2/
-split_counts  = [np.size(mypotentials)] * mpisize
-displacements = np.insert(np.cumsum(split_counts),0,0)[0:-1]
-comm.Barrier()
+    for i in range(len(get_settings())):
+        for start in range(0, numpoints_z, tile_rows):
+            tiles.append((i, start, min(start + tile_rows, numpoints_z)))
+
+    return tiles
+
+def run_mpi():
+    # Rank 0 hands out tiles of (setting, z rows) on demand, every other rank computes them. 
+    # This balances the load for any number of ranks, and the finished tiles are collected with one Gatherv at the end.
+    comm = MPI.COMM_WORLD
+    mpisize = comm.Get_size()
+    mpirank = comm.Get_rank()
+
+    # With one rank per core, the default of cpu_count numba threads per rank would oversubscribe the node
+    if mpisize > 1:
+        set_jit_threads(threads_per_rank)
+
+    # Only the grid axes are broadcast (a few kB), every rank generates the coordinates of its own tiles
+    axes = generate_axes() if mpirank == 0 else None
+    x, y, z = comm.bcast(axes, root = 0)
+
+    settings = get_settings()
+    tiles    = get_tiles()
+
+    mytiles = []
+    mypotentials = []
+
+    def calculate_tile(tile):
+        i, start, stop = tile
+        mytiles.append(tile)
+        mypotentials.append(calculate_potentials(settings[i], x = x, y = y, z = z, name = f"Rank {mpirank}: ", rows = slice(start, stop)))
+
+    if mpisize == 1:
+        for tile in tiles:
+            calculate_tile(tile)
+    elif mpirank == 0:
+        print(f"Number of tiles = {len(tiles)}")
+
+        status = MPI.Status()
+        # One None per worker to stop them
+        for tile in tiles + [None] * (mpisize - 1):
+            comm.recv(source = MPI.ANY_SOURCE, tag = TAG_READY, status = status)
+            comm.send(tile, dest = status.Get_source(), tag = TAG_TASK)
+    else:
+        while True:
+            comm.send(None, dest = 0, tag = TAG_READY)
+            tile = comm.recv(source = 0, tag = TAG_TASK)
+
+            if tile is None:
+                break
+
+            calculate_tile(tile)
+
+    print(f"Rank {mpirank}: Calculation Done ({len(mytiles)} tiles)")
+
+    if len(mypotentials) > 0:
+        sendbuf = np.concatenate([potentials.ravel() for potentials in mypotentials])
+    else:
+        sendbuf = np.empty(0, dtype = np.float64)
+
+    # The ranks finish different numbers of tiles, so gather the counts and which tiles they are first
+    split_counts = comm.gather(sendbuf.size, root = 0)
+    alltiles     = comm.gather(mytiles, root = 0)
+
+    recvbuf = None
+    if mpirank == 0:
+        assert split_counts is not None
+        # https://stackoverflow.com/a/36082684
+        # https://www.kth.se/blogs/pdc/2019/11/parallel-programming-in-python-mpi4py-part-2/
+        displacements = np.insert(np.cumsum(split_counts),0,0)[0:-1]
+        recvbuf = [np.empty(sum(split_counts), dtype = np.float64), split_counts, displacements, MPI.DOUBLE]
+
+    comm.Gatherv(sendbuf = sendbuf, recvbuf = recvbuf, root = 0)
+
+    if mpirank == 0:
+        assert recvbuf is not None and alltiles is not None
+        allpotentials = np.empty((len(settings), numpoints_z, numpoints_x), dtype = np.float64)
+
+        offset = 0
+        for ranktiles in alltiles:
+            for i, start, stop in ranktiles:
+                size = (stop - start) * numpoints_x
+                allpotentials[i, start:stop] = recvbuf[0][offset:offset + size].reshape((stop - start, numpoints_x))
+                offset += size
+
+        plot_potentials(allpotentials, x = x, z = z)
+
+def run_local(processes = None):
+    x, y, z = generate_axes()
+
+    # The axes are placed into shared memory once, the settings are handed out to the workers as they become free
+    allpotentials = run_shared_pool(
+        function = calculate_potentials, 
+        tasks = get_settings(), 
+        inputs = { "x": x, "y": y, "z": z }, 
+        result_shape = (numpoints_z, numpoints_x),
+        processes = processes)
+
+    plot_potentials(allpotentials, x = x, z = z)
+
+def plot_potentials(allpotentials: np.ndarray, x: np.ndarray, z: np.ndarray):
+    plotter = Plotter(nrows = nrows, ncols = ncols, sharex = 'col', sharey = 'row', squeeze = False, figsize=(figwidth, figheight))
 
-comm.Gatherv(sendbuf = mypotentials, recvbuf = [allpotentials, split_counts, displacements, MPI.DOUBLE], root = 0)
+    assert isinstance(plotter.axs, np.ndarray)
 
-if mpirank == 0:
     minimum_potential = np.amin(allpotentials) # auto-flattens
     maximum_potential = np.amax(allpotentials)
 
-    # https://stackoverflow.com/a/26553855
-    # Flatten the outermost dimension
-    allpotentials = np.reshape(allpotentials, newshape = (-1, *allpotentials.shape[2:]))
     colourmeshes = []
 
     # PLOTTING
@@ -240,4 +297,10 @@ if mpirank == 0:
     # plt.tight_layout()
     # plt.show()
     # plt.savefig("./sweeping_potential_2D.eps", format = 'eps') # bbox_inches='tight'
-    plotter.savefig("./sweeping_potential_2D.pdf", format = 'pdf', dpi = 600)
\ No newline at end of file
+    plotter.savefig("./sweeping_potential_2D.pdf", format = 'pdf', dpi = 600)
+
+if __name__ == "__main__":
+    if MPI is None or "--local" in sys.argv:
+        run_local(processes = local_processes)
+    else:
+        run_mpi()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+# Single-node alternative to the mpi4py scripts
+# The inputs are placed into shared memory once and all workers read from and write into the same buffers
+
+import os
+import numpy as np
+from multiprocessing import get_all_start_methods, get_context, shared_memory
+from typing import Any, Callable, Dict, Sequence, Tuple, Union
+
+from dipoletrapli import set_jit_threads
+
+class SharedArray():
+    def __init__(self, shape: Tuple[int, ...], dtype: Any = np.float64, name: Union[str, None] = None) -> None:
+        """A numpy array backed by multiprocessing shared memory.
+        Creates a new block if no name is given, otherwise attaches to an existing one.
+
+        Args:
+            shape (Tuple[int, ...]): Shape of the array
+            dtype (Any, optional): dtype of the array. Defaults to np.float64.
+            name (Union[str, None], optional): Name of an existing shared memory block. Defaults to None.
+        """
+
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+
+        nbytes = max(1, int(np.prod(self.shape)) * self.dtype.itemsize)
+
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create = True, size = nbytes)
+        else:
+            self.shm = shared_memory.SharedMemory(name = name)
+
+        self.array = np.ndarray(self.shape, dtype = self.dtype, buffer = self.shm.buf)
+
+    @staticmethod
+    def from_array(array: np.ndarray) -> "SharedArray":
+        """Copies an array into a new shared memory block"""
+        shared = SharedArray(shape = array.shape, dtype = array.dtype)
+        shared.array[...] = array
+        return shared
+
+    @property
+    def spec(self) -> Tuple[str, Tuple[int, ...], str]:
+        """Everything a worker needs to attach to the block"""
+        return (self.shm.name, self.shape, self.dtype.str)
+
+    def close(self) -> None:
+        del self.array
+        self.shm.close()
+
+    def unlink(self) -> None:
+        self.shm.unlink()
+
+# Attached in every worker by _attach
+_worker_inputs: Dict[str, SharedArray] = {}
+_worker_output: Union[SharedArray, None] = None
+_worker_function: Union[Callable, None] = None
+
+def _attach(function: Callable, input_specs: Dict[str, Tuple[str, Tuple[int, ...], str]], output_spec: Tuple[str, Tuple[int, ...], str], threads: Union[int, None]) -> None:
+    global _worker_inputs, _worker_output, _worker_function
+
+    set_jit_threads(threads)
+
+    _worker_function = function
+    _worker_inputs   = { key: SharedArray(shape = shape, dtype = dtype, name = name) for key, (name, shape, dtype) in input_specs.items() }
+    _worker_output   = SharedArray(shape = output_spec[1], dtype = output_spec[2], name = output_spec[0])
+
+def _run_task(indexed_task: Tuple[int, Any]) -> int:
+    index, task = indexed_task
+
+    assert _worker_function is not None and _worker_output is not None
+
+    inputs = { key: shared.array for key, shared in _worker_inputs.items() }
+    _worker_output.array[index] = _worker_function(task, **inputs)
+
+    return index
+
+def _start_method() -> str:
+    # forkserver does not exist on Windows
+    return "forkserver" if "forkserver" in get_all_start_methods() else "spawn"
+
+def run_shared_pool(
+        function: Callable,
+        tasks: Sequence[Any],
+        inputs: Dict[str, np.ndarray],
+        result_shape: Tuple[int, ...],
+        processes: Union[int, None] = None,
+        threads_per_worker: Union[int, None] = None,
+        verbose: bool = True
+    ) -> np.ndarray:
+    """Runs function(task, **inputs) for every task on a pool of processes and collects the results into one array.
+
+    The inputs are copied into shared memory once instead of being sent to every worker,
+    and every worker writes its result straight into the shared output.
+    The tasks are handed out one at a time as workers become free, so any number of tasks and processes can be used.
+
+    The workers are never forked from this process: once the parallel numba kernels have run here, their TBB thread pool 
+    makes a forked process hang on exit. They are forked from a fresh forkserver process where available (Linux, macOS) 
+    and spawned otherwise (Windows). Note that function has to be picklable, i.e. defined at the top level of a module,
+    and that a script calling this has to guard its entry point with if __name__ == "__main__".
+
+    Args:
+        function (Callable): Function taking a task and the inputs as keyword arguments, returning an array of shape result_shape
+        tasks (Sequence[Any]): Tasks, e.g. (modulation function, range) settings
+        inputs (Dict[str, np.ndarray]): Large read-only arrays shared between all tasks
+        result_shape (Tuple[int, ...]): Shape of the result of one task
+        processes (Union[int, None], optional): Number of worker processes. Defaults to None (os.cpu_count()).
+        threads_per_worker (Union[int, None], optional): Threads of the parallel numba kernels in every worker, see set_jit_threads. 
+            Defaults to None (1 if there is more than one worker, so the pool does not start cpu_count threads per process).
+        verbose (bool, optional): Print progress. Defaults to True.
+
+    Returns:
+        np.ndarray: Results of shape (len(tasks), *result_shape)
+    """
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    processes = min(processes, max(1, len(tasks)))
+
+    if threads_per_worker is None and processes > 1:
+        threads_per_worker = 1
+
+    shared_inputs = { key: SharedArray.from_array(np.ascontiguousarray(array)) for key, array in inputs.items() }
+    shared_output = SharedArray(shape = (len(tasks), *result_shape), dtype = np.float64)
+
+    try:
+        initargs = (function, { key: shared.spec for key, shared in shared_inputs.items() }, shared_output.spec, threads_per_worker)
+
+        with get_context(_start_method()).Pool(processes = processes, initializer = _attach, initargs = initargs) as pool:
+            for done, index in enumerate(pool.imap_unordered(_run_task, enumerate(tasks), chunksize = 1)):
+                if verbose:
+                    print(f"Task {index} done ({done + 1}/{len(tasks)})")
+
+            # Let the workers exit on their own instead of terminating them
+            pool.close()
+            pool.join()
+
+        results = np.array(shared_output.array)
+    finally:
+        for shared in [*shared_inputs.values(), shared_output]:
+            shared.close()
+            shared.unlink()
+
+    return results
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+
+# Surrogate model of the trap metrics over the design space of the crossed (painted) trap
+# The model is sampled with the grid-free minimum finder, interpolated with radial basis functions and refined where its error is largest
+
+import os
+import numpy as np
+import scipy.interpolate
+import scipy.stats.qmc
+from typing import Any, Dict, NamedTuple, Tuple, Union
+
+from grid_cache import input_hash
+from parameter_sweep import sweep_trap
+from shared_pool import run_shared_pool
+from trap_analysis import find_trap_minimum
+
+# Design parameters the surrogate interpolates over, the power is exact (see TrapSurrogate)
+DESIGN_AXES = ("angle", "deviation", "waist")
+
+DEFAULT_BOUNDS = {
+    "angle":     (5, 20),           # degrees
+    "deviation": (0, 100e-6),       # m
+    "waist":     (15e-6, 50e-6),    # m
+}
+
+# Columns of the sampled metrics at 1 W per beam
+METRICS = ("minimum_potential", "x", "y", "z", "omega_1", "omega_2", "omega_3")
+
+class SurrogatePrediction(NamedTuple):
+    depth: np.ndarray               # Depth of the minimum below the potential far away from the beams   [J]
+    minimum: np.ndarray             # (..., 3) distance of the minimum from the symmetry planes (|x|, |y|, |z|) [m]
+    frequencies: np.ndarray         # (..., 3) angular trap frequencies, ascending, 0 if not confining  [rad/s]
+    depth_error: np.ndarray         # Estimated errors of the above, from the cross-validation of the surrogate
+    minimum_error: np.ndarray
+    frequencies_error: np.ndarray
+
+def _trap_metrics(task: Tuple[float, float, float, Dict[str, Any]]) -> np.ndarray:
+    # Metrics of one design point at 1 W per beam, in the order of METRICS, run by the workers of run_shared_pool
+    angle, deviation, waist, settings = task
+
+    trap = sweep_trap(angle = angle, deviation = deviation, power = 1, waist = waist, **settings)
+    minimum = find_trap_minimum(trap)
+    omega, _ = trap.trap_frequencies(*minimum.position)
+
+    # The trap is mirror symmetric in x and z, which of the mirrored minima is found is arbitrary
+    return np.concatenate([[minimum.potential], np.abs(minimum.position), np.nan_to_num(omega, nan = 0)])
+
+class TrapSurrogate():
+    def __init__(self,
+            bounds: Dict[str, Tuple[float, float]] = DEFAULT_BOUNDS,
+            wavelength: float = 1070e-9,
+            kernel: str = "thin_plate_spline",
+            folds: int = 5,
+            processes: Union[int, None] = None,
+            seed: int = 0,
+            verbose: bool = True,
+            **kwargs
+        ) -> None:
+        """Surrogate of the depth, the minimum position and the trap frequencies of the crossed trap (see parameter_sweep.sweep_trap)
+        over the angle between the beams, the deviation and the waist.
+
+        Every sample is one grid-free minimum search (trap_analysis.find_trap_minimum) at 1 W per beam, the samples are computed with run_shared_pool.
+        The potential is linear in the power, so the power needs no samples: the depth scales with it, the frequencies with its square root,
+        and the minimum does not move. The metrics are interpolated with scipy.interpolate.RBFInterpolator in the unit cube of the bounds.
+        The error estimate is the k-fold cross-validation error at the samples, interpolated (linear RBF) between them.
+
+        The keyword arguments are passed on to sweep_trap (rotation_axis, z_0, Msq, modulation_function, numsamples, polarizability model).
+        A callable modulation_function has to be picklable, and it is not saved with the surrogate, see load.
+
+        Args:
+            bounds (Dict[str, Tuple[float, float]], optional): (lower, upper) of every design parameter of DESIGN_AXES [degrees, m, m]. Defaults to DEFAULT_BOUNDS.
+            wavelength (float, optional): Wavelength of the light [m]. Defaults to 1070e-9.
+            kernel (str, optional): Kernel of the RBFInterpolator. Defaults to "thin_plate_spline".
+            folds (int, optional): Number of folds of the cross-validation. Defaults to 5.
+            processes (Union[int, None], optional): Number of worker processes for the samples, 1 computes in this process. Defaults to None (os.cpu_count()).
+            seed (int, optional): Seed of the sampling. Defaults to 0.
+            verbose (bool, optional): Print progress. Defaults to True.
+        """
+
+        self.bounds = { name: (float(bounds[name][0]), float(bounds[name][1])) for name in DESIGN_AXES }
+        self.lower = np.array([self.bounds[name][0] for name in DESIGN_AXES])
+        self.upper = np.array([self.bounds[name][1] for name in DESIGN_AXES])
+
+        self.settings = { "wavelength": wavelength, **kwargs }
+        self.kernel = kernel
+        self.folds = folds
+        self.processes = processes
+        self.verbose = verbose
+
+        self.rng = np.random.default_rng(seed)
+
+        # Samples in the unit cube and their metrics at 1 W
+        self.points = np.empty((0, len(DESIGN_AXES)))
+        self.values = np.empty((0, len(METRICS)))
+
+        self.interpolator: Union[scipy.interpolate.RBFInterpolator, None] = None
+        self.error_interpolator: Union[scipy.interpolate.RBFInterpolator, None] = None
+        self.cv_errors = np.empty((0, len(METRICS)))
+
+    @property
+    def settings_hash(self) -> str:
+        """Hash of the physical settings, see grid_cache.input_hash"""
+        return input_hash({ "bounds": self.bounds, **self.settings })
+
+    def _to_unit(self, parameters: np.ndarray) -> np.ndarray:
+        return (parameters - self.lower) / np.where(self.upper > self.lower, self.upper - self.lower, 1)
+
+    def _from_unit(self, points: np.ndarray) -> np.ndarray:
+        return self.lower + points * (self.upper - self.lower)
+
+    def _evaluate(self, points: np.ndarray) -> np.ndarray:
+        """Metrics at 1 W of points in the unit cube"""
+        tasks = [(*self._from_unit(point), self.settings) for point in points]
+
+        processes = self.processes if self.processes is not None else (os.cpu_count() or 1)
+
+        if processes == 1:
+            results = []
+            for i, task in enumerate(tasks):
+                if self.verbose:
+                    print(f"Sampling design point {i + 1}/{len(tasks)}...", end = "\r")
+                results.append(_trap_metrics(task))
+            if self.verbose:
+                print(f"Sampling design point {len(tasks)}/{len(tasks)}...Done!")
+            return np.array(results)
+
+        return run_shared_pool(function = _trap_metrics, tasks = tasks, inputs = {}, result_shape = (len(METRICS),), processes = processes, verbose = self.verbose)
+
+    def add_samples(self, points: np.ndarray) -> None:
+        """Samples the model at points in the unit cube and refits"""
+        points = np.atleast_2d(points)
+
+        self.points = np.concatenate([self.points, points])
+        self.values = np.concatenate([self.values, self._evaluate(points)])
+
+        self.fit()
+
+    def sample(self, n: int = 64) -> None:
+        """Samples the model at n Latin hypercube points of the design space and refits"""
+        sampler = scipy.stats.qmc.LatinHypercube(d = len(DESIGN_AXES), seed = self.rng)
+        self.add_samples(sampler.random(n))
+
+    def _interpolator(self, points: np.ndarray, values: np.ndarray, kernel: Union[str, None] = None) -> scipy.interpolate.RBFInterpolator:
+        return scipy.interpolate.RBFInterpolator(points, values, kernel = kernel or self.kernel) # type: ignore
+
+    def fit(self) -> None:
+        """Fits the interpolant to all samples and estimates its error by k-fold cross-validation"""
+        if self.verbose:
+            print("Fitting Surrogate...", end = "\r")
+
+        self.interpolator = self._interpolator(self.points, self.values)
+
+        # Error of every sample when left out with its fold
+        folds = np.array_split(self.rng.permutation(len(self.points)), min(self.folds, len(self.points)))
+        self.cv_errors = np.zeros_like(self.values)
+
+        for fold in folds:
+            train = np.setdiff1d(np.arange(len(self.points)), fold)
+            self.cv_errors[fold] = np.abs(self._interpolator(self.points[train], self.values[train])(self.points[fold]) - self.values[fold])
+
+        self.error_interpolator = self._interpolator(self.points, self.cv_errors, kernel = "linear")
+
+        if self.verbose:
+            print("Fitting Surrogate...Done!")
+
+    def _predict_unit(self, points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        assert self.interpolator is not None and self.error_interpolator is not None, "Sample the surrogate first"
+        return self.interpolator(points), np.maximum(self.error_interpolator(points), 0)
+
+    def predict(self,
+            angle: Union[float, np.ndarray],
+            deviation: Union[float, np.ndarray],
+            power: Union[float, np.ndarray],
+            waist: Union[float, np.ndarray]
+        ) -> SurrogatePrediction:
+        """Trap metrics at design points, broadcast against each other
+
+        Args:
+            angle (Union[float, np.ndarray]): Angle between the beams    [degrees]
+            deviation (Union[float, np.ndarray]): Amplitude of the modulation [m]
+            power (Union[float, np.ndarray]): Power of each beam         [W]
+            waist (Union[float, np.ndarray]): Waist of the beams         [m]
+
+        Returns:
+            SurrogatePrediction: Depth, minimum and trap frequencies with their estimated errors
+        """
+
+        angle, deviation, power, waist = np.broadcast_arrays(*(np.asarray(c, dtype = np.float64) for c in (angle, deviation, power, waist)))
+        shape = angle.shape
+
+        values, errors = self._predict_unit(self._to_unit(np.stack([angle.ravel(), deviation.ravel(), waist.ravel()], axis = -1)))
+
+        # Potential ~ P, minimum independent of P, frequencies ~ sqrt(P)
+        power = power.reshape((-1, 1))
+        scale = np.concatenate([power, np.ones((len(power), 3)), np.repeat(np.sqrt(power), 3, axis = 1)], axis = 1)
+        values, errors = values * scale, errors * scale
+
+        return SurrogatePrediction(
+            depth = -values[:, 0].reshape(shape),
+            minimum = values[:, 1:4].reshape((*shape, 3)),
+            frequencies = values[:, 4:7].reshape((*shape, 3)),
+            depth_error = errors[:, 0].reshape(shape),
+            minimum_error = errors[:, 1:4].reshape((*shape, 3)),
+            frequencies_error = errors[:, 4:7].reshape((*shape, 3)))
+
+    def refine(self, n: int = 16, candidates: int = 4096) -> np.ndarray:
+        """Adds n samples where the estimated error, relative to the spread of every metric, is largest.
+        The samples are picked greedily from Latin hypercube candidates, each at least one sample spacing away from the ones picked before.
+
+        Args:
+            n (int, optional): Number of samples to add. Defaults to 16.
+            candidates (int, optional): Number of candidate points. Defaults to 4096.
+
+        Returns:
+            np.ndarray: Estimated relative error at the added samples before they were added
+        """
+
+        points = scipy.stats.qmc.LatinHypercube(d = len(DESIGN_AXES), seed = self.rng).random(candidates)
+
+        _, errors = self._predict_unit(points)
+        scale = np.ptp(self.values, axis = 0)
+        score = np.max(errors / np.where(scale > 0, scale, 1), axis = 1)
+
+        spacing = (len(self.points) + n) ** (-1 / len(DESIGN_AXES))
+
+        chosen = []
+        for i in np.argsort(score)[::-1]:
+            if all(np.linalg.norm(points[i] - points[j]) >= spacing for j in chosen):
+                chosen.append(i)
+                if len(chosen) == n:
+                    break
+
+        if self.verbose:
+            print(f"Refining at {len(chosen)} points, largest estimated relative error {score[chosen[0]]:.3e}")
+
+        self.add_samples(points[chosen])
+
+        return score[chosen]
+
+    def save(self, filename: str) -> None:
+        """Saves the samples to an .npz file, loading refits the interpolants"""
+        np.savez(filename,
+            points = self.points, values = self.values,
+            lower = self.lower, upper = self.upper,
+            kernel = self.kernel, folds = self.folds,
+            settings_hash = self.settings_hash)
+
+    @staticmethod
+    def load(filename: str, wavelength: float = 1070e-9, processes: Union[int, None] = None, verbose: bool = True, **kwargs) -> "TrapSurrogate":
+        """Loads a surrogate saved with save. The settings (wavelength and the keyword arguments of sweep_trap) have to be given again,
+        as callables cannot be saved, and have to match the saved ones.
+
+        Raises:
+            ValueError: If the settings differ from the saved ones
+        """
+
+        with np.load(filename) as data:
+            bounds = { name: (data["lower"][i], data["upper"][i]) for i, name in enumerate(DESIGN_AXES) }
+
+            surrogate = TrapSurrogate(
+                bounds = bounds, wavelength = wavelength,
+                kernel = str(data["kernel"]), folds = int(data["folds"]),
+                processes = processes, verbose = verbose, **kwargs)
+
+            if surrogate.settings_hash != str(data["settings_hash"]):
+                raise ValueError(f"The settings differ from the ones {filename} was sampled with")
+
+            surrogate.points = data["points"]
+            surrogate.values = data["values"]
+
+        surrogate.fit()
+
+        return surrogate
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+
+# Classical Monte-Carlo trajectories of lithium atoms in the painted trap, with the beams moving along their modulation
+# Checks whether the time-averaged potential is valid at a given painting frequency, see freq_calc.py for the back-of-envelope estimate
+
+import os
+import numpy as np
+import scipy.constants as sc
+from typing import Any, Dict, NamedTuple, Sequence, Tuple, Union
+
+from dipoletrapli import DipoleTrapLi, TrapConfiguration
+from shared_pool import run_shared_pool
+from trap_analysis import find_trap_minimum
+
+class TrajectoryResult(NamedTuple):
+    times: np.ndarray           # Times of the records                                                      [s]
+    mean_energy: np.ndarray     # Mean energy of the atoms that stay trapped, at every record                [J]
+    heating_rate: float         # Slope of a linear fit to mean_energy                                      [J/s]
+    loss_fraction: float        # Fraction of atoms that are no longer bound at the end
+    energies: np.ndarray        # Energy of every atom at the end, in the time-averaged potential           [J]
+    positions: np.ndarray       # (3, n) positions at the end                                               [m]
+    velocities: np.ndarray      # (3, n) velocities at the end                                              [m/s]
+
+class FrequencyScan(NamedTuple):
+    frequencies: np.ndarray     # Painting frequencies                                                      [Hz]
+    heating_rate: np.ndarray    # Heating rate at every frequency                                           [J/s]
+    loss_fraction: np.ndarray   # Loss fraction at every frequency
+    energies: np.ndarray        # (len(frequencies), n) energy of every atom at the end                     [J]
+
+def potential_gradient(
+        trap: TrapConfiguration,
+        x: np.ndarray, y: np.ndarray, z: np.ndarray,
+        phase: float
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Analytic gradient of the instantaneous potential, with every painted beam at deviation * modulation(phase) along its x axis.
+    Only the gradient is evaluated (TrapConfiguration.potential_derivatives of order 1), which is all the integrator needs.
+
+    Args:
+        trap (TrapConfiguration): The trap
+        x (np.ndarray): x-coordinates of the points     [m]
+        y (np.ndarray): y-coordinates of the points     [m]
+        z (np.ndarray): z-coordinates of the points     [m]
+        phase (float): Time in units of the modulation period, i.e. the argument t of the modulation functions
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: Components of the gradient in the grid frame [J/m]
+    """
+
+    _, gradient, _ = trap.potential_derivatives(x = x, y = y, z = z, order = 1, phase = phase)
+
+    return gradient[..., 0], gradient[..., 1], gradient[..., 2]
+
+def thermal_ensemble(
+        trap: TrapConfiguration,
+        temperature: float,
+        n: int,
+        mass: float = DipoleTrapLi.LI6_MASS,
+        seed: Union[int, None] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+    """Samples a thermal cloud in the harmonic approximation around the minimum of the (time-averaged) trap, see find_trap_minimum
+
+    Args:
+        trap (TrapConfiguration): The trap
+        temperature (float): Temperature of the cloud [K]
+        n (int): Number of atoms
+        mass (float, optional): Mass of an atom [kg]. Defaults to DipoleTrapLi.LI6_MASS.
+        seed (Union[int, None], optional): Seed of the random numbers. Defaults to None.
+
+    Raises:
+        ValueError: If the trap does not confine along all three axes
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (3, n) positions [m] and velocities [m/s]
+    """
+
+    rng = np.random.default_rng(seed)
+
+    minimum = find_trap_minimum(trap)
+    omega, axes = trap.trap_frequencies(*minimum.position, mass = mass)
+
+    if not np.all(omega > 0):
+        raise ValueError(f"The trap does not confine along all axes at its minimum, trap frequencies {omega} rad/s")
+
+    # Gaussian along every principal axis, width sqrt(k_B T / (m omega^2)), and Maxwell-Boltzmann velocities
+    sigma = np.sqrt(sc.Boltzmann * temperature / mass) / omega
+    positions = minimum.position[:, np.newaxis] + axes @ (sigma[:, np.newaxis] * rng.standard_normal((3, n)))
+    velocities = np.sqrt(sc.Boltzmann * temperature / mass) * rng.standard_normal((3, n))
+
+    return positions, velocities
+
+def _energies(trap: TrapConfiguration, positions: np.ndarray, velocities: np.ndarray, mass: float) -> np.ndarray:
+    # Kinetic energy plus the time-averaged potential, the energy of the effective static trap
+    return 0.5 * mass * np.sum(velocities**2, axis = 0) + trap.potential_points(x = positions[0], y = positions[1], z = positions[2])
+
+def _evolve(task: Tuple[int, int, TrapConfiguration, Dict[str, Any]], positions: np.ndarray, velocities: np.ndarray) -> np.ndarray:
+    """Velocity Verlet for the atoms start to start + chunk, run by the workers of run_shared_pool.
+    Returns the final positions and velocities and the energy of every atom at every record, as (6 + records, chunk)"""
+    start, chunk, trap, settings = task
+    frequency, dt, numsteps, record_steps, mass = (settings[key] for key in ("frequency", "dt", "numsteps", "record_steps", "mass"))
+
+    # Struct of arrays, updated in place
+    x, y, z = (np.array(positions[i, start:start + chunk]) for i in range(3))
+    vx, vy, vz = (np.array(velocities[i, start:start + chunk]) for i in range(3))
+
+    out = np.empty((6 + len(record_steps), chunk))
+    record = 0
+
+    def record_energies() -> None:
+        nonlocal record
+        out[6 + record] = _energies(trap, np.stack([x, y, z]), np.stack([vx, vy, vz]), mass)
+        record += 1
+
+    gx, gy, gz = potential_gradient(trap, x, y, z, phase = 0)
+
+    if record < len(record_steps) and record_steps[record] == 0:
+        record_energies()
+
+    for step in range(1, numsteps + 1):
+        # Kick, drift, kick with the force at the new time
+        vx -= gx * (dt / (2 * mass)); vy -= gy * (dt / (2 * mass)); vz -= gz * (dt / (2 * mass))
+        x += vx * dt; y += vy * dt; z += vz * dt
+
+        gx, gy, gz = potential_gradient(trap, x, y, z, phase = (frequency * step * dt) % 1)
+
+        vx -= gx * (dt / (2 * mass)); vy -= gy * (dt / (2 * mass)); vz -= gz * (dt / (2 * mass))
+
+        if record < len(record_steps) and record_steps[record] == step:
+            record_energies()
+
+    out[:6] = np.stack([x, y, z, vx, vy, vz])
+
+    return out
+
+def simulate(
+        trap: TrapConfiguration,
+        positions: np.ndarray,
+        velocities: np.ndarray,
+        frequency: float,
+        duration: float,
+        steps_per_period: int = 32,
+        steps_per_oscillation: int = 64,
+        records: int = 11,
+        mass: float = DipoleTrapLi.LI6_MASS,
+        chunk: int = 4096,
+        processes: Union[int, None] = None,
+        verbose: bool = True
+    ) -> TrajectoryResult:
+    """Evolves atoms in the instantaneous potential of the trap, with every painted beam moving along its modulation at the painting frequency.
+
+    The atoms are integrated with velocity Verlet (symplectic) in struct-of-arrays form, with the analytic force of potential_gradient.
+    The time step resolves both the modulation (steps_per_period) and the fastest trap oscillation of the time-averaged trap (steps_per_oscillation).
+    Chunks of atoms are evolved in parallel with run_shared_pool. The energies are taken in the time-averaged potential,
+    so if the time average is valid they are conserved, and the heating rate is the slope of the mean energy of the atoms that stay bound.
+    An atom is lost when its energy is no longer negative, i.e. when it is not bound by the time-averaged trap anymore.
+
+    Args:
+        trap (TrapConfiguration): The trap
+        positions (np.ndarray): (3, n) initial positions, e.g. from thermal_ensemble [m]
+        velocities (np.ndarray): (3, n) initial velocities [m/s]
+        frequency (float): Painting frequency [Hz]
+        duration (float): Duration of the simulation [s]
+        steps_per_period (int, optional): Time steps per modulation period. Defaults to 32.
+        steps_per_oscillation (int, optional): Time steps per period of the fastest trap oscillation. Defaults to 64.
+        records (int, optional): Number of evenly spaced records of the energies, including the start and the end. Defaults to 11.
+        mass (float, optional): Mass of an atom [kg]. Defaults to DipoleTrapLi.LI6_MASS.
+        chunk (int, optional): Number of atoms per task. Defaults to 4096.
+        processes (Union[int, None], optional): Number of worker processes, 1 computes in this process. Defaults to None (os.cpu_count()).
+        verbose (bool, optional): Print progress. Defaults to True.
+
+    Returns:
+        TrajectoryResult: Energies, heating rate and losses
+    """
+
+    positions = np.asarray(positions, dtype = np.float64)
+    velocities = np.asarray(velocities, dtype = np.float64)
+    n = positions.shape[1]
+
+    minimum = find_trap_minimum(trap)
+    omega, _ = trap.trap_frequencies(*minimum.position, mass = mass)
+
+    dt = 2 * np.pi / (np.nanmax(omega) * steps_per_oscillation)
+    if frequency > 0:
+        dt = min(dt, 1 / (frequency * steps_per_period))
+
+    numsteps = int(np.ceil(duration / dt))
+    record_steps = np.unique(np.rint(np.linspace(start = 0, stop = numsteps, num = records)).astype(np.int64))
+
+    if verbose:
+        print(f"Simulating {n} atoms for {numsteps} steps of {dt:.3e} s")
+
+    # Pad to whole chunks with copies of the last atom, dropped again below
+    chunk = min(chunk, n)
+    numchunks = int(np.ceil(n / chunk))
+    padding = numchunks * chunk - n
+    padded_positions = np.concatenate([positions, np.repeat(positions[:, -1:], padding, axis = 1)], axis = 1)
+    padded_velocities = np.concatenate([velocities, np.repeat(velocities[:, -1:], padding, axis = 1)], axis = 1)
+
+    settings = { "frequency": frequency, "dt": dt, "numsteps": numsteps, "record_steps": record_steps, "mass": mass }
+    tasks = [(i * chunk, chunk, trap, settings) for i in range(numchunks)]
+
+    processes = processes if processes is not None else (os.cpu_count() or 1)
+
+    if processes == 1:
+        results = np.array([_evolve(task, positions = padded_positions, velocities = padded_velocities) for task in tasks])
+    else:
+        results = run_shared_pool(
+            function = _evolve,
+            tasks = tasks,
+            inputs = { "positions": padded_positions, "velocities": padded_velocities },
+            result_shape = (6 + len(record_steps), chunk),
+            processes = processes,
+            verbose = verbose)
+
+    # (6 + records, n)
+    results = np.concatenate(list(results), axis = 1)[:, :n]
+    history = results[6:]
+
+    trapped = history[-1] < 0
+    mean_energy = np.mean(history[:, trapped], axis = 1) if np.any(trapped) else np.full(len(record_steps), np.nan)
+    times = record_steps * dt
+
+    heating_rate = float(np.polyfit(times, mean_energy, 1)[0]) if np.any(trapped) and len(times) > 1 else np.nan
+
+    return TrajectoryResult(
+        times = times,
+        mean_energy = mean_energy,
+        heating_rate = heating_rate,
+        loss_fraction = 1 - np.count_nonzero(trapped) / n,
+        energies = history[-1],
+        positions = results[:3],
+        velocities = results[3:6])
+
+def frequency_scan(
+        trap: TrapConfiguration,
+        frequencies: Sequence[float],
+        temperature: float,
+        n: int,
+        duration: float,
+        seed: Union[int, None] = 0,
+        verbose: bool = True,
+        **kwargs
+    ) -> FrequencyScan:
+    """Heating rate, loss fraction and energy distribution of the same thermal cloud (see thermal_ensemble) at every painting frequency.
+    The keyword arguments are passed on to simulate.
+
+    Args:
+        trap (TrapConfiguration): The trap
+        frequencies (Sequence[float]): Painting frequencies [Hz]
+        temperature (float): Temperature of the initial cloud [K]
+        n (int): Number of atoms
+        duration (float): Duration of every simulation [s]
+        seed (Union[int, None], optional): Seed of the initial cloud. Defaults to 0.
+        verbose (bool, optional): Print progress. Defaults to True.
+
+    Returns:
+        FrequencyScan: Heating rates, loss fractions and final energies
+    """
+
+    positions, velocities = thermal_ensemble(trap, temperature = temperature, n = n, mass = kwargs.get("mass", DipoleTrapLi.LI6_MASS), seed = seed)
+
+    results = []
+    for frequency in frequencies:
+        if verbose:
+            print(f"Simulating at {frequency:.3e} Hz...")
+        results.append(simulate(trap, positions = positions, velocities = velocities, frequency = frequency, duration = duration, verbose = verbose, **kwargs))
+
+    return FrequencyScan(
+        frequencies = np.asarray(frequencies, dtype = np.float64),
+        heating_rate = np.array([result.heating_rate for result in results]),
+        loss_fraction = np.array([result.loss_fraction for result in results]),
+        energies = np.array([result.energies for result in results]))
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+
+# Trap depth as the height of the escape barrier instead of the global minimum of the potential
+
+import numpy as np
+import scipy.constants as sc
+import scipy.ndimage
+import scipy.optimize
+import scipy.special
+from typing import NamedTuple, Sequence, Tuple, Union
+
+from dipoletrapli import DipoleTrapLi, TrapConfiguration
+
+class TrapDepth(NamedTuple):
+    minimum: np.ndarray     # (x, y, z) of the minimum                      [m]
+    saddle: np.ndarray      # (x, y, z) of the lowest escape saddle         [m]
+    minimum_potential: float  #                                             [J]
+    saddle_potential: float   #                                             [J]
+    depth: float            # saddle_potential - minimum_potential          [J]
+    on_boundary: bool       # The escape point lies on the edge of the grid, i.e. the grid is too small to contain the saddle
+
+class TrapMinimum(NamedTuple):
+    position: np.ndarray    # (x, y, z) of the minimum                      [m]
+    potential: float        # Potential at the minimum                      [J]
+    depth: float            # -potential, the depth of the minimum below the potential far away from the beams [J]
+    iterations: int         # Number of Newton steps (or optimiser iterations for the fallback)
+    converged: bool
+    gradient_norm: float    # |grad U| at the position                      [J/m]
+
+class ThermalLoading(NamedTuple):
+    temperatures: np.ndarray        # Temperatures of the cloud                                                         [K]
+    minimum_potential: float        # Minimum of the potential on the grid                                              [J]
+    log_partition: np.ndarray       # log of the integral of exp(-U / k_B T) over the grid, with the volume in m^3 (m^2 for a plane)
+    effective_volume: np.ndarray    # Integral of exp(-(U - U_min) / k_B T), i.e. the volume (area) of a uniform cloud at the peak density [m^3, m^2]
+    peak_density: np.ndarray        # atom_number / effective_volume                                                    [m^-3, m^-2]
+    captured_fraction: np.ndarray   # Fraction of the thermal cloud with an energy below the escape potential
+
+def _touches_boundary(mask: np.ndarray, index: Tuple[int, ...]) -> bool:
+    # Whether the connected region of mask containing index reaches the edge of the grid
+    labels, _ = scipy.ndimage.label(mask)
+    label = labels[index]
+
+    for axis in range(labels.ndim):
+        for edge in (0, -1):
+            if np.any(np.take(labels, edge, axis = axis) == label):
+                return True
+
+    return False
+
+def escape_saddle(potential: np.ndarray) -> Tuple[Tuple[int, ...], Tuple[int, ...]]:
+    """Finds the global minimum of a potential on a grid and the lowest point over which the region around it can be left,
+    i.e. the lowest level at which the sublevel set {potential <= level} connects the minimum to the edge of the grid.
+
+    The level is found by bisection over the sorted values of the potential, each step labelling the connected regions
+    of the sublevel set (scipy.ndimage.label, O(N)), so this takes O(N log N) in total.
+
+    Args:
+        potential (np.ndarray): Potential on a 2D or 3D grid
+
+    Returns:
+        Tuple[Tuple[int, ...], Tuple[int, ...]]: Grid indices of the minimum and of the escape saddle
+    """
+
+    potential = np.asarray(potential)
+    minimum = np.unravel_index(np.argmin(potential), potential.shape)
+
+    edge_minimum = min(np.take(potential, edge, axis = axis).min() for axis in range(potential.ndim) for edge in (0, -1))
+
+    # The lowest value on the edge splits the candidates, usually the region already reaches the edge there
+    if _touches_boundary(potential <= edge_minimum, minimum):
+        values = np.sort(potential[potential <= edge_minimum], axis = None)
+    else:
+        values = np.sort(potential[potential > edge_minimum], axis = None)
+
+    lo, hi = 0, len(values) - 1
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if _touches_boundary(potential <= values[mid], minimum):
+            hi = mid
+        else:
+            lo = mid + 1
+
+    level = values[lo]
+
+    # The saddle is the point at the escape level that joined the region of the minimum
+    labels, _ = scipy.ndimage.label(potential <= level)
+    candidates = np.flatnonzero((potential == level) & (labels == labels[minimum]))
+    saddle = np.unravel_index(candidates[0], potential.shape)
+
+    return tuple(int(i) for i in minimum), tuple(int(i) for i in saddle)
+
+def _refine(
+        function,
+        start: np.ndarray,
+        scale: np.ndarray,
+        free: np.ndarray
+    ) -> np.ndarray:
+    # Nelder-Mead in coordinates scaled to the grid spacing, within two grid cells of the start
+    def scaled(u: np.ndarray) -> float:
+        point = start.copy()
+        point[free] += u * scale[free]
+        return float(function(point))
+
+    bounds = [(-2, 2)] * int(np.count_nonzero(free))
+    result = scipy.optimize.minimize(scaled, np.zeros(len(bounds)), method = "Nelder-Mead", bounds = bounds, options = { "xatol": 1e-4, "fatol": 1e-14 })
+
+    point = start.copy()
+    point[free] += result.x * scale[free]
+
+    return point
+
+def trap_depth(
+        trap: TrapConfiguration,
+        x: np.ndarray, y: Union[float, np.ndarray], z: np.ndarray,
+        potential: Union[np.ndarray, None] = None,
+        refine: bool = True,
+        verbose: bool = True
+    ) -> TrapDepth:
+    """Trap depth of a trap as the height of its lowest escape saddle above its minimum.
+
+    The minimum and the saddle are located on the grid with escape_saddle, then refined on the potential of the trap itself
+    (TrapConfiguration.potential_points): the minimum by minimising the potential, the saddle by minimising the squared gradient,
+    both within two grid cells of the grid points. For a single y value the refinement stays in the x-z plane.
+
+    Args:
+        trap (TrapConfiguration): The trap
+        x (np.ndarray): Evenly spaced grid axis x                                       [m]
+        y (Union[float, np.ndarray]): Evenly spaced grid axis y, or a single value     [m]
+        z (np.ndarray): Evenly spaced grid axis z                                       [m]
+        potential (Union[np.ndarray, None], optional): Potential of the trap on the grid, in the layout of TrapConfiguration.potential_grid.
+            Defaults to None (computed).
+        refine (bool, optional): Refine the grid points. Defaults to True.
+        verbose (bool, optional): Print progress. Defaults to True.
+
+    Returns:
+        TrapDepth: Positions and potentials of the minimum and the saddle, and the depth [m, J]
+    """
+
+    x = np.asarray(x, dtype = np.float64)
+    y = np.atleast_1d(np.asarray(y, dtype = np.float64))
+    z = np.asarray(z, dtype = np.float64)
+
+    if potential is None:
+        potential = trap.potential_grid(x = x, y = y, z = z, verbose = verbose)
+
+    # Always work in the (len(z), len(y), len(x)) layout
+    potential = np.asarray(potential).reshape((len(z), len(y), len(x)))
+
+    if verbose:
+        print("Finding Escape Saddle...", end = "\r")
+
+    # A single y value is a 2D problem, label it as such so the saddle is searched in the plane
+    minimum_index, saddle_index = escape_saddle(potential[:, 0, :] if len(y) == 1 else potential)
+    if len(y) == 1:
+        minimum_index = (minimum_index[0], 0, minimum_index[1])
+        saddle_index = (saddle_index[0], 0, saddle_index[1])
+
+    on_boundary = any(i in (0, n - 1) for i, n in zip(saddle_index, potential.shape) if n > 1)
+
+    def grid_point(index: Tuple[int, ...]) -> np.ndarray:
+        return np.array([x[index[2]], y[index[1]], z[index[0]]])
+
+    minimum = grid_point(minimum_index)
+    saddle = grid_point(saddle_index)
+
+    if refine:
+        def U(point: np.ndarray) -> float:
+            return float(trap.potential_points(x = point[0], y = point[1], z = point[2]))
+
+        # The optimisers work on the potential in units of the grid minimum and on coordinates in units of the grid spacing
+        norm = abs(float(potential[minimum_index]))
+        spacing = np.array([np.ptp(axis) / (len(axis) - 1) if len(axis) > 1 else 0 for axis in (x, y, z)])
+        free = spacing > 0
+
+        def normalised(point: np.ndarray) -> float:
+            return U(point) / norm
+
+        def squared_gradient(point: np.ndarray) -> float:
+            # Central differences at a hundredth of the grid spacing
+            gradient = [(normalised(point + h) - normalised(point - h)) / 0.02 for i, h in enumerate(np.diag(spacing / 100)) if free[i]]
+            return float(np.sum(np.square(gradient)))
+
+        minimum = _refine(normalised, minimum, spacing, free)
+
+        if not on_boundary:
+            saddle = _refine(squared_gradient, saddle, spacing, free)
+
+        minimum_potential = U(minimum)
+        saddle_potential = U(saddle)
+    else:
+        minimum_potential = float(potential[minimum_index])
+        saddle_potential = float(potential[saddle_index])
+
+    if verbose:
+        print("Finding Escape Saddle...Done!")
+
+    return TrapDepth(
+        minimum = minimum, saddle = saddle,
+        minimum_potential = minimum_potential, saddle_potential = saddle_potential,
+        depth = saddle_potential - minimum_potential,
+        on_boundary = on_boundary)
+
+def _newton(trap: TrapConfiguration, point: np.ndarray, powers: Union[Sequence[float], None], xtol: float, max_iterations: int) -> Tuple[np.ndarray, int, bool]:
+    # Newton steps where the Hessian is positive definite, steps along the direction of most negative curvature elsewhere (e.g. on a saddle),
+    # both with a backtracking line search. Returns the point, the number of steps and whether it converged (False also if the line search failed)
+    for iteration in range(1, max_iterations + 1):
+        U, gradient, hessian = trap.potential_derivatives(x = point[0], y = point[1], z = point[2], powers = powers)
+        eigenvalues, eigenvectors = np.linalg.eigh(hessian)
+
+        if eigenvalues[0] > 0:
+            step = -np.linalg.solve(hessian, gradient)
+        else:
+            # Length at which the quadratic model has dropped by |U|, i.e. roughly a beam width
+            direction = eigenvectors[:, 0] * (-np.sign(gradient @ eigenvectors[:, 0]) or 1)
+            step = direction * np.sqrt(2 * abs(U) / max(abs(eigenvalues[0]), np.finfo(float).tiny))
+
+        # Allow for rounding errors once the steps approach machine precision
+        tolerance = 1e-13 * abs(U)
+
+        t = 1.0
+        while t > 1e-6 and trap.potential_points(*(point + t * step), powers = powers) > U + tolerance:
+            t /= 2
+
+        if t <= 1e-6:
+            return point, iteration, False
+
+        point = point + t * step
+
+        if eigenvalues[0] > 0 and np.linalg.norm(t * step) < xtol:
+            return point, iteration, True
+
+    return point, max_iterations, False
+
+def find_trap_minimum(
+        trap: TrapConfiguration,
+        start: Union[np.ndarray, None] = None,
+        powers: Union[Sequence[float], None] = None,
+        xtol: float = 1e-12,
+        max_iterations: int = 50
+    ) -> TrapMinimum:
+    """Finds the minimum of the potential of a trap directly on the analytic model, without a grid.
+
+    Uses Newton steps with the analytic gradient and Hessian (TrapConfiguration.potential_derivatives) and a backtracking line search. 
+    Where the Hessian is not positive definite, e.g. on the saddle between the two lobes of a widely painted trap, 
+    it steps along the direction of most negative curvature instead. If the line search fails, BFGS with the analytic gradient takes over
+    and Newton polishes its result. The default start at the origin is the symmetric point of the usual crossed and painted configurations.
+
+    Args:
+        trap (TrapConfiguration): The trap
+        start (Union[np.ndarray, None], optional): (x, y, z) to start from [m]. Defaults to None (the origin).
+        powers (Union[Sequence[float], None], optional): Power of every beam [W]. Defaults to None (the powers of the beams).
+        xtol (float, optional): Stop once a Newton step is shorter than this [m]. Defaults to 1e-12.
+        max_iterations (int, optional): Maximum number of Newton steps. Defaults to 50.
+
+    Returns:
+        TrapMinimum: Position, potential and depth of the minimum with the convergence information
+    """
+
+    point = np.zeros(3) if start is None else np.array(start, dtype = np.float64)
+
+    point, iterations, converged = _newton(trap, point = point, powers = powers, xtol = xtol, max_iterations = max_iterations)
+
+    if not converged:
+        # Fallback, in units of micrometres so the optimiser sees numbers of order one
+        scale = 1e-6
+        norm = abs(float(trap.potential_points(*point, powers = powers))) or 1.0
+
+        def fun(u: np.ndarray) -> Tuple[float, np.ndarray]:
+            U, gradient, _ = trap.potential_derivatives(x = u[0] * scale, y = u[1] * scale, z = u[2] * scale, powers = powers)
+            return float(U) / norm, gradient * scale / norm
+
+        optimised = scipy.optimize.minimize(fun, point / scale, jac = True, method = "BFGS")
+
+        point, polish_iterations, converged = _newton(trap, point = optimised.x * scale, powers = powers, xtol = xtol, max_iterations = max_iterations)
+        iterations += optimised.nit + polish_iterations
+
+    U, gradient, _ = trap.potential_derivatives(x = point[0], y = point[1], z = point[2], powers = powers)
+
+    return TrapMinimum(
+        position = point, potential = float(U), depth = -float(U), 
+        iterations = iterations, converged = converged, gradient_norm = float(np.linalg.norm(gradient)))
+
+def thermal_loading(
+        potential: np.ndarray,
+        x: np.ndarray, y: Union[float, np.ndarray], z: np.ndarray,
+        temperatures: Union[float, Sequence[float]],
+        escape_potential: float = 0,
+        atom_number: float = 1,
+        max_bytes: Union[int, None] = None,
+        verbose: bool = True
+    ) -> ThermalLoading:
+    """Loads a thermal cloud into a computed potential: effective volume, peak density and captured fraction for a list of temperatures.
+
+    All Boltzmann factors exp(-U / k_B T) are summed in one pass over slabs of z rows, for all temperatures at once. The sums are kept as a
+    log-sum-exp relative to the running minimum of the potential, so they do not overflow for trap depths of many k_B T, 
+    and the potential can be a memory-mapped volume (see TrapConfiguration.potential_volume) that does not fit into memory.
+
+    The captured fraction weighs every cell with the fraction of the Maxwell-Boltzmann distribution whose kinetic energy 
+    is below escape_potential - U, which is the regularized lower incomplete gamma function P(3/2, (escape_potential - U) / k_B T).
+
+    Args:
+        potential (np.ndarray): Potential in the layout of TrapConfiguration.potential_grid, (len(z), len(x)) or (len(z), len(y), len(x)) [J]
+        x (np.ndarray): Evenly spaced grid axis x                                       [m]
+        y (Union[float, np.ndarray]): Evenly spaced grid axis y, or a single value     [m]
+        z (np.ndarray): Evenly spaced grid axis z                                       [m]
+        temperatures (Union[float, Sequence[float]]): Temperatures of the cloud         [K]
+        escape_potential (float, optional): Energy above which an atom escapes, e.g. the saddle potential of trap_depth [J]. Defaults to 0 (far away from the beams).
+        atom_number (float, optional): Number of atoms for the peak density. Defaults to 1.
+        max_bytes (Union[int, None], optional): Memory budget for the temporaries of one slab [bytes]. Defaults to None (DipoleTrapLi.GRID_TILE_BYTES).
+        verbose (bool, optional): Print progress. Defaults to True.
+
+    Returns:
+        ThermalLoading: Effective volume, peak density and captured fraction for every temperature
+    """
+
+    x = np.asarray(x, dtype = np.float64)
+    y = np.atleast_1d(np.asarray(y, dtype = np.float64))
+    z = np.asarray(z, dtype = np.float64)
+
+    temperatures = np.atleast_1d(np.asarray(temperatures, dtype = np.float64))
+    beta = 1 / (sc.Boltzmann * temperatures)
+
+    # Volume (area for a single y) of a grid cell
+    cell = float(np.prod([np.ptp(axis) / (len(axis) - 1) for axis in (x, y, z) if len(axis) > 1]))
+
+    if max_bytes is None:
+        max_bytes = DipoleTrapLi.GRID_TILE_BYTES
+
+    row_points = int(np.prod(potential.shape[1:]))
+    rows_per_slab = max(1, max_bytes // (3 * 8 * row_points * len(temperatures)))
+
+    # Running minimum of the potential, and the sums of exp(-beta (U - minimum)) over all cells and weighted with the captured fraction
+    minimum = np.inf
+    total = np.zeros(len(temperatures))
+    captured = np.zeros(len(temperatures))
+
+    for start in range(0, potential.shape[0], rows_per_slab):
+        if verbose:
+            print(f"Integrating Boltzmann Factors (rows {start}/{potential.shape[0]})...", end = "\r")
+
+        slab = np.asarray(potential[start:start + rows_per_slab], dtype = np.float64).ravel()
+
+        slab_minimum = float(slab.min())
+        if slab_minimum < minimum:
+            # Rescale the sums to the new reference
+            if np.isfinite(minimum):
+                total *= np.exp(-beta * (minimum - slab_minimum))
+                captured *= np.exp(-beta * (minimum - slab_minimum))
+            minimum = slab_minimum
+
+        # (len(slab), len(temperatures))
+        exponent = -np.outer(slab - minimum, beta)
+        boltzmann = np.exp(exponent)
+        total += np.sum(boltzmann, axis = 0)
+
+        bound = slab < escape_potential
+        kinetic = np.outer(escape_potential - slab[bound], beta)
+        captured += np.sum(boltzmann[bound] * scipy.special.gammainc(1.5, kinetic), axis = 0)
+
+    if verbose:
+        print(f"Integrating Boltzmann Factors (rows {potential.shape[0]}/{potential.shape[0]})...Done!")
+
+    effective_volume = total * cell
+
+    return ThermalLoading(
+        temperatures = temperatures,
+        minimum_potential = minimum,
+        log_partition = np.log(effective_volume) - beta * minimum,
+        effective_volume = effective_volume,
+        peak_density = atom_number / effective_volume,
+        captured_fraction = captured / total)